@@ -0,0 +1,86 @@
+# Per-assignment statistics computed with NumPy
+#
+# Grades come straight from the submission.grade column and per-question results
+# from the extracted answer rows, so no submission document is loaded or parsed.
+# app.py stores the results in assignment_stats and recomputes a part only after
+# a change has invalidated it.
+import re
+
+import numpy as np
+
+import autograde
+
+# Grade distribution buckets: 0-10, 10-20, ..., 90-100 (100 is in the last one)
+GRADE_BINS = np.arange(0, 101, 10)
+# Worksheets without an answer key report on at most this many fields
+MAX_QUESTIONS = 200
+
+
+def natural_key(question_key):
+    """Sort q2 before q10"""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', question_key)]
+
+
+def _round(value):
+    return None if value is None or np.isnan(value) else round(float(value), 2)
+
+
+def completion_rate(submitted, allocated):
+    return _round(min(submitted / allocated, 1.0)) if allocated else None
+
+
+def grade_statistics(grades):
+    """Summary of the grade of every submission (None when ungraded)"""
+    grades = np.array([np.nan if g is None else g for g in grades], dtype=np.float64)
+    values = grades[~np.isnan(grades)]
+    counts, _ = np.histogram(np.clip(values, 0, 100), bins=GRADE_BINS)
+    has_grades = values.size > 0
+    return {
+        'submitted': int(grades.size),
+        'graded': int(values.size),
+        'mean': _round(values.mean()) if has_grades else None,
+        'median': _round(np.median(values)) if has_grades else None,
+        'std': _round(values.std()) if has_grades else None,
+        'min': _round(values.min()) if has_grades else None,
+        'max': _round(values.max()) if has_grades else None,
+        'distribution': [
+            {'range': f'{int(low)}-{int(high)}', 'count': int(count)}
+            for low, high, count in zip(GRADE_BINS[:-1], GRADE_BINS[1:], counts)
+        ],
+    }
+
+
+def question_statistics(answer_key, answer_rows, submission_ids, question_keys=()):
+    """Per-question answer and success rates across submission_ids
+
+    With an answer key every keyed question is reported with the fraction of
+    submissions that got it right; otherwise the fields in `question_keys` are
+    reported with how often they were answered.
+    """
+    if answer_key:
+        questions = sorted(answer_key, key=natural_key)
+    else:
+        questions = sorted(set(question_keys), key=natural_key)[:MAX_QUESTIONS]
+    codes = {}
+    expected = autograde.key_vector(answer_key, questions, codes) if answer_key else None
+    matrix = autograde.response_matrix(questions, answer_rows, submission_ids, codes)
+
+    if not submission_ids:
+        return [{'question': q, 'answered_rate': None, 'correct_rate': None, 'most_common': None} for q in questions]
+    answered = (matrix != 0).mean(axis=0)
+    correct = (matrix == expected).mean(axis=0) if answer_key else None
+
+    # Most common answer per question: count codes column by column
+    names = {code: value for value, code in codes.items()}
+    most_common = []
+    for j in range(len(questions)):
+        counts = np.bincount(matrix[:, j], minlength=1)
+        counts[0] = 0  # Unanswered
+        most_common.append(names[int(counts.argmax())] if counts.any() else None)
+
+    return [{
+        'question': question,
+        'answered_rate': _round(answered[j]),
+        'correct_rate': _round(correct[j]) if correct is not None else None,
+        'most_common': most_common[j],
+    } for j, question in enumerate(questions)]
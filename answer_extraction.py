@@ -0,0 +1,158 @@
+# Extraction of student answers from submitted worksheet HTML
+#
+# Before submitting, interactive_assignment.html writes each field's state into the
+# markup: value attributes on inputs, checked on ticked checkboxes and radios, the
+# text of textareas and selected on chosen options. Multiple-choice worksheets
+# built from clickable elements instead mark the chosen one with a "selected"
+# class and carry its letter in data-answer; that is recorded as a "choice" for
+# the nearest enclosing element with an id (the question). extract_answers() reads
+# all of this back with a streaming parser (no DOM is built) and returns one
+# Answer per field in document order.
+from collections import namedtuple
+from html.parser import HTMLParser
+
+# Bump when extraction changes so stored answers are re-extracted by the backfill
+EXTRACTOR_VERSION = 2
+
+# Feed documents to the parser in pieces of this many characters
+CHUNK_SIZE = 16 * 1024
+
+Answer = namedtuple('Answer', ['position', 'question_key', 'element_type', 'value'])
+
+# Inputs that are not answered by the student
+IGNORED_INPUT_TYPES = {'button', 'submit', 'reset', 'image', 'file', 'hidden'}
+
+FORM_FIELDS = {'input', 'textarea', 'select', 'option'}
+# Elements without end tags, which never enclose a question
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+                 'meta', 'param', 'source', 'track', 'wbr'}
+
+
+class AnswerParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.answers = []
+        # Correct answers declared on form fields with data-answer, by question key
+        self.answer_key = {}
+        self.element_ids = set()
+        self._unnamed = {}
+        self._open = []  # (tag, id) of enclosing elements
+        self._textarea = None
+        self._select = None
+        self._option = None
+
+    def _key(self, attrs, tag, group=False):
+        # Radio and checkbox groups are one question, named by their shared name
+        first, second = ('name', 'id') if group else ('id', 'name')
+        key = attrs.get(first) or attrs.get(second)
+        if key:
+            return key[:255]
+        self._unnamed[tag] = self._unnamed.get(tag, 0) + 1
+        return f'{tag}-{self._unnamed[tag]}'
+
+    def _add(self, key, element_type, value):
+        self.answers.append(Answer(len(self.answers), key, element_type, value))
+
+    def _enclosing_id(self):
+        for _, element_id in reversed(self._open):
+            if element_id:
+                return element_id[:255]
+        return None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {name: value if value is not None else '' for name, value in attrs}
+        if attrs.get('id'):
+            self.element_ids.add(attrs['id'])
+        if tag not in VOID_ELEMENTS:
+            self._open.append((tag, attrs.get('id')))
+        if tag not in FORM_FIELDS:
+            if 'data-answer' in attrs and 'selected' in attrs.get('class', '').split():
+                self._add(self._enclosing_id() or self._key({}, 'choice'), 'choice', attrs['data-answer'])
+            return
+        if tag == 'input':
+            input_type = (attrs.get('type') or 'text').lower()
+            if input_type in IGNORED_INPUT_TYPES:
+                return
+            if input_type in ('checkbox', 'radio'):
+                key = self._key(attrs, tag, group=True)
+                if 'checked' in attrs:
+                    self._add(key, input_type, attrs.get('value') or 'on')
+            else:
+                key = self._key(attrs, tag)
+                self._add(key, input_type, attrs.get('value', ''))
+            self._record_key(key, attrs)
+        elif tag == 'textarea':
+            self._textarea = (self._key(attrs, tag), [])
+            self._record_key(self._textarea[0], attrs)
+        elif tag == 'select':
+            self._select = (self._key(attrs, tag), [])
+            self._record_key(self._select[0], attrs)
+        elif tag == 'option' and self._select is not None:
+            self._option = (attrs.get('value'), 'selected' in attrs, [])
+
+    def _record_key(self, key, attrs):
+        if attrs.get('data-answer'):
+            self.answer_key[key] = attrs['data-answer']
+
+    def handle_startendtag(self, tag, attrs):
+        # XHTML serialization writes empty elements as <textarea ... />
+        if tag == 'textarea':
+            attrs = {name: value or '' for name, value in attrs}
+            key = self._key(attrs, tag)
+            self._add(key, 'textarea', '')
+            self._record_key(key, attrs)
+        elif tag != 'select':
+            self.handle_starttag(tag, attrs)
+            if tag not in VOID_ELEMENTS:
+                self._close(tag)
+
+    def _close(self, tag):
+        # Tolerate unclosed elements in hand-written HTML: close up to the last match
+        for i in range(len(self._open) - 1, -1, -1):
+            if self._open[i][0] == tag:
+                del self._open[i:]
+                return
+
+    def handle_data(self, data):
+        if self._textarea is not None:
+            self._textarea[1].append(data)
+        elif self._option is not None:
+            self._option[2].append(data)
+
+    def _close_option(self):
+        if self._option is not None:
+            value, selected, text = self._option
+            if selected:
+                self._select[1].append(value if value is not None else ''.join(text).strip())
+            self._option = None
+
+    def handle_endtag(self, tag):
+        self._close(tag)
+        if tag == 'textarea' and self._textarea is not None:
+            key, text = self._textarea
+            self._add(key, 'textarea', ''.join(text))
+            self._textarea = None
+        elif tag == 'option':
+            self._close_option()
+        elif tag == 'select' and self._select is not None:
+            self._close_option()
+            key, chosen = self._select
+            for value in chosen or ['']:
+                self._add(key, 'select', value)
+            self._select = None
+
+
+def parse(content):
+    """Run AnswerParser over a string or an iterable of string chunks"""
+    parser = AnswerParser()
+    chunks = (content[i:i + CHUNK_SIZE] for i in range(0, len(content), CHUNK_SIZE)) \
+        if isinstance(content, str) else content
+    for chunk in chunks:
+        parser.feed(chunk)
+    parser.close()
+    return parser
+
+
+def extract_answers(content):
+    """Answers in a submitted document, given as a string or an iterable of string chunks"""
+    return parse(content).answers
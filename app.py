@@ -1,16 +1,53 @@
 # Flask Application for Educational Platform
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file, send_from_directory, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_babel import Babel, gettext as _
-from flask_wtf.csrf import CSRFProtect
+from flask_wtf.csrf import CSRFProtect, generate_csrf
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from werkzeug.utils import secure_filename
+from datetime import datetime, timedelta
+from collections import namedtuple
+from itertools import groupby
 import os
 import json
+import mimetypes
+import click
 import logging
 import sys
-from sqlalchemy import text
+import shutil
+import tempfile
+import threading
+import time
+import multiprocessing
+import re
+import socket
+import urllib.request
+import random
+import base64
+import gzip
+import io
+import csv
+from sqlalchemy import text, func, and_, literal, select, bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import deferred, undefer, load_only, contains_eager
+from sqlalchemy.dialects import postgresql, sqlite
+import migrations
+import precompressed
+import response_compression
+import db_profile
+import template_delta
+import compressed_text
+import answer_extraction
+import autograde
+import analytics
+import assets
+import gradebook
+import zipstream
+import screenshots
+import storage
+import page_cache
 
 # Set up logging (early to capture all errors)
 logging.basicConfig(
@@ -61,9 +98,10 @@ instance_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instanc
 DATABASE_URL = os.environ.get('DATABASE_URL')
 if DATABASE_URL:
     logger.info(f"Using DATABASE_URL from environment: {DATABASE_URL[:20]}...")
-    # Fix Railway PostgreSQL URL format
-    if DATABASE_URL.startswith('postgres://'):
-        DATABASE_URL = DATABASE_URL.replace('postgres://', 'postgresql://', 1)
+    # Fix Railway PostgreSQL URL format, and name the driver explicitly since
+    # newer SQLAlchemy releases default postgresql:// to psycopg 3
+    if DATABASE_URL.startswith(('postgres://', 'postgresql://')):
+        DATABASE_URL = db_profile.normalize_uri(DATABASE_URL)
         logger.info(f"Converted to SQLAlchemy format: {DATABASE_URL[:20]}...")
     app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 else:
@@ -72,6 +110,42 @@ else:
     logger.info(f"Using SQLite database: {sqlite_path}")
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Pool sizing, pre-ping, recycling and timeouts come from DB_* environment variables
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = db_profile.engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+logger.info(f"Database engine options: {db_profile.describe(app.config['SQLALCHEMY_ENGINE_OPTIONS'])}")
+
+# Uploaded worksheets, screenshots and submission archives, see storage.py. The local
+# backend keeps them in UPLOAD_FOLDER (Render mounts a disk here); with 's3' they go
+# to a bucket, so several instances can share them.
+app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', 'uploads')
+app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 'local')
+for setting in ('S3_ENDPOINT_URL', 'S3_BUCKET', 'S3_ACCESS_KEY_ID', 'S3_SECRET_ACCESS_KEY', 'S3_REGION', 'S3_PREFIX'):
+    app.config[setting] = os.environ.get(setting)
+# A released file is deleted only if nobody stored the same content again within this
+# long, which leaves time for that upload's row to be committed
+app.config['UPLOAD_RELEASE_GRACE_SECONDS'] = int(os.environ.get('UPLOAD_RELEASE_GRACE_SECONDS', 3600))
+# Precompressed worksheet variants; safe to delete, they are rebuilt on demand
+app.config['COMPRESSED_CACHE_FOLDER'] = os.environ.get('COMPRESSED_CACHE_FOLDER', os.path.join(instance_dir, 'compressed'))
+# Screenshot thumbnails for the grading pages; also rebuilt on demand
+app.config['THUMBNAIL_FOLDER'] = os.environ.get('THUMBNAIL_FOLDER', os.path.join(instance_dir, 'thumbnails'))
+app.config['SCREENSHOT_MAX_BYTES'] = int(os.environ.get('SCREENSHOT_MAX_BYTES', screenshots.MAX_UPLOAD_BYTES))
+# Larger request bodies are refused before Werkzeug spools them: the biggest legitimate
+# one is a submission's screenshot plus its form fields (each field is held to
+# MAX_FORM_MEMORY_SIZE) and the multipart framing. Worksheet uploads share the limit.
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get(
+    'MAX_CONTENT_LENGTH', app.config['SCREENSHOT_MAX_BYTES'] + app.config['MAX_FORM_MEMORY_SIZE'] + 64 * 1024))
+# Let a reverse proxy send local uploads instead of the worker: USE_X_SENDFILE for
+# Apache mod_xsendfile or lighttpd (given the file's path), UPLOADS_ACCEL_REDIRECT for
+# nginx (given a URI prefix, e.g. /_uploads/, of an `internal` location aliased to
+# UPLOAD_FOLDER). Without either, send_file hands the open file to the server's
+# wsgi.file_wrapper, which gunicorn sends with sendfile(2).
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', 'false').lower() == 'true'
+app.config['UPLOADS_ACCEL_REDIRECT'] = os.environ.get('UPLOADS_ACCEL_REDIRECT')
+# Rendered dashboards, login pages and assignment shells, see page_cache.py. Each
+# worker keeps an LRU; PAGE_CACHE_FOLDER adds a directory shared by all of them.
+# PAGE_CACHE_SECONDS=0 turns the cache off.
+app.config['PAGE_CACHE_SECONDS'] = int(os.environ.get('PAGE_CACHE_SECONDS', page_cache.DEFAULT_TTL))
+app.config['PAGE_CACHE_FOLDER'] = os.environ.get('PAGE_CACHE_FOLDER')
 app.config['DEBUG'] = False  # Always False in production
 
 # Babel configuration
@@ -82,6 +156,15 @@ app.config['BABEL_TRANSLATION_DIRECTORIES'] = './translations'
 # Initialize database
 db = SQLAlchemy(app)
 
+with app.app_context():
+    db_profile.install_metrics(app, db.engine)
+    if db.engine.dialect.name == 'sqlite':
+        db_profile.install_sqlite_pragmas(db.engine)
+
+# Submissions, grades and new assignments are written one at a time on SQLite,
+# retrying on lock errors, so deadline bursts don't fail with "database is locked"
+db_writer = db_profile.SerializedWriter.for_database(app.config['SQLALCHEMY_DATABASE_URI'])
+
 # User model
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
@@ -90,6 +173,7 @@ class User(db.Model, UserMixin):
     password_hash = db.Column(db.String(200), nullable=False)
     role = db.Column(db.String(50), nullable=False, default='student')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    deleted_at = db.Column(db.DateTime, nullable=True)  # Set when a purge is scheduled
     
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -101,11 +185,19 @@ class User(db.Model, UserMixin):
 student_assignment = db.Table('student_assignment',
     db.Column('student_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
     db.Column('assignment_id', db.Integer, db.ForeignKey('assignment.id'), primary_key=True),
-    db.Column('assigned_at', db.DateTime, default=datetime.utcnow)
+    db.Column('assigned_at', db.DateTime, default=datetime.utcnow),
+    db.Index('ix_student_assignment_student', 'student_id')
 )
 
 # Assignment model
 class Assignment(db.Model):
+    # Indexes are also added to existing databases by migrations.py
+    __table_args__ = (
+        db.Index('ix_assignment_active_creator', 'is_active', 'created_by'),
+        db.Index('ix_assignment_created', 'created_at', 'id'),
+        db.Index('ix_assignment_html_filename', 'html_filename'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=False)
@@ -113,27 +205,1388 @@ class Assignment(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     due_date = db.Column(db.DateTime, nullable=True)
     is_active = db.Column(db.Boolean, default=True)
+    deleted_at = db.Column(db.DateTime, nullable=True)  # Set when a purge is scheduled
     
     # All assignments are now HTML assignments
-    html_filename = db.Column(db.String(255), nullable=True)  # Name of uploaded HTML file
-    html_content = db.Column(db.Text, nullable=True)  # Content of HTML assignment
+    html_filename = db.Column(db.String(255), nullable=True)  # Storage key of the uploaded HTML file
+    # Deferred: worksheets are 25-50KB and list views never need them. Stored compressed.
+    html_content = deferred(db.Column(compressed_text.CompressedText, nullable=True))  # Content of HTML assignment
+    # Versions the assignment_content URL; submission deltas are stored against the
+    # worksheet it names, so html_content must never be changed in place
+    content_hash = db.Column(db.String(64), nullable=True)
+    # {question_key: correct answer} declared by the worksheet, see autograde.py
+    answer_key = db.Column(db.JSON, nullable=True)
+
+    def set_html_content(self, html_content):
+        self.html_content = html_content
+        self.content_hash = precompressed.content_hash(html_content) if html_content is not None else None
     
     # Relationship to students (many-to-many)
     assigned_students = db.relationship('User', secondary=student_assignment, backref='assigned_assignments', lazy='dynamic')
 
+    @classmethod
+    def with_content(cls):
+        """Query assignments with the deferred html_content column loaded up front"""
+        return cls.query.options(undefer(cls.html_content))
+
 # Submission model
 class Submission(db.Model):
+    __table_args__ = (
+        db.Index('ix_submission_assignment_student', 'assignment_id', 'student_id'),
+        db.Index('ix_submission_student', 'student_id'),
+        db.Index('ix_submission_assignment_submitted', 'assignment_id', 'submitted_at', 'id'),
+        # Stored files are shared by content, so deleting one first checks these
+        db.Index('ix_submission_screenshot', 'screenshot_filename'),
+        db.Index('ix_submission_archive', 'archive_filename'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     assignment_id = db.Column(db.Integer, db.ForeignKey('assignment.id'), nullable=False)
     student_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    content = db.Column(db.Text, nullable=False)
+    # Deferred: the serialized iframe document is ~50KB per row. When content_base_hash
+    # is set the column holds a template_delta against that worksheet instead, so
+    # read and write the document through `content` rather than stored_content.
+    stored_content = deferred(db.Column('content', compressed_text.CompressedText, nullable=False))
+    content_base_hash = db.Column(db.String(64), nullable=True)
     submitted_at = db.Column(db.DateTime, default=datetime.utcnow)
     grade = db.Column(db.Float, nullable=True)
     feedback = db.Column(db.Text, nullable=True)
-    screenshot_filename = db.Column(db.String(255), nullable=True)
+    screenshot_filename = db.Column(db.String(255), nullable=True)  # Storage key
+    archive_filename = db.Column(db.String(255), nullable=True)  # Storage key of the HTML record
+    # answer_extraction.EXTRACTOR_VERSION that produced the answer rows, None if not extracted yet
+    answers_version = db.Column(db.Integer, nullable=True)
     
     assignment = db.relationship('Assignment', backref='submissions', lazy=True)
     user = db.relationship('User', backref='submissions', lazy=True)
+    answers = db.relationship('Answer', order_by='Answer.position', lazy=True)
+
+    @property
+    def content(self):
+        if self.content_base_hash is None:
+            return self.stored_content
+        template = load_template(self.assignment_id, self.content_base_hash)
+        if template is None:
+            raise template_delta.DeltaError(
+                f"Worksheet {self.content_base_hash} for submission {self.id} is missing")
+        return template_delta.decode(template, self.stored_content)
+
+    @content.setter
+    def content(self, content):
+        self.stored_content = content
+        self.content_base_hash = None
+
+    @classmethod
+    def with_content(cls):
+        """Query submissions with the deferred content column loaded up front"""
+        return cls.query.options(undefer(cls.stored_content))
+
+# Form field values extracted from submissions, so grading, exports and analytics
+# query rows instead of parsing HTML on every read
+class Answer(db.Model):
+    __table_args__ = (
+        db.Index('ix_answer_submission', 'submission_id', 'position'),
+        db.Index('ix_answer_assignment_question', 'assignment_id', 'question_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    submission_id = db.Column(db.Integer, db.ForeignKey('submission.id'), nullable=False)
+    assignment_id = db.Column(db.Integer, db.ForeignKey('assignment.id'), nullable=False)
+    position = db.Column(db.Integer, nullable=False)  # Order of the field in the document
+    question_key = db.Column(db.String(255), nullable=False)  # Element id or name
+    element_type = db.Column(db.String(20), nullable=False)  # text, textarea, select, radio, ...
+    value = db.Column(db.Text, nullable=False)
+
+def answer_rows(submission_id, assignment_id, answers):
+    return [{'submission_id': submission_id, 'assignment_id': assignment_id,
+             'position': a.position, 'question_key': a.question_key,
+             'element_type': a.element_type, 'value': a.value} for a in answers]
+
+def submission_answers(submission):
+    """The answers in a submission's HTML; none if its content cannot be decoded or parsed"""
+    try:
+        return answer_extraction.extract_answers(submission.content)
+    except Exception as e:
+        # Stored as extracted all the same, so one broken row can't fail every later read
+        logger.error(f"Could not extract answers from submission {submission.id}: {e}")
+        return []
+
+def store_answers(submission, answers):
+    """Replace a submission's answer rows (caller commits)"""
+    Answer.query.filter_by(submission_id=submission.id).delete(synchronize_session=False)
+    if answers:
+        db.session.execute(Answer.__table__.insert(), answer_rows(submission.id, submission.assignment_id, answers))
+    submission.answers_version = answer_extraction.EXTRACTOR_VERSION
+
+# Materialized analytics for one assignment, see analytics.py. Changes to grades
+# clear grade_stats and changes to answers clear question_stats; either bumps
+# version so a computation that raced with the change is not stored.
+class AssignmentStats(db.Model):
+    __tablename__ = 'assignment_stats'
+
+    assignment_id = db.Column(db.Integer, db.ForeignKey('assignment.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    grade_stats = db.Column(db.JSON(none_as_null=True), nullable=True)
+    question_stats = db.Column(db.JSON(none_as_null=True), nullable=True)
+    computed_at = db.Column(db.DateTime, nullable=True)
+
+def invalidate_stats(assignment_ids, answers=False):
+    """Mark the statistics of assignments stale after their submissions or grades change (caller commits)"""
+    assignment_ids = list(set(assignment_ids))
+    if not assignment_ids:
+        return
+    values = {'grade_stats': None, 'version': AssignmentStats.version + 1}
+    if answers:
+        values['question_stats'] = None
+    db.session.execute(db.update(AssignmentStats).where(
+        AssignmentStats.assignment_id.in_(assignment_ids)).values(**values).execution_options(synchronize_session=False))
+
+class CacheVersion(db.Model):
+    """Version counters in page cache keys; bumping one retires every page rendered from it"""
+    __tablename__ = 'cache_version'
+
+    scope = db.Column(db.String(16), primary_key=True)  # 'assignment', 'student' or 'listing'
+    key_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    version = db.Column(db.Integer, nullable=False)
+
+def bump_cache_versions(assignments=(), students=(), listing=False):
+    """Retire cached pages showing these assignments, students or the assignment list (caller commits)"""
+    keys = {('assignment', i) for i in assignments} | {('student', i) for i in students}
+    if listing:
+        keys.add(('listing', 0))
+    if not keys:
+        return
+    # New counters start anywhere, so a recreated database never reuses keys cached from the old one
+    insert = postgresql.insert if db.engine.dialect.name == 'postgresql' else sqlite.insert
+    statement = insert(CacheVersion).values([
+        {'scope': scope, 'key_id': key_id, 'version': random.randrange(1, 2 ** 30)} for scope, key_id in sorted(keys)
+    ])
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['scope', 'key_id'], set_={'version': CacheVersion.version + 1}))
+
+def get_cache_versions(*keys):
+    """Current versions of (scope, key_id) counters, 0 for one never bumped"""
+    rows = dict(((row.scope, row.key_id), row.version) for row in db.session.query(
+        CacheVersion.scope, CacheVersion.key_id, CacheVersion.version
+    ).filter(db.tuple_(CacheVersion.scope, CacheVersion.key_id).in_(keys)))
+    return [rows.get(key, 0) for key in keys]
+
+def get_student_page_versions(student_id):
+    """The counters behind a student's dashboard: their own, then each allocated assignment's"""
+    allocated = db.session.query(student_assignment.c.assignment_id, func.coalesce(CacheVersion.version, 0)).outerjoin(
+        CacheVersion, and_(CacheVersion.scope == 'assignment', CacheVersion.key_id == student_assignment.c.assignment_id)
+    ).filter(student_assignment.c.student_id == student_id).order_by(student_assignment.c.assignment_id).all()
+    return get_cache_versions(('student', student_id)) + [list(row) for row in allocated]
+
+# Worksheets by content hash, for building and reading submission deltas
+template_cache = template_delta.TemplateCache()
+
+def load_template(assignment_id, content_hash):
+    """The worksheet HTML that `content_hash` names, or None if the assignment no longer has it"""
+    def load():
+        row = db.session.query(Assignment.html_content, Assignment.content_hash).filter(
+            Assignment.id == assignment_id).first()
+        if row is None or row.content_hash != content_hash:
+            return None
+        return row.html_content
+    return template_cache.get(content_hash, load)
+
+def encode_submission_content(content, assignment):
+    """(stored_content, content_base_hash) for a new submission to `assignment`"""
+    if assignment.content_hash:
+        template = load_template(assignment.id, assignment.content_hash)
+        delta = template_delta.encode(template, content) if template else None
+        if delta is not None:
+            return delta, assignment.content_hash
+    return content, None
+
+# Progress of the background purge of a soft-deleted assignment or user, run as a 'purge' job
+class PurgeTask(db.Model):
+    __table_args__ = (
+        db.Index('ix_purge_task_status', 'status'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    target_type = db.Column(db.String(20), nullable=False)  # 'assignment' or 'user'
+    target_id = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, running, done, failed
+    phase = db.Column(db.String(30), nullable=True)
+    submissions_deleted = db.Column(db.Integer, nullable=False, default=0)
+    allocations_deleted = db.Column(db.Integer, nullable=False, default=0)
+    files_deleted = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    requested_by = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)  # Heartbeat while running
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'target_type': self.target_type,
+            'target_id': self.target_id,
+            'status': self.status,
+            'phase': self.phase,
+            'submissions_deleted': self.submissions_deleted,
+            'allocations_deleted': self.allocations_deleted,
+            'files_deleted': self.files_deleted,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+# Durable background jobs, run by the job queue below
+class Job(db.Model):
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)  # A key of JOB_HANDLERS
+    payload = db.Column(db.JSON, nullable=False)  # Keyword arguments for the handler
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # Not before; pushed back on retry
+    locked_by = db.Column(db.String(100), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)  # Claim time while running
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+# Dashboard read model
+# One row per assignment on a student's dashboard, carrying only the columns the
+# dashboard renders (never html_content or submission content).
+DashboardRow = namedtuple('DashboardRow', [
+    'id', 'title', 'description', 'is_active', 'created_at', 'due_date',
+    'submission_id', 'submitted_at', 'grade', 'due_state'
+])
+
+DASHBOARD_DESCRIPTION_CHARS = 100
+
+def get_due_state(due_date, submitted_at=None, now=None):
+    """Classify an assignment's due date as 'none', 'open', 'overdue' or 'submitted'"""
+    if submitted_at is not None:
+        return 'submitted'
+    if due_date is None:
+        return 'none'
+    now = now or datetime.utcnow()
+    return 'overdue' if due_date < now else 'open'
+
+def get_student_dashboard_rows(student_id):
+    """Load a student's active assignments with their submission status in a single query"""
+    rows = db.session.query(
+        Assignment.id,
+        Assignment.title,
+        func.substr(Assignment.description, 1, DASHBOARD_DESCRIPTION_CHARS),
+        Assignment.is_active,
+        Assignment.created_at,
+        Assignment.due_date,
+        Submission.id,
+        Submission.submitted_at,
+        Submission.grade
+    ).join(
+        student_assignment,
+        Assignment.id == student_assignment.c.assignment_id
+    ).outerjoin(
+        Submission,
+        and_(Submission.assignment_id == Assignment.id,
+             Submission.student_id == student_assignment.c.student_id)
+    ).filter(
+        student_assignment.c.student_id == student_id,
+        Assignment.is_active == True,
+        Assignment.deleted_at.is_(None)
+    ).order_by(Assignment.id).all()
+
+    now = datetime.utcnow()
+    dashboard_rows = []
+    seen = set()
+    for row in rows:
+        # Guard against duplicate submissions for the same assignment
+        if row[0] in seen:
+            continue
+        seen.add(row[0])
+        dashboard_rows.append(DashboardRow(*row, due_state=get_due_state(row[5], row[7], now)))
+    return dashboard_rows
+
+def seconds_until_overdue(dashboard_rows, now=None):
+    """How long until the first open row turns overdue, or None if none will"""
+    now = now or datetime.utcnow()
+    due = [row.due_date for row in dashboard_rows if row.due_state == 'open']
+    return (min(due) - now).total_seconds() if due else None
+
+# Keyset pagination
+# Pages are addressed by an opaque cursor holding the sort key of the last row
+# shown, so page 200 costs the same index range scan as page 1.
+PAGE_SIZE_DEFAULT = 50
+PAGE_SIZE_MAX = 200
+
+KeysetPage = namedtuple('KeysetPage', ['items', 'next_cursor', 'page_size', 'cursor'])
+
+def encode_cursor(values):
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, columns):
+    """Decode a cursor into sort-key values, or None if it is missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw.decode('utf-8'))
+        if not isinstance(values, list) or len(values) != len(columns):
+            return None
+        return [datetime.fromisoformat(v) if isinstance(column.type, db.DateTime) and v is not None else v
+                for column, v in zip(columns, values)]
+    except (ValueError, TypeError):
+        return None
+
+def get_page_size(default=PAGE_SIZE_DEFAULT):
+    page_size = request.args.get('per_page', default, type=int)
+    return max(1, min(page_size, PAGE_SIZE_MAX))
+
+def keyset_paginate(query, columns, cursor=None, page_size=PAGE_SIZE_DEFAULT, descending=True):
+    """Return one page of `query` ordered by `columns` (the last must be unique), starting after `cursor`"""
+    values = decode_cursor(cursor, columns)
+    if values is not None:
+        key = db.tuple_(*columns)
+        # Bind with the column types so datetimes compare in the stored format
+        bound = db.tuple_(*[literal(v, type_=column.type) for column, v in zip(columns, values)])
+        query = query.filter(key < bound if descending else key > bound)
+    order = [column.desc() if descending else column.asc() for column in columns]
+    rows = query.order_by(*order).limit(page_size + 1).all()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, column.key) for column in columns])
+    return KeysetPage(rows, next_cursor, page_size, cursor if values is not None else None)
+
+# Page cache
+# Dashboards, the login and register pages and the assignment shell are rendered
+# once per key and served from rendered_pages until a write bumps one of the
+# CacheVersion counters in their key, see page_cache.py.
+rendered_pages = page_cache.PageCache(
+    ttl=app.config['PAGE_CACHE_SECONDS'],
+    backend=page_cache.DirectoryBackend(app.config['PAGE_CACHE_FOLDER']) if app.config['PAGE_CACHE_FOLDER'] else None
+)
+
+def render_cacheable(template_name, **context):
+    """render_template with a placeholder for the CSRF token, which cached_page fills in"""
+    return render_template(template_name, csrf_token=lambda: page_cache.CSRF_PLACEHOLDER, **context)
+
+def cached_page(parts, render):
+    """The current page from rendered_pages, with this session's CSRF token
+
+    `parts` are the page's arguments and the versions it is rendered from; the
+    endpoint, viewer and locale are added here. `render()` returns (html, max_age)
+    from render_cacheable and runs on a miss, or every time while flashed messages
+    are waiting, since those are shown once and never cached.
+    """
+    if request.method != 'GET' or '_flashes' in session:
+        html = render()[0]
+    else:
+        viewer = [current_user.id, current_user.username, current_user.role] if current_user.is_authenticated else None
+        html = rendered_pages.get([request.endpoint, viewer, str(get_locale()), parts], render)
+    return html.replace(page_cache.CSRF_PLACEHOLDER, generate_csrf())
+
+# HTML body responses
+# Submission and worksheet bodies are served on their own URLs instead of being
+# inlined into srcdoc attributes, so list pages stay small and bodies can be
+# revalidated with ETags and sent gzip-compressed.
+BODY_CHUNK_SIZE = 64 * 1024
+# Student HTML runs in an opaque origin so its scripts cannot reach the app's session
+UNTRUSTED_HTML_CSP = 'sandbox allow-scripts allow-forms allow-popups allow-modals'
+
+variant_cache = precompressed.VariantCache(app.config['COMPRESSED_CACHE_FOLDER'])
+# Every other text response is compressed on the way out; immutable ones share variant_cache
+app.wsgi_app = response_compression.CompressionMiddleware(app.wsgi_app, variant_cache)
+
+# Stylesheets and scripts under static/, linked by content hash (see assets.py)
+asset_fingerprints = assets.Fingerprints(os.path.join(app.root_path, 'static'))
+app.jinja_env.add_extension(assets.MinifyHTML)
+
+@app.template_global()
+def asset_url(path):
+    """The fingerprinted URL of a file under static/"""
+    return url_for('static_asset', filename=asset_fingerprints.hashed_name(path))
+
+def html_body_response(body, etag, cache_control='private, no-cache', sandbox=True, cache_key=None):
+    """Stream an HTML body with a strong ETag, answering 304 and negotiating compression.
+
+    `body` may be a callable so the column is only read when the client needs it.
+    With a `cache_key` (a content hash) compressed variants come from variant_cache;
+    otherwise the body is gzipped on the fly.
+    """
+    headers = {
+        'Cache-Control': cache_control,
+        'Vary': 'Accept-Encoding',
+    }
+    if sandbox:
+        headers['Content-Security-Policy'] = UNTRUSTED_HTML_CSP
+    if request.if_none_match.contains(etag):
+        response = Response(status=304, headers=headers)
+        response.set_etag(etag)
+        return response
+
+    def load():
+        value = body() if callable(body) else body
+        return (value or '').encode('utf-8')
+
+    if cache_key:
+        encoding = precompressed.negotiate(request.accept_encodings)
+        data = variant_cache.get(cache_key, encoding, load) if encoding else load()
+    else:
+        encoding = 'gzip' if request.accept_encodings['gzip'] else None
+        data = gzip.compress(load(), compresslevel=6) if encoding else load()
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    headers['Content-Length'] = str(len(data))
+
+    def generate():
+        for start in range(0, len(data), BODY_CHUNK_SIZE):
+            yield data[start:start + BODY_CHUNK_SIZE]
+
+    response = Response(generate(), mimetype='text/html', headers=headers)
+    response.set_etag(etag)
+    return response
+
+# Bulk cohort allocation
+# Large IN lists are split to stay under SQLite's bound-parameter limit
+ALLOCATION_CHUNK_SIZE = 900
+# Above this many rows Postgres allocations are streamed with COPY
+ALLOCATION_COPY_THRESHOLD = 500
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _parse_student_ids(student_ids):
+    ids, invalid = set(), []
+    for raw in student_ids:
+        try:
+            ids.add(int(raw))
+        except (TypeError, ValueError):
+            invalid.append(raw)
+    return ids, invalid
+
+def _copy_student_assignment_rows(rows):
+    """Stream rows into student_assignment with Postgres COPY on the session's connection"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row['student_id'], row['assignment_id'], row['assigned_at'].isoformat()])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            'COPY student_assignment (student_id, assignment_id, assigned_at) FROM STDIN WITH (FORMAT csv)',
+            buffer
+        )
+    finally:
+        cursor.close()
+
+def allocate_students(assignment_id, student_ids=None):
+    """Assign students to an assignment with set-based statements.
+
+    With no student_ids every student is allocated by a single INSERT ... SELECT.
+    Otherwise the ids are validated in one query per chunk and the new rows are
+    written with a multi-row insert (COPY on Postgres for large cohorts).
+    Students who already have the assignment are skipped. Does not commit.
+
+    Returns a dict with the number of rows allocated and the rejected ids.
+    """
+    now = datetime.utcnow()
+    already_assigned = db.session.query(student_assignment.c.student_id).filter(
+        student_assignment.c.assignment_id == assignment_id
+    )
+
+    if not student_ids:
+        select_students = db.session.query(
+            User.id, literal(assignment_id), literal(now)
+        ).filter(
+            User.role == 'student',
+            ~User.id.in_(already_assigned)
+        )
+        result = db.session.execute(
+            student_assignment.insert().from_select(
+                ['student_id', 'assignment_id', 'assigned_at'], select_students
+            )
+        )
+        return {'allocated': result.rowcount, 'invalid_ids': []}
+
+    ids, invalid = _parse_student_ids(student_ids)
+    valid_ids = set()
+    for chunk in _chunks(sorted(ids), ALLOCATION_CHUNK_SIZE):
+        valid_ids.update(row[0] for row in db.session.query(User.id).filter(
+            User.id.in_(chunk), User.role == 'student'
+        ))
+    invalid.extend(sorted(ids - valid_ids))
+    valid_ids -= {row[0] for row in already_assigned}
+
+    rows = [{'student_id': student_id, 'assignment_id': assignment_id, 'assigned_at': now}
+            for student_id in sorted(valid_ids)]
+    if rows:
+        if db.engine.dialect.name == 'postgresql' and len(rows) >= ALLOCATION_COPY_THRESHOLD:
+            _copy_student_assignment_rows(rows)
+        else:
+            db.session.execute(student_assignment.insert(), rows)
+    return {'allocated': len(rows), 'invalid_ids': invalid}
+
+# Job queue
+# Work that can happen after a request has returned (archives, screenshot checks,
+# answer extraction, notifications, purges) is recorded as Job rows in the same transaction
+# as the change it follows up, so it is never lost to a crash. Jobs are claimed
+# with a conditional UPDATE, so any number of threads and `flask work` processes
+# can share the table. A failed job is retried with exponential backoff until it
+# has used max_attempts; handlers must therefore be safe to run more than once.
+# A job whose worker died is claimed again once stale, which also uses an attempt.
+#
+# `flask work` processes on another machine see only what the web workers share
+# with them: they need the same (PostgreSQL) database and STORAGE_BACKEND=s3, since
+# handlers read and write uploaded files.
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_SECONDS = 30  # Doubled after every failed attempt...
+JOB_RETRY_MAX_SECONDS = 3600  # ...up to this
+# A running job whose claim (or last job_heartbeat) is older than this is assumed to have crashed
+JOB_STALE_SECONDS = 600
+JOB_CLAIM_CANDIDATES = 10
+JOB_POLL_SECONDS = 5
+# Finished jobs are kept this long for inspection; failed ones until removed by hand
+JOB_RETENTION_DAYS = 7
+# Off when `flask work` processes run the jobs instead of the web workers
+app.config.setdefault('JOBS_IN_BACKGROUND', os.environ.get('JOBS_IN_BACKGROUND', 'true').lower() != 'false')
+# Comma-separated URLs that receive a JSON POST for every new submission
+app.config.setdefault('NOTIFY_WEBHOOK_URLS', [
+    url.strip() for url in os.environ.get('NOTIFY_WEBHOOK_URLS', '').split(',') if url.strip()
+])
+WEBHOOK_TIMEOUT_SECONDS = 10
+
+JOB_HANDLERS = {}
+
+def job_handler(kind):
+    """Register a function as the handler of a job kind; it is called with the payload as keyword arguments"""
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return decorator
+
+def enqueue_job(kind, payload, max_attempts=JOB_MAX_ATTEMPTS, run_at=None):
+    """Record a job (caller commits) and return it"""
+    job = Job(kind=kind, payload=payload, status='pending', attempts=0, max_attempts=max_attempts,
+              run_at=run_at or datetime.utcnow())
+    db.session.add(job)
+    return job
+
+def _job_stale(now):
+    return and_(Job.status == 'running', Job.updated_at < now - timedelta(seconds=JOB_STALE_SECONDS))
+
+def _job_claimable(now):
+    return db.or_(and_(Job.status == 'pending', Job.run_at <= now),
+                  and_(_job_stale(now), Job.attempts < Job.max_attempts))
+
+def fail_abandoned_jobs():
+    """Mark stale running jobs that have no attempts left as failed; returns how many"""
+    now = datetime.utcnow()
+    count = db_writer.run(db.session, lambda: db.session.execute(Job.__table__.update().where(
+        _job_stale(now), Job.attempts >= Job.max_attempts
+    ).values(status='failed', error='Worker stopped while running the job', locked_by=None,
+             updated_at=now, finished_at=now)).rowcount)
+    if count:
+        logger.error(f"Gave up on {count} jobs whose workers stopped on their last attempt")
+    return count
+
+def claim_job(worker_id):
+    """Atomically take the next due job (or one whose worker died); returns its id or None"""
+    def claim():
+        now = datetime.utcnow()
+        candidates = [row[0] for row in db.session.query(Job.id).filter(
+            _job_claimable(now)).order_by(Job.run_at, Job.id).limit(JOB_CLAIM_CANDIDATES)]
+        for job_id in candidates:
+            # Another worker may have taken it since the SELECT; then try the next one
+            result = db.session.execute(Job.__table__.update().where(
+                Job.id == job_id, _job_claimable(now)
+            ).values(status='running', locked_by=worker_id, attempts=Job.attempts + 1, updated_at=now))
+            if result.rowcount == 1:
+                return job_id
+        return None
+    return db_writer.run(db.session, claim)
+
+def _update_job(job_id, **values):
+    values['updated_at'] = datetime.utcnow()
+    db_writer.run(db.session, lambda: db.session.execute(
+        Job.__table__.update().where(Job.id == job_id).values(**values)))
+
+_current_job = threading.local()
+
+def job_heartbeat():
+    """Keep the running job from looking stale (caller commits); for handlers that run for long"""
+    job_id = getattr(_current_job, 'id', None)
+    if job_id is not None:
+        db.session.execute(Job.__table__.update().where(Job.id == job_id).values(updated_at=datetime.utcnow()))
+
+def job_retry_delay(attempts):
+    return timedelta(seconds=min(JOB_RETRY_SECONDS * 2 ** (attempts - 1), JOB_RETRY_MAX_SECONDS))
+
+def run_job(job_id):
+    """Run a claimed job, then mark it done or schedule its retry"""
+    job = db.session.get(Job, job_id)
+    kind, payload, attempts, max_attempts = job.kind, dict(job.payload), job.attempts, job.max_attempts
+    db.session.commit()
+    try:
+        handler = JOB_HANDLERS.get(kind)
+        if handler is None:
+            raise ValueError(f"Unknown job kind: {kind}")
+        _current_job.id = job_id
+        try:
+            handler(**payload)
+        finally:
+            _current_job.id = None
+    except Exception as e:
+        db.session.rollback()
+        now = datetime.utcnow()
+        if attempts >= max_attempts:
+            logger.error(f"Job {job_id} ({kind}) failed after {attempts} attempts: {e}")
+            logger.exception("Detailed error traceback:")
+            _update_job(job_id, status='failed', error=str(e), locked_by=None, finished_at=now)
+        else:
+            delay = job_retry_delay(attempts)
+            logger.warning(f"Job {job_id} ({kind}) failed, retrying in {delay}: {e}")
+            _update_job(job_id, status='pending', error=str(e), locked_by=None, run_at=now + delay)
+        return False
+    _update_job(job_id, status='done', error=None, locked_by=None, finished_at=datetime.utcnow())
+    return True
+
+def _worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"[:100]
+
+def run_pending_jobs(worker_id=None):
+    """Run due jobs until none is left; returns the number run"""
+    worker_id = worker_id or _worker_id()
+    fail_abandoned_jobs()
+    count = 0
+    while True:
+        job_id = claim_job(worker_id)
+        if job_id is None:
+            return count
+        run_job(job_id)
+        count += 1
+
+def next_job_due():
+    """When the earliest pending job becomes due, or None if there is none"""
+    return db.session.query(func.min(Job.run_at)).filter(Job.status == 'pending').scalar()
+
+def prune_jobs():
+    """Delete finished jobs past their retention period; returns the number deleted"""
+    cutoff = datetime.utcnow() - timedelta(days=JOB_RETENTION_DAYS)
+    return db_writer.run(db.session, lambda: db.session.execute(Job.__table__.delete().where(
+        Job.status == 'done', Job.finished_at < cutoff)).rowcount)
+
+def _poll_seconds(when):
+    """How long to wait for a job due at `when` (None: nothing pending)"""
+    if when is None:
+        return None
+    return min(max((when - datetime.utcnow()).total_seconds(), 0.1), JOB_POLL_SECONDS)
+
+_job_worker = None
+_job_worker_lock = threading.Lock()
+_job_wakeup = threading.Event()
+
+def _job_worker_loop():
+    global _job_worker
+    with app.app_context():
+        try:
+            while True:
+                _job_wakeup.clear()
+                run_pending_jobs()
+                wait = _poll_seconds(next_job_due())
+                db.session.remove()
+                if wait is None:
+                    with _job_worker_lock:
+                        # A job committed since the queue was found empty has set the wakeup
+                        if not _job_wakeup.is_set():
+                            _job_worker = None
+                            return
+                    continue
+                _job_wakeup.wait(wait)
+        except Exception as e:
+            logger.error(f"Job worker stopped: {e}")
+            logger.exception("Detailed error traceback:")
+            with _job_worker_lock:
+                _job_worker = None
+        finally:
+            db.session.remove()
+
+def start_job_worker():
+    """Run queued jobs on a thread of this process until the queue is empty"""
+    global _job_worker
+    if not app.config['JOBS_IN_BACKGROUND']:
+        return
+    _job_wakeup.set()
+    with _job_worker_lock:
+        if _job_worker is None:
+            _job_worker = threading.Thread(target=_job_worker_loop, name='job-worker', daemon=True)
+            _job_worker.start()
+
+_jobs_resumed = False
+
+@app.before_request
+def resume_queued_jobs():
+    """Start the job worker on a process's first request, for jobs (such as purges) queued before a restart"""
+    global _jobs_resumed
+    if not _jobs_resumed:
+        _jobs_resumed = True
+        start_job_worker()
+
+def work_jobs(once=False):
+    """Run jobs as they become due; with once, return when none is due"""
+    with app.app_context():
+        prune_jobs()
+        while True:
+            run_pending_jobs()
+            if once:
+                return
+            wait = _poll_seconds(next_job_due())
+            db.session.remove()
+            time.sleep(JOB_POLL_SECONDS if wait is None else wait)
+
+@app.cli.command('work')
+@click.option('--processes', default=1, show_default=True, help='Worker processes to run')
+@click.option('--once', is_flag=True, help='Exit when no job is due instead of waiting for more')
+def work_command(processes, once):
+    """Run queued background jobs"""
+    if app.config['STORAGE_BACKEND'] == 'local' or db.engine.dialect.name == 'sqlite':
+        logger.warning("Job workers share local files and SQLite only with web workers on the same machine; "
+                       "elsewhere, set STORAGE_BACKEND=s3 and a shared DATABASE_URL")
+    if processes <= 1:
+        work_jobs(once)
+        return
+    # Forked workers must not share the parent's pooled connections
+    db.engine.dispose()
+    workers = [multiprocessing.Process(target=work_jobs, args=(once,), name=f'job-worker-{i}')
+               for i in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+# Purge engine
+# Purges run as 'purge' jobs on the job queue, which claims them, reclaims them from
+# crashed workers and retries them. Every phase deletes at most PURGE_BATCH_SIZE rows
+# per transaction and is safe to repeat, so a retried purge resumes where it stopped;
+# the PurgeTask row records its progress.
+PURGE_BATCH_SIZE = 200
+
+def schedule_purge(target_type, target_id, requested_by=None):
+    """Record a purge task and queue its job (caller commits); returns the task"""
+    task = PurgeTask(target_type=target_type, target_id=target_id,
+                     status='pending', requested_by=requested_by)
+    db.session.add(task)
+    db.session.flush()
+    enqueue_job('purge', {'task_id': task.id})
+    return task
+
+def _purge_progress(task, phase, **increments):
+    task.phase = phase
+    for field, amount in increments.items():
+        setattr(task, field, getattr(task, field) + amount)
+    task.updated_at = datetime.utcnow()
+    job_heartbeat()
+    db.session.commit()
+
+def _referenced_uploads(keys):
+    referenced = set()
+    for column in UPLOAD_COLUMNS:
+        referenced.update(row[0] for row in db.session.query(column).filter(column.in_(keys)).distinct())
+    return referenced
+
+def release_uploads(keys):
+    """Queue stored files that no row refers to any more for deletion (caller commits)
+
+    Call after the rows that used the keys have been changed or deleted; the check
+    sees those changes even before they are committed. The files are deleted by the
+    release_uploads job, so a rollback keeps them. Returns the number queued.
+    """
+    keys = {key for key in keys if key}
+    released = sorted(keys - _referenced_uploads(keys)) if keys else []
+    if released:
+        enqueue_job('release_uploads', {'keys': released})
+    return len(released)
+
+def release_unused_uploads(keys):
+    """Release files stored for a write that then failed or was not needed"""
+    try:
+        db_writer.run(db.session, lambda: release_uploads(keys))
+    except Exception as e:
+        logger.error(f"Could not release uploads {keys}: {e}")
+        return
+    start_job_worker()
+
+def _release_matching_uploads(pattern, released=()):
+    """Release flat-named files from before content addressing whose names match `pattern`"""
+    regex = re.compile(pattern)
+    return release_uploads(name for name in upload_storage().legacy_names()
+                           if regex.match(name) and name not in released)
+
+def _purge_submissions(task, *criteria):
+    """Delete matching submissions in batches; returns the file keys released"""
+    released = set()
+    while True:
+        batch = db.session.query(
+            Submission.id, Submission.screenshot_filename, Submission.archive_filename, Submission.assignment_id
+        ).filter(*criteria).order_by(Submission.id).limit(PURGE_BATCH_SIZE).all()
+        if not batch:
+            return released
+        ids = [row[0] for row in batch]
+        Answer.query.filter(Answer.submission_id.in_(ids)).delete(synchronize_session=False)
+        Submission.query.filter(Submission.id.in_(ids)).delete(synchronize_session=False)
+        invalidate_stats((row.assignment_id for row in batch), answers=True)
+        bump_cache_versions(assignments={row.assignment_id for row in batch})
+        keys = [row.screenshot_filename for row in batch] + [row.archive_filename for row in batch]
+        files = release_uploads(keys)
+        released.update(keys)
+        _purge_progress(task, 'submissions', submissions_deleted=len(batch), files_deleted=files)
+
+def _purge_allocations(task, column, value, other):
+    while True:
+        batch = [row[0] for row in db.session.query(other).filter(column == value).limit(PURGE_BATCH_SIZE)]
+        if not batch:
+            return
+        db.session.execute(student_assignment.delete().where(column == value, other.in_(batch)))
+        _purge_progress(task, 'allocations', allocations_deleted=len(batch))
+
+def _purge_assignment(task, assignment_id):
+    released = _purge_submissions(task, Submission.assignment_id == assignment_id)
+    _purge_allocations(task, student_assignment.c.assignment_id, assignment_id, student_assignment.c.student_id)
+
+    files = _release_matching_uploads(rf'^(html_submission|screenshot)_{assignment_id}_\d+_', released)
+    assignment = Assignment.query.options(load_only(Assignment.id, Assignment.html_filename)).get(assignment_id)
+    if assignment:
+        html_filename = assignment.html_filename
+        AssignmentStats.query.filter_by(assignment_id=assignment_id).delete(synchronize_session=False)
+        db.session.delete(assignment)
+        db.session.flush()
+        # Other teachers may have uploaded the same worksheet
+        files += release_uploads([html_filename])
+    _purge_progress(task, 'assignment', files_deleted=files)
+
+def _purge_user(task, user_id):
+    # Assignments the user created reference them, so those go first
+    for (assignment_id,) in db.session.query(Assignment.id).filter(Assignment.created_by == user_id).all():
+        _purge_assignment(task, assignment_id)
+    released = _purge_submissions(task, Submission.student_id == user_id)
+    _purge_allocations(task, student_assignment.c.student_id, user_id, student_assignment.c.assignment_id)
+
+    files = _release_matching_uploads(rf'^(html_submission|screenshot)_\d+_{user_id}_', released)
+    user = User.query.get(user_id)
+    if user:
+        db.session.delete(user)
+    _purge_progress(task, 'user', files_deleted=files)
+
+@job_handler('purge')
+def run_purge_task(task_id):
+    """Run (or resume) one purge task to completion"""
+    task = PurgeTask.query.get(task_id)
+    if task is None or task.status == 'done':
+        return
+    task.status = 'running'
+    task.updated_at = datetime.utcnow()
+    db.session.commit()
+    logger.info(f"Purging {task.target_type} {task.target_id} (task {task.id})")
+    try:
+        if task.target_type == 'assignment':
+            _purge_assignment(task, task.target_id)
+        elif task.target_type == 'user':
+            _purge_user(task, task.target_id)
+        else:
+            raise ValueError(f"Unknown purge target type: {task.target_type}")
+        task.status = 'done'
+        task.finished_at = datetime.utcnow()
+        db.session.commit()
+        logger.info(f"Purge task {task.id} finished: {task.to_dict()}")
+    except Exception as e:
+        db.session.rollback()
+        task = PurgeTask.query.get(task_id)
+        task.status = 'failed'
+        task.error = str(e)
+        task.updated_at = datetime.utcnow()
+        db.session.commit()
+        raise  # Retried by the job queue, resuming from the last committed batch
+
+# Job handlers
+
+def upload_storage():
+    """The storage backend for uploaded files (see storage.py)"""
+    return storage.from_config(app.config)
+
+def store_screenshot(stream):
+    """Stream an uploaded screenshot into storage and return its key
+
+    Raises screenshots.UploadTooLarge or screenshots.NotAnImage for uploads that are not kept.
+    """
+    uploads = upload_storage()
+    path, kind = screenshots.receive(stream, uploads.staging_dir(), app.config['SCREENSHOT_MAX_BYTES'])
+    return uploads.put_file(path, kind)
+
+def _remove_thumbnail(key):
+    try:
+        os.remove(os.path.join(app.config['THUMBNAIL_FOLDER'], screenshots.thumbnail_name(key)))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Could not remove thumbnail of {key}: {e}")
+
+def _replace_submission_file(submission_id, column, old, new, then=None):
+    """Point a submission's file column from `old` to `new` unless it changed meanwhile, releasing whichever lost"""
+    def swap():
+        result = db.session.execute(db.update(Submission).where(
+            Submission.id == submission_id, column == old
+        ).values({column.key: new}).execution_options(synchronize_session=False))
+        if result.rowcount and then:
+            then()
+        return result.rowcount
+    replaced = db_writer.run(db.session, swap)
+    db_writer.run(db.session, lambda: release_uploads([old if replaced else new]))
+
+@job_handler('release_uploads')
+def delete_released_uploads(keys):
+    """Delete released files that are still unreferenced; ones stored again recently are looked at later"""
+    grace = app.config['UPLOAD_RELEASE_GRACE_SECONDS']
+    # Taken before the reference check: an upload that touched a file before this has committed by now
+    since = time.time() - grace
+    uploads = upload_storage()
+    kept = []
+    for key in sorted(set(keys) - _referenced_uploads(keys)):
+        if uploads.delete_if_untouched(key, since):
+            _remove_thumbnail(key)
+        else:
+            kept.append(key)
+    if kept:
+        db_writer.run(db.session, lambda: enqueue_job(
+            'release_uploads', {'keys': kept}, run_at=datetime.utcnow() + timedelta(seconds=grace)))
+
+@job_handler('archive_submission')
+def archive_submission(submission_id):
+    """Store a standalone HTML record of a submission"""
+    submission = Submission.with_content().filter_by(id=submission_id).first()
+    if submission is None:  # Purged before the job ran
+        return
+    assignment = db.session.get(Assignment, submission.assignment_id)
+    student = db.session.get(User, submission.student_id)
+    html_doc = render_template('submission_archive.html', submission=submission, assignment=assignment,
+                               student=student, content=submission.content)
+    key = upload_storage().put_bytes(html_doc.encode('utf-8'), 'html')
+    if key != submission.archive_filename:
+        _replace_submission_file(submission_id, Submission.archive_filename, submission.archive_filename, key)
+    logger.info(f"Stored HTML record of submission {submission_id} as {key}")
+
+@job_handler('process_screenshot')
+def process_screenshot(submission_id, screenshot=None):
+    """Replace an uploaded screenshot with a WebP of bounded resolution"""
+    current = db.session.query(Submission.screenshot_filename).filter(Submission.id == submission_id).scalar()
+    screenshot = screenshot or current  # Jobs queued before screenshots were stored by key
+    if not screenshot or current != screenshot or screenshots.Image is None:
+        # Replaced or purged since, or kept as uploaded (its signature was checked on receipt)
+        return
+    uploads = upload_storage()
+    fd, target = tempfile.mkstemp(dir=uploads.staging_dir(), suffix='.webp')
+    os.close(fd)
+    try:
+        # A missing file raises FileNotFoundError, so the job is retried
+        with uploads.local_copy(screenshot) as source:
+            screenshots.reencode(source, target)
+        processed = uploads.put_file(target, 'webp')
+    except screenshots.NotAnImage as e:
+        logger.warning(f"Screenshot {screenshot} of submission {submission_id} could not be decoded, removing it: {e}")
+        processed = None
+    finally:
+        if os.path.exists(target):
+            os.remove(target)
+    # The archive links to the screenshot by key
+    _replace_submission_file(submission_id, Submission.screenshot_filename, screenshot, processed,
+                             then=lambda: enqueue_job('archive_submission', {'submission_id': submission_id}))
+
+@job_handler('extract_answers')
+def extract_submission_answers(submission_id):
+    """Store the answer rows of a new submission"""
+    submission = Submission.with_content().filter_by(id=submission_id).first()
+    if submission is None or (submission.answers_version or 0) >= answer_extraction.EXTRACTOR_VERSION:
+        return
+    answers = submission_answers(submission)
+
+    def write():
+        current = Submission.query.options(load_only(
+            Submission.id, Submission.assignment_id)).filter_by(id=submission_id).first()
+        if current:
+            store_answers(current, answers)
+            invalidate_stats([current.assignment_id], answers=True)
+    db_writer.run(db.session, write)
+
+@job_handler('notify_submission')
+def notify_submission(submission_id):
+    """Fan a new submission out to every webhook, each delivered (and retried) on its own"""
+    submission = Submission.query.options(load_only(
+        Submission.id, Submission.assignment_id, Submission.student_id, Submission.submitted_at
+    )).filter_by(id=submission_id).first()
+    if submission is None:
+        return
+    body = {
+        'event': 'submission.created',
+        'submission_id': submission.id,
+        'assignment_id': submission.assignment_id,
+        'student_id': submission.student_id,
+        'submitted_at': submission.submitted_at.isoformat(),
+    }
+
+    def fan_out():
+        for url in app.config['NOTIFY_WEBHOOK_URLS']:
+            enqueue_job('deliver_webhook', {'url': url, 'body': body})
+    db_writer.run(db.session, fan_out)
+
+@job_handler('deliver_webhook')
+def deliver_webhook(url, body):
+    webhook_request = urllib.request.Request(url, data=json.dumps(body).encode('utf-8'), method='POST',
+                                             headers={'Content-Type': 'application/json'})
+    # Error statuses raise HTTPError, so the delivery is retried
+    with urllib.request.urlopen(webhook_request, timeout=WEBHOOK_TIMEOUT_SECONDS) as response:
+        response.read()
+
+def enqueue_submission_jobs(submission):
+    """Queue the follow-up work for a new submission (caller commits)"""
+    enqueue_job('extract_answers', {'submission_id': submission.id})
+    enqueue_job('archive_submission', {'submission_id': submission.id})
+    if submission.screenshot_filename:
+        enqueue_job('process_screenshot', {'submission_id': submission.id,
+                                           'screenshot': submission.screenshot_filename})
+    if app.config['NOTIFY_WEBHOOK_URLS']:
+        enqueue_job('notify_submission', {'submission_id': submission.id})
+
+# Background compression of rows written before html_content and submission
+# content were stored compressed. Each batch is its own short write.
+COMPRESS_BATCH_SIZE = 50
+app.config.setdefault('BACKFILL_IN_BACKGROUND', True)
+
+def rewrite_compressed_columns(batch_size=COMPRESS_BATCH_SIZE):
+    """Compress every row still holding plain text; returns the number of rows rewritten"""
+    rewritten = 0
+    for column in (Assignment.__table__.c.html_content, Submission.__table__.c.content):
+        table = column.table
+        pending = select(table.c.id, column).where(
+            column.isnot(None),
+            compressed_text.uncompressed_filter(column, db.engine.dialect.name)
+        ).order_by(table.c.id).limit(batch_size)
+        update = table.update().where(table.c.id == bindparam('row_id')).values({column.name: bindparam('value')})
+        while True:
+            def write_batch():
+                rows = db.session.execute(pending).fetchall()
+                if rows:
+                    # Reading decodes the plain text; writing it back compresses it
+                    db.session.execute(update, [{'row_id': row[0], 'value': row[1]} for row in rows])
+                return len(rows)
+            count = db_writer.run(db.session, write_batch)
+            if not count:
+                break
+            rewritten += count
+    if rewritten:
+        logger.info(f"Compressed {rewritten} rows of large text columns")
+    return rewritten
+
+@app.cli.command('compress-columns')
+def compress_columns_command():
+    """Compress assignment and submission rows written before compression"""
+    print(f"Compressed rows: {rewrite_compressed_columns()}")
+
+# Uploads written before storage by content key keep their flat names in
+# UPLOAD_FOLDER; this moves each into the configured backend and repoints its rows
+UPLOAD_COLUMNS = (Assignment.html_filename, Submission.screenshot_filename, Submission.archive_filename)
+
+def migrate_legacy_uploads():
+    """Store flat-named uploads by content key; returns the number of files moved"""
+    legacy = storage.LocalStorage(app.config['UPLOAD_FOLDER'])
+    uploads = upload_storage()
+    names = set()
+    for column in UPLOAD_COLUMNS:
+        names.update(row[0] for row in db.session.query(column).filter(column.isnot(None)).distinct())
+    moved = 0
+    for name in sorted(names):
+        if storage.is_content_key(name) or not legacy.exists(name):
+            continue
+        fd, copy = tempfile.mkstemp(dir=uploads.staging_dir())
+        os.close(fd)
+        shutil.copyfile(legacy.path(name), copy)
+        key = uploads.put_file(copy, os.path.splitext(name)[1] or 'bin')
+
+        def repoint():
+            for column in UPLOAD_COLUMNS:
+                db.session.execute(db.update(column.class_).where(column == name).values(
+                    {column.key: key}).execution_options(synchronize_session=False))
+        db_writer.run(db.session, repoint)
+        legacy.delete(name)
+        _remove_thumbnail(name)
+        moved += 1
+    return moved
+
+@app.cli.command('migrate-uploads')
+def migrate_uploads_command():
+    """Move uploads stored under flat names into content-addressed storage"""
+    print(f"Files moved: {migrate_legacy_uploads()}")
+
+# Answer extraction backfill for submissions made before extraction existed, or
+# extracted by an older answer_extraction.EXTRACTOR_VERSION
+ANSWER_BATCH_SIZE = 50
+
+def backfill_answers(batch_size=ANSWER_BATCH_SIZE):
+    """Extract answers for every submission that needs it; returns the number processed"""
+    processed = 0
+    last_id = 0
+    while True:
+        batch = Submission.with_content().filter(
+            Submission.id > last_id,
+            db.or_(Submission.answers_version.is_(None),
+                   Submission.answers_version < answer_extraction.EXTRACTOR_VERSION)
+        ).order_by(Submission.id).limit(batch_size).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+        # Parse outside the write lock; only the inserts are serialized
+        extracted = [(submission.id, submission_answers(submission)) for submission in batch]
+
+        def write_batch():
+            for submission_id, answers in extracted:
+                submission = Submission.query.options(load_only(
+                    Submission.id, Submission.assignment_id)).get(submission_id)
+                if submission:  # Not purged in the meantime
+                    store_answers(submission, answers)
+            invalidate_stats([submission.assignment_id for submission in batch], answers=True)
+        db_writer.run(db.session, write_batch)
+        processed += len(batch)
+    if processed:
+        logger.info(f"Extracted answers for {processed} submissions")
+    return processed
+
+@app.cli.command('extract-answers')
+def extract_answers_command():
+    """Extract answers from submissions that have none or were extracted by an older version"""
+    print(f"Submissions processed: {backfill_answers()}")
+
+# Automatic grading of a whole assignment against its worksheet's answer key
+AUTOGRADE_EXTRACT_BATCH_SIZE = 200
+
+def _extract_pending_answers(assignment_id):
+    """Bring the answer rows of an assignment's submissions up to date before grading
+
+    Runs in the request, but only for submissions whose extract_answers job has not
+    run yet, so it is normally a single indexed query.
+    """
+    while True:
+        # Find the ids first so content is only read when something is pending
+        ids = [row[0] for row in db.session.query(Submission.id).filter(
+            Submission.assignment_id == assignment_id,
+            db.or_(Submission.answers_version.is_(None),
+                   Submission.answers_version < answer_extraction.EXTRACTOR_VERSION)
+        ).order_by(Submission.id).limit(AUTOGRADE_EXTRACT_BATCH_SIZE)]
+        if not ids:
+            return
+        batch = Submission.with_content().filter(Submission.id.in_(ids)).order_by(Submission.id).all()
+        extracted = [submission_answers(submission) for submission in batch]
+
+        def write_batch():
+            for submission, answers in zip(batch, extracted):
+                store_answers(submission, answers)
+            invalidate_stats([assignment_id], answers=True)
+        db_writer.run(db.session, write_batch)
+
+def bulk_update_submissions(updates):
+    """UPDATE many submissions by primary key; each update is a dict with 'id' and the columns to set"""
+    by_columns = {}
+    for update in updates:
+        by_columns.setdefault(frozenset(update), []).append(update)
+    # One executemany per distinct set of columns
+    for rows in by_columns.values():
+        db.session.execute(db.update(Submission), rows)
+
+def autograde_assignment(assignment_id, regrade=False):
+    """Grade every submission of an assignment in one pass; None if the worksheet has no answer key
+
+    Submissions that already have a grade keep it unless `regrade` is set.
+    """
+    assignment = Assignment.query.options(load_only(Assignment.id, Assignment.answer_key)).get(assignment_id)
+    if assignment is None or not assignment.answer_key:
+        return None
+    answer_key = assignment.answer_key
+    _extract_pending_answers(assignment_id)
+
+    query = db.session.query(Submission.id, Submission.feedback).filter(Submission.assignment_id == assignment_id)
+    if not regrade:
+        query = query.filter(Submission.grade.is_(None))
+    targets = query.all()
+    if not targets:
+        return {'graded': 0, 'questions': len(answer_key), 'average': None}
+
+    answer_rows = db.session.query(Answer.submission_id, Answer.question_key, Answer.value).filter(
+        Answer.assignment_id == assignment_id, Answer.question_key.in_(list(answer_key))
+    )
+    scores = autograde.score_submissions(answer_key, answer_rows, [row.id for row in targets])
+    updates = []
+    for submission_id, feedback in targets:
+        correct, total = scores[submission_id]
+        update = {'id': submission_id, 'grade': round(100.0 * correct / total, 1)}
+        if not feedback or feedback.startswith('Auto-graded:'):
+            update['feedback'] = f'Auto-graded: {correct}/{total} correct'
+        updates.append(update)
+
+    def write_grades():
+        bulk_update_submissions(updates)
+        invalidate_stats([assignment_id])
+        bump_cache_versions(assignments=[assignment_id])
+    db_writer.run(db.session, write_grades)
+
+    grades = [u['grade'] for u in updates]
+    logger.info(f"Auto-graded {len(grades)} submissions of assignment {assignment_id}")
+    return {'graded': len(grades), 'questions': len(answer_key), 'average': round(sum(grades) / len(grades), 1)}
+
+@app.cli.command('autograde')
+@click.argument('assignment_id', type=int)
+@click.option('--regrade', is_flag=True, help='Also replace existing grades')
+def autograde_command(assignment_id, regrade):
+    """Grade an assignment's submissions against its worksheet's answer key"""
+    print(autograde_assignment(assignment_id, regrade=regrade) or 'The worksheet has no answer key')
+
+# Most grades accepted by one batch grading request
+MAX_GRADE_BATCH = 500
+
+def parse_grade_entries(entries):
+    """Validate (submission_id, grade, feedback) tuples; returns (updates, errors)
+
+    A feedback of None leaves the stored feedback unchanged.
+    """
+    updates = {}
+    errors = []
+    for submission_id, grade, feedback in entries:
+        try:
+            submission_id = int(submission_id)
+            grade = float(grade)
+        except (TypeError, ValueError):
+            errors.append(f'Invalid grade {grade!r} for submission {submission_id!r}')
+            continue
+        if not 0 <= grade <= 1000:
+            errors.append(f'Grade {grade} for submission {submission_id} is out of range')
+            continue
+        update = {'id': submission_id, 'grade': grade}
+        if feedback is not None:
+            update['feedback'] = str(feedback)
+        updates[submission_id] = update  # A later entry for the same submission wins
+    return list(updates.values()), errors
+
+def apply_grades(entries, user):
+    """Grade many submissions in one transaction, or none of them; returns (graded, errors)"""
+    if len(entries) > MAX_GRADE_BATCH:
+        return 0, [f'At most {MAX_GRADE_BATCH} grades can be saved at once']
+    updates, errors = parse_grade_entries(entries)
+    if errors or not updates:
+        return 0, errors
+
+    # One query checks that every submission exists and belongs to one of the user's assignments
+    owners = {row.id: row for row in db.session.query(
+        Submission.id, Submission.assignment_id, Submission.student_id, Assignment.created_by
+    ).join(
+        Assignment, Submission.assignment_id == Assignment.id
+    ).filter(Submission.id.in_([u['id'] for u in updates]), Assignment.deleted_at.is_(None))}
+    for update in updates:
+        if update['id'] not in owners:
+            errors.append(f"Submission {update['id']} not found")
+        elif user.role != 'admin' and owners[update['id']].created_by != user.id:
+            errors.append(f"You can only grade submissions to assignments that you created ({update['id']})")
+    if errors:
+        return 0, errors
+
+    def write_grades():
+        bulk_update_submissions(updates)
+        invalidate_stats(row.assignment_id for row in owners.values())
+        bump_cache_versions(students={row.student_id for row in owners.values()})
+    db_writer.run(db.session, write_grades)
+    logger.info(f"User {user.id} graded {len(updates)} submissions in one batch")
+    return len(updates), []
+
+# Teacher analytics, materialized in assignment_stats. Students scheduled for purge
+# are left out; deleting one invalidates the statistics of their assignments.
+def _compute_grade_stats(assignment_id):
+    grades = [row[0] for row in db.session.query(Submission.grade).join(
+        User, Submission.student_id == User.id
+    ).filter(Submission.assignment_id == assignment_id, User.deleted_at.is_(None))]
+    return analytics.grade_statistics(grades)
+
+def _with_completion(assignment_id, grade_stats):
+    # Allocations change outside grading, so the completion rate is not materialized
+    allocated = db.session.query(func.count()).select_from(student_assignment).join(
+        User, User.id == student_assignment.c.student_id
+    ).filter(student_assignment.c.assignment_id == assignment_id, User.deleted_at.is_(None)).scalar()
+    return dict(grade_stats, allocated=allocated,
+                completion_rate=analytics.completion_rate(grade_stats['submitted'], allocated))
+
+def _compute_question_stats(assignment_id, answer_key):
+    # Answers of other submissions are ignored by question_statistics
+    submission_ids = [row[0] for row in db.session.query(Submission.id).join(
+        User, Submission.student_id == User.id
+    ).filter(Submission.assignment_id == assignment_id, User.deleted_at.is_(None)).order_by(Submission.id)]
+    rows = db.session.query(Answer.submission_id, Answer.question_key, Answer.value).filter(
+        Answer.assignment_id == assignment_id)
+    question_keys = ()
+    if answer_key:
+        rows = rows.filter(Answer.question_key.in_(list(answer_key)))
+    else:
+        question_keys = [row[0] for row in db.session.query(Answer.question_key).filter(
+            Answer.assignment_id == assignment_id).distinct()]
+    return analytics.question_statistics(answer_key, rows, submission_ids, question_keys)
+
+def assignment_statistics(assignment_id):
+    """{'grades': ..., 'questions': ...} for an assignment, recomputing only the parts invalidated since last time"""
+    _extract_pending_answers(assignment_id)
+    stats = AssignmentStats.query.get(assignment_id)
+    if stats is None:
+        try:
+            db_writer.run(db.session, lambda: db.session.add(AssignmentStats(assignment_id=assignment_id, version=0)))
+        except IntegrityError:
+            db.session.rollback()  # Created by a concurrent request
+        stats = AssignmentStats.query.get(assignment_id)
+    version, grade_stats, question_stats = stats.version, stats.grade_stats, stats.question_stats
+    if grade_stats is not None and question_stats is not None:
+        return {'grades': _with_completion(assignment_id, grade_stats), 'questions': question_stats,
+                'computed_at': stats.computed_at}
+
+    if grade_stats is None:
+        grade_stats = _compute_grade_stats(assignment_id)
+    if question_stats is None:
+        answer_key = db.session.query(Assignment.answer_key).filter(Assignment.id == assignment_id).scalar()
+        question_stats = _compute_question_stats(assignment_id, answer_key)
+    computed_at = datetime.utcnow()
+
+    def store():
+        # Skipped if an invalidation arrived while computing; the next view recomputes
+        db.session.execute(db.update(AssignmentStats).where(
+            AssignmentStats.assignment_id == assignment_id, AssignmentStats.version == version
+        ).values(grade_stats=grade_stats, question_stats=question_stats, computed_at=computed_at
+                 ).execution_options(synchronize_session=False))
+    db_writer.run(db.session, store)
+    return {'grades': _with_completion(assignment_id, grade_stats), 'questions': question_stats,
+            'computed_at': computed_at}
+
+def start_backfill_worker():
+    """Bring rows left behind by a migration up to date off the request thread"""
+    if not app.config['BACKFILL_IN_BACKGROUND']:
+        return
+
+    def worker():
+        with app.app_context():
+            for backfill in (rewrite_compressed_columns, backfill_answers):
+                try:
+                    backfill()
+                except Exception as e:
+                    logger.error(f"Background {backfill.__name__} failed: {e}")
+                    db.session.rollback()
+            db.session.remove()
+
+    threading.Thread(target=worker, name='backfill-worker', daemon=True).start()
 
 # Setup Flask-Login
 login_manager = LoginManager()
@@ -145,7 +1598,9 @@ login_manager.session_protection = 'strong'
 @login_manager.user_loader
 def load_user(user_id):
     try:
-        return User.query.get(int(user_id))
+        user = User.query.get(int(user_id))
+        # Users scheduled for purge are logged out immediately
+        return user if user and user.deleted_at is None else None
     except Exception as e:
         logger.error(f"Error loading user {user_id}: {e}")
         return None
@@ -171,16 +1626,114 @@ def health_check():
         'version': '1.0'
     }), 200
 
-# Route to serve files from uploads directory
+# Fingerprinted names never change meaning, so any cache may keep them for a year
+ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+@app.route('/assets/<path:filename>')
+def static_asset(filename):
+    """A stylesheet or script under its fingerprinted name, see asset_url()"""
+    try:
+        path, current = asset_fingerprints.resolve(filename)
+        # A page from before the file changed still gets it, but revalidated instead of kept
+        etag = asset_fingerprints.fingerprint(path) if current else True
+        response = send_file(asset_fingerprints.file_path(path), etag=etag, conditional=False)
+    except FileNotFoundError:
+        return "File not found", 404
+    if current:
+        response.headers['Cache-Control'] = ASSET_CACHE_CONTROL
+    return response.make_conditional(request)
+
+# A content key never changes meaning, so browsers keep those files without revalidating;
+# flat legacy names revalidate against their modification time
+UPLOAD_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+# Route to serve uploaded files by storage key (or legacy flat name), with ETags and Range requests
 @app.route('/uploads/<path:filename>')
 def serve_uploaded_file(filename):
+    uploads = upload_storage()
+    # A content key is its own strong validator, so a revalidation needs no storage access
+    etag = filename.rsplit('.', 1)[0] if storage.is_content_key(filename) else None
+    if etag and request.if_none_match.contains(etag):
+        response = Response(status=304, headers={'Cache-Control': UPLOAD_CACHE_CONTROL})
+        response.set_etag(etag)
+        return response
+    
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
     try:
-        return send_from_directory('uploads', filename)
+        path = uploads.local_path(filename)
+        if path is None:
+            size = uploads.size(filename)
+            response = Response(uploads.chunks(filename), mimetype=mimetype, direct_passthrough=True)
+            response.content_length = size
+        elif app.config['UPLOADS_ACCEL_REDIRECT']:
+            stat = os.stat(path)
+            response = Response(mimetype=mimetype)
+            response.headers['X-Accel-Redirect'] = (app.config['UPLOADS_ACCEL_REDIRECT'].rstrip('/') + '/'
+                                                    + uploads.relative_path(filename))
+            response.last_modified = stat.st_mtime
+            response.cache_control.no_cache = True
+            response.set_etag(etag or f'{stat.st_mtime}-{stat.st_size}')
+        else:
+            # Sets X-Sendfile instead of a body when USE_X_SENDFILE is on
+            response = send_file(path, mimetype=mimetype, etag=etag or True, conditional=False)
+    except (KeyError, FileNotFoundError):
+        return "File not found", 404
     except Exception as e:
         logger.error(f"Error serving file {filename}: {e}")
         return "File not found", 404
+    
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = UPLOAD_CACHE_CONTROL
+    # The proxy answers Range requests for the files it sends
+    offloaded = 'X-Sendfile' in response.headers or 'X-Accel-Redirect' in response.headers
+    try:
+        response = response.make_conditional(request, accept_ranges=not offloaded,
+                                             complete_length=None if offloaded else response.content_length)
+    except RequestedRangeNotSatisfiable as e:
+        response.close()
+        return e.get_response()
+    if response.status_code == 304:
+        response.headers.pop('X-Sendfile', None)
+        response.headers.pop('X-Accel-Redirect', None)
+    return response
 
 # Database initialization function
+def upgrade_schema():
+    """Create the tables of an empty database or apply pending migrations; returns the versions applied"""
+    # A stamped, up-to-date schema needs no reflection at all
+    schema_version = migrations.get_schema_version(db.engine)
+    if schema_version == migrations.latest_version():
+        logger.info(f"Database schema is at version {schema_version}, preserving data")
+        return []
+    # Import inspect to check if tables exist
+    from sqlalchemy import inspect
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names()) - {migrations.SCHEMA_VERSION_TABLE}
+    
+    # Only create tables if they don't exist
+    if not existing_tables:
+        logger.info("Creating database tables...")
+        db.create_all()
+        migrations.stamp(db.engine)
+        logger.info("Database tables created successfully")
+        return []
+    logger.info("Database tables already exist, applying pending migrations")
+    applied = migrations.upgrade(db.engine)
+    logger.info(f"Applied migrations: {applied or 'none'}")
+    return applied
+
+@app.cli.command('db-upgrade')
+@click.option('--no-backfill', is_flag=True, help='Leave rows written before the migrations to the web workers')
+def db_upgrade_command(no_backfill):
+    """Create or migrate the database schema; run before starting the web and worker processes"""
+    applied = upgrade_schema()
+    print(f"Applied migrations: {applied or 'none'}")
+    print(f"Schema version: {migrations.get_schema_version(db.engine)}")
+    if applied and not no_backfill:
+        for backfill in (rewrite_compressed_columns, backfill_answers):
+            backfill()
+
 def init_database():
     with app.app_context():
         try:
@@ -189,18 +1742,10 @@ def init_database():
             db.session.execute(text('SELECT 1'))
             logger.info("Database connection successful")
             
-            # Import inspect to check if tables exist
-            from sqlalchemy import inspect
-            inspector = inspect(db.engine)
-            existing_tables = inspector.get_table_names()
-            
-            # Only create tables if they don't exist
-            if not existing_tables:
-                logger.info("Creating database tables...")
-                db.create_all()
-                logger.info("Database tables created successfully")
-            else:
-                logger.info("Database tables already exist, preserving data")
+            if upgrade_schema():
+                start_backfill_worker()
+            # Jobs left queued or interrupted when the server last stopped
+            start_job_worker()
             
             # Create admin user if it doesn't exist
             admin_user = User.query.filter_by(username='admin').first()
@@ -231,7 +1776,7 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
-        user = User.query.filter_by(username=username).first()
+        user = User.query.filter_by(username=username, deleted_at=None).first()
         if user and user.check_password(password):
             login_user(user, remember=True)
             session.permanent = True  # Make session permanent
@@ -244,7 +1789,7 @@ def login():
         else:
             flash(_('Invalid username or password'))
     
-    return render_template('login.html')
+    return cached_page([], lambda: (render_cacheable('login.html'), None))
 
 @app.route('/logout')
 @login_required
@@ -282,7 +1827,7 @@ def register():
         except:
             flash(_('Registration failed. Please try again.'))
     
-    return render_template('register.html')
+    return cached_page([], lambda: (render_cacheable('register.html'), None))
 
 @app.route('/student_dashboard')
 @login_required
@@ -293,39 +1838,34 @@ def student_dashboard():
         if current_user.role == 'student':
             logger.debug(f"Student user detected - ID: {current_user.id}")
             
-            # Get assignments assigned to this student
-            logger.debug("Querying assignments for student...")
-            assignments = Assignment.query.join(
-                student_assignment, 
-                Assignment.id == student_assignment.c.assignment_id
-            ).filter(
-                student_assignment.c.student_id == current_user.id,
-                Assignment.is_active == True
-            ).all()
-            
-            logger.debug(f"Found {len(assignments)} assignments for student")
-            
-            # Get submission status for each assignment
-            assignment_submissions = {}
-            for assignment in assignments:
-                logger.debug(f"Checking submission for assignment {assignment.id}: {assignment.title}")
-                submission = Submission.query.filter_by(
-                    assignment_id=assignment.id, 
-                    student_id=current_user.id
-                ).first()
-                assignment_submissions[assignment.id] = submission
-                logger.debug(f"Submission status for assignment {assignment.id}: {'Found' if submission else 'Not found'}")
-            
-            logger.debug("Rendering student dashboard template")
-            return render_template('student_dashboard.html', 
-                                 assignments=assignments,
-                                 assignment_submissions=assignment_submissions)
+            def render():
+                # Get assignments and submission status for this student in one query
+                logger.debug("Querying dashboard rows for student...")
+                assignments = get_student_dashboard_rows(current_user.id)
+                logger.debug(f"Found {len(assignments)} assignments for student")
+                # Kept until the next assignment turns overdue at the latest
+                return (render_cacheable('student_dashboard.html', assignments=assignments),
+                        seconds_until_overdue(assignments))
+
+            # Changes with the student's submissions and grades and with their allocated assignments
+            return cached_page(get_student_page_versions(current_user.id), render)
         else:
             logger.debug(f"Teacher/admin user detected - showing all assignments")
-            # For teachers/admin, show all assignments and submissions
-            assignments = Assignment.query.all()
-            logger.debug(f"Found {len(assignments)} total assignments for teacher/admin")
-            return render_template('student_dashboard.html', assignments=assignments)
+            cursor, page_size = request.args.get('cursor'), get_page_size()
+
+            def render():
+                # For teachers/admin, show all assignments and submissions
+                # Only the columns the dashboard card shows; html_content stays deferred
+                query = Assignment.query.options(load_only(
+                    Assignment.id, Assignment.title, Assignment.description, Assignment.is_active,
+                    Assignment.created_at, Assignment.due_date, Assignment.created_by
+                )).filter(Assignment.deleted_at.is_(None))
+                page = keyset_paginate(query, [Assignment.created_at, Assignment.id], cursor, page_size)
+                logger.debug(f"Showing {len(page.items)} assignments for teacher/admin")
+                return render_cacheable('student_dashboard.html', assignments=page.items, page=page), None
+
+            # Changes whenever an assignment is created or deleted
+            return cached_page([cursor, page_size] + get_cache_versions(('listing', 0)), render)
             
     except Exception as e:
         logger.error(f"Error in student_dashboard: {str(e)}", exc_info=True)
@@ -339,7 +1879,8 @@ def create_assignment():
         flash(_('Access denied'))
         return redirect(url_for('student_dashboard'))
     
-    students = User.query.filter_by(role='student').all()
+    # The form only lists names, so skip loading the rest of each user row
+    students = User.query.options(load_only(User.id, User.username)).filter_by(role='student').all()
     
     if request.method == 'POST':
         title = request.form['title']
@@ -355,65 +1896,90 @@ def create_assignment():
         if due_date_str:
             due_date = datetime.strptime(due_date_str, '%Y-%m-%dT%H:%M')
         
-        new_assignment = Assignment(
-            title=title,
-            description=description,
-            created_by=current_user.id,
-            due_date=due_date,
-            is_active=is_active
-        )
+        # Handle HTML file upload (required for all assignments)
+        if not html_file or not html_file.filename:
+            flash(_('HTML file is required for assignments'))
+            return render_template('create_assignment.html', students=students)
+        if not html_file.filename.endswith('.html'):
+            flash(_('Only HTML files are allowed for assignments'))
+            return render_template('create_assignment.html', students=students)
         
-        try:
+        def write_assignment():
+            new_assignment = Assignment(
+                title=title,
+                description=description,
+                created_by=current_user.id,
+                due_date=due_date,
+                is_active=is_active
+            )
             db.session.add(new_assignment)
             db.session.flush()  # Get the assignment ID
             
-            # Handle HTML file upload (required for all assignments)
-            if html_file and html_file.filename:
-                if html_file.filename.endswith('.html'):
-                    # Save the HTML file
-                    filename = f"assignment_{new_assignment.id}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.html"
-                    filepath = os.path.join('uploads', filename)
-                    html_file.save(filepath)
-                    
-                    # Read the HTML content for display
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        html_content = f.read()
-                    
-                    new_assignment.html_filename = filename
-                    new_assignment.html_content = html_content
-                else:
-                    flash(_('Only HTML files are allowed for assignments'))
-                    return render_template('create_assignment.html', students=students)
-            else:
-                flash(_('HTML file is required for assignments'))
-                return render_template('create_assignment.html', students=students)
-            
-            # Assign to selected students
-            if selected_student_ids:
-                for student_id in selected_student_ids:
-                    student = User.query.get(int(student_id))
-                    if student and student.role == 'student':
-                        new_assignment.assigned_students.append(student)
-            else:
-                # If no students selected, assign to all students
-                for student in students:
-                    new_assignment.assigned_students.append(student)
+            new_assignment.html_filename = html_key
+            new_assignment.set_html_content(html_content)
+            new_assignment.answer_key = answer_key or None
             
-            db.session.commit()
+            # Assign to selected students (or all students if none selected)
+            allocation = allocate_students(new_assignment.id, selected_student_ids)
+            logger.info(f"Allocated assignment {new_assignment.id} to {allocation['allocated']} students")
+            bump_cache_versions(assignments=[new_assignment.id], listing=True)
+            return new_assignment.content_hash
+        
+        html_key = None
+        try:
+            # Read the HTML content once; the write below may be retried
+            html_content = html_file.read().decode('utf-8')
+            answer_key = autograde.extract_answer_key(html_content)
+            # Stored by content, so the same worksheet uploaded twice is kept once
+            html_key = upload_storage().put_bytes(html_content.encode('utf-8'), 'html')
+            content_hash = db_writer.run(db.session, write_assignment)
+            # Compress once at upload instead of on the first student's request
+            variant_cache.warm(content_hash, html_content.encode('utf-8'))
             flash(_('Assignment created successfully'))
             return redirect(url_for('student_dashboard'))
         except Exception as e:
             db.session.rollback()
+            if html_key:
+                release_unused_uploads([html_key])
             flash(_('Failed to create assignment'))
             logger.error(f"Error creating assignment: {e}")
             logger.exception("Detailed error traceback:")
     
     return render_template('create_assignment.html', students=students)
 
+@app.route('/api/assignments/<int:assignment_id>/allocate', methods=['POST'])
+@login_required
+def api_allocate_students(assignment_id):
+    """Allocate an assignment to a cohort: {"student_ids": [...]} or {"all_students": true}"""
+    if current_user.role not in ['admin', 'teacher']:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    assignment = Assignment.query.options(load_only(Assignment.id, Assignment.created_by)).filter_by(id=assignment_id, deleted_at=None).first_or_404()
+    if current_user.role != 'admin' and assignment.created_by != current_user.id:
+        return jsonify({'error': 'You can only allocate assignments that you created'}), 403
+    
+    payload = request.get_json(silent=True) or {}
+    student_ids = payload.get('student_ids') or []
+    if not isinstance(student_ids, list):
+        return jsonify({'error': 'student_ids must be a list'}), 400
+    if not student_ids and not payload.get('all_students'):
+        return jsonify({'error': 'Provide student_ids or set all_students'}), 400
+    
+    try:
+        allocation = allocate_students(assignment_id, student_ids)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error allocating assignment {assignment_id}: {e}")
+        return jsonify({'error': 'Failed to allocate students'}), 500
+    
+    return jsonify(allocation), 200
+
 @app.route('/view_assignment/<int:assignment_id>')
 @login_required
 def view_assignment(assignment_id):
-    assignment = Assignment.query.get_or_404(assignment_id)
+    # The worksheet and any submission are loaded by their own URLs, not inlined
+    assignment = Assignment.query.filter_by(id=assignment_id, deleted_at=None).first_or_404()
     
     # Check if student has access to this assignment
     if current_user.role == 'student':
@@ -427,25 +1993,30 @@ def view_assignment(assignment_id):
             flash(_('Access denied - this assignment is not assigned to you'))
             return redirect(url_for('student_dashboard'))
     
-    # Get submission for current user
-    submission = None
-    if current_user.role == 'student':
-        submission = Submission.query.filter_by(
-            assignment_id=assignment_id, 
-            student_id=current_user.id
-        ).first()
+    def render():
+        # Get submission for current user
+        submission = None
+        if current_user.role == 'student':
+            submission = Submission.query.filter_by(
+                assignment_id=assignment_id, 
+                student_id=current_user.id
+            ).first()
+        
+        # All assignments are HTML assignments - redirect to interactive view
+        return render_cacheable('interactive_assignment.html', 
+                                assignment=assignment, 
+                                submission=submission), None
     
-    # All assignments are HTML assignments - redirect to interactive view
-    return render_template('interactive_assignment.html', 
-                         assignment=assignment, 
-                         submission=submission)
+    # Changes with the assignment and with the viewer's submission and its grade
+    versions = get_cache_versions(('assignment', assignment_id), ('student', current_user.id))
+    return cached_page([assignment_id] + versions, render)
 
 @app.route('/submit_html_assignment/<int:assignment_id>', methods=['POST'])
 @login_required
 def submit_html_assignment(assignment_id):
     if request.method == 'POST':
         # Check if assignment exists
-        assignment = Assignment.query.get_or_404(assignment_id)
+        assignment = Assignment.query.filter_by(id=assignment_id, deleted_at=None).first_or_404()
         
         # Check if student has access to this assignment
         if current_user.role == 'student':
@@ -474,190 +2045,63 @@ def submit_html_assignment(assignment_id):
             return redirect(url_for('view_assignment', assignment_id=assignment_id))
         
         content = request.form['content']
-        print(f"[DEBUG] Received content length: {len(content)}")
-        print(f"[DEBUG] Content preview (first 500 chars): {content[:500]}")
+        logger.debug(f"Received content length: {len(content)}")
         
         # Check if content contains form values
         if '<textarea' in content and 'value=' not in content:
-            print("[WARNING] Content may not contain filled form values")
+            logger.warning("Content may not contain filled form values")
         
-        # Handle screenshot upload if provided
+        # Handle screenshot upload if provided (a binary multipart part, re-encoded by a job)
         screenshot_filename = None
-        if 'screenshot' in request.files:
-            screenshot = request.files['screenshot']
-            if screenshot and screenshot.filename:
-                if screenshot.filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
-                    screenshot_filename = f"screenshot_{assignment_id}_{current_user.id}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.{screenshot.filename.split('.')[-1]}"
-                    try:
-                        screenshot.save(os.path.join('uploads', screenshot_filename))
-                    except Exception as e:
-                        print(f"Error saving screenshot: {e}")
-                        screenshot_filename = None  # Continue without screenshot
-        
-        new_submission = Submission(
-            assignment_id=assignment_id,
-            student_id=current_user.id,
-            content=content,
-            screenshot_filename=screenshot_filename,
-            submitted_at=datetime.utcnow()
-        )
-        
-        try:
-            db.session.add(new_submission)
-            db.session.commit()
-            
-            # Generate HTML file for submission
+        screenshot = request.files.get('screenshot')
+        if screenshot and screenshot.filename:
             try:
-                # Generate HTML file for submission using format() instead of f-string
-                html_template = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>HTML Assignment Submission - {assignment_title}</title>
-    <style>
-        :root {{
-            --background-color: #ffffff !important;
-            --text-color: #000000 !important;
-            --code-background: #f5f5f5 !important;
-            --code-text: #000000 !important;
-        }}
+                screenshot_filename = store_screenshot(screenshot.stream)
+            except (screenshots.UploadTooLarge, screenshots.NotAnImage) as e:
+                logger.warning(f"Ignoring screenshot for assignment {assignment_id}: {e}")
+            except OSError as e:
+                logger.error(f"Error saving screenshot: {e}")  # Continue without screenshot
         
-        * {{
-            background-color: var(--background-color) !important;
-            color: var(--text-color) !important;
-        }}
-        
-        body {{
-            font-family: Arial, sans-serif;
-            line-height: 1.6;
-            padding: 20px;
-            max-width: 1200px;
-            margin: 0 auto;
-        }}
-        
-        .header {{
-            background-color: #4a6fa5 !important;
-            color: white !important;
-            padding: 20px;
-            border-radius: 8px;
-            margin-bottom: 20px;
-            color: #333 !important;
-        }}
-        
-        .header h1 {{
-            margin: 0 0 10px 0;
-            color: white !important;
-        }}
-        
-        .submission-info {{
-            background-color: #f9f9f9 !important;
-            padding: 15px;
-            border-radius: 4px;
-            margin-bottom: 20px;
-            color: #333 !important;
-        }}
-        
-        .content-section {{
-            background-color: #f9f9f9 !important;
-            padding: 20px;
-            border-radius: 8px;
-            margin-bottom: 20px;
-        }}
-        
-        .content-section h2 {{
-            color: #4a6fa5 !important;
-            margin-top: 0;
-        }}
-        
-        pre {{
-            background-color: var(--code-background) !important;
-            color: var(--code-text) !important;
-            padding: 15px;
-            border-radius: 5px;
-            overflow-x: auto;
-            font-family: monospace;
-            white-space: pre-wrap;
-        }}
-        
-        .screenshot-section {{
-            margin-top: 20px;
-        }}
+        def write_submission():
+            # Checked again inside the serialized write so a double-click can't submit twice
+            if db.session.query(Submission.id).filter_by(assignment_id=assignment_id, student_id=current_user.id).first():
+                return None
+            submission = Submission(
+                assignment_id=assignment_id,
+                student_id=current_user.id,
+                stored_content=stored_content,
+                content_base_hash=content_base_hash,
+                screenshot_filename=screenshot_filename,
+                submitted_at=datetime.utcnow()
+            )
+            db.session.add(submission)
+            db.session.flush()
+            invalidate_stats([assignment_id], answers=True)
+            bump_cache_versions(students=[current_user.id])
+            # Answers, the HTML archive and notifications follow on the job queue
+            enqueue_submission_jobs(submission)
+            return submission
         
-        .screenshot-section img {{
-            max-width: 100%;
-            height: auto;
-            border: 1px solid #ddd;
-            border-radius: 4px;
-        }}
-    </style>
-</head>
-<body>
-    <div class="header">
-        <h1>HTML Assignment Submission</h1>
-        <p><strong>Assignment:</strong> {assignment_title}</p>
-        <p><strong>Student:</strong> {student_username}</p>
-    </div>
-    
-    <div class="submission-info">
-        <p><strong>Assignment ID:</strong> {assignment_id}</p>
-        <p><strong>Student ID:</strong> {student_id}</p>
-        <p><strong>Submitted at:</strong> {submitted_at}</p>
-    </div>
-    
-    <div class="content-section">
-        <h2>Submitted HTML Content:</h2>
-        <pre>{content}</pre>
-    </div>
-"""
-                
-                # Format the template with actual values
-                html_doc = html_template.format(
-                    assignment_title=assignment.title,
-                    student_username=current_user.username,
-                    assignment_id=assignment_id,
-                    student_id=current_user.id,
-                    submitted_at=new_submission.submitted_at.strftime('%Y-%m-%d %H:%M:%S'),
-                    content=content
-                )
-                
-                # Add screenshot section if screenshot exists
-                if screenshot_filename:
-                    html_doc += f"""
-    <div class="screenshot-section">
-        <h2>Screenshot:</h2>
-        <img src="/uploads/{screenshot_filename}" alt="Submission Screenshot">
-    </div>
-"""
-                
-                html_doc += """
-</body>
-</html>
-"""
-                
-                # Save the HTML file
-                filename = f"html_submission_{assignment_id}_{current_user.id}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.html"
-                try:
-                    with open(os.path.join('uploads', filename), 'w', encoding='utf-8') as f:
-                        f.write(html_doc)
-                        print(f"Saved HTML submission as {filename}")
-                except Exception as e:
-                    print(f"Error saving HTML submission file: {e}")
-                    # Continue without saving the HTML file
-                    
-            except Exception as e:
-                print(f"Error generating HTML submission: {e}")
-                # Continue even if HTML generation fails
-            
-            flash(_('HTML assignment submitted successfully!'))
-            return redirect(url_for('student_dashboard'))
-            
+        try:
+            # Diff against the worksheet before taking the write lock
+            stored_content, content_base_hash = encode_submission_content(content, assignment)
+            new_submission = db_writer.run(db.session, write_submission)
         except Exception as e:
             db.session.rollback()
+            if screenshot_filename:
+                release_unused_uploads([screenshot_filename])
             flash(_('Failed to submit HTML assignment'))
-            print(f"Error submitting HTML assignment: {e}")
+            logger.error(f"Error submitting HTML assignment: {e}")
+            return redirect(url_for('view_assignment', assignment_id=assignment_id))
+        if new_submission is None:
+            if screenshot_filename:
+                release_unused_uploads([screenshot_filename])
+            flash(_('You have already submitted this assignment'))
             return redirect(url_for('view_assignment', assignment_id=assignment_id))
+        
+        start_job_worker()
+        flash(_('HTML assignment submitted successfully!'))
+        return redirect(url_for('student_dashboard'))
     
     return redirect(url_for('view_assignment', assignment_id=assignment_id))
 
@@ -667,89 +2111,28 @@ def submit_assignment(assignment_id):
     if request.method == 'POST':
         content = request.form['content']
         
-        new_submission = Submission(
-            assignment_id=assignment_id,
-            student_id=current_user.id,
-            content=content
-        )
+        def write_submission():
+            submission = Submission(
+                assignment_id=assignment_id,
+                student_id=current_user.id,
+                content=content
+            )
+            db.session.add(submission)
+            db.session.flush()
+            invalidate_stats([assignment_id], answers=True)
+            bump_cache_versions(students=[current_user.id])
+            enqueue_submission_jobs(submission)
         
         try:
-            db.session.add(new_submission)
-            db.session.commit()
-            
-            # Generate HTML file for submission
-            try:
-                # Define the HTML template
-                html_doc = f"""
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Student Submission</title>
-    <style>
-        /* Browser dark mode override */
-        :root {
-            --background-color: #ffffff !important;
-            --text-color: #000000 !important;
-            --code-background: #f5f5f5 !important;
-            --code-text: #000000 !important;
-        }
-        
-        * {
-            background-color: var(--background-color) !important;
-            color: var(--text-color) !important;
-        }
-        
-        body {
-            font-family: Arial, sans-serif;
-            line-height: 1.6;
-            padding: 20px;
-            max-width: 800px;
-            margin: 0 auto;
-        }
-        
-        h1 {
-            color: #2c3e50;
-            border-bottom: 1px solid #ddd;
-            padding-bottom: 10px;
-        }
-        
-        pre {
-            background-color: var(--code-background) !important;
-            color: var(--code-text) !important;
-            padding: 15px;
-            border-radius: 5px;
-            overflow-x: auto;
-            font-family: monospace;
-        }
-    </style>
-</head>
-<body>
-    <h1>Student Submission</h1>
-    <p><strong>Assignment ID:</strong> {assignment_id}</p>
-    <p><strong>Student ID:</strong> {current_user.id}</p>
-    <p><strong>Submitted at:</strong> {new_submission.submitted_at.strftime('%Y-%m-%d %H:%M:%S')}</p>
-    <h2>Content:</h2>
-    <pre>{content}</pre>
-</body>
-</html>
-"""
-                
-                # Save the HTML file
-                filename = f"submission_{assignment_id}_{current_user.id}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.html"
-                with open(filename, 'w', encoding='utf-8') as f:
-                    f.write(html_doc)
-                    print(f"Saved submission as {filename}")
-                    
-            except Exception as e:
-                print(f"Error saving HTML: {e}")
-            
-            return render_template('assignment_submitted.html', assignment_id=assignment_id)
+            db_writer.run(db.session, write_submission)
         except Exception as e:
+            db.session.rollback()
             flash(_('Failed to submit assignment'))
-            print(f"Error submitting assignment: {e}")
+            logger.error(f"Error submitting assignment: {e}")
             return redirect(url_for('view_assignment', assignment_id=assignment_id))
+        
+        start_job_worker()
+        return render_template('assignment_submitted.html', assignment_id=assignment_id)
     return redirect(url_for('view_assignment', assignment_id=assignment_id))
 
 @app.route('/view_submissions/<int:assignment_id>')
@@ -759,9 +2142,447 @@ def view_submissions(assignment_id):
         flash(_('Access denied'))
         return redirect(url_for('student_dashboard'))
     
-    assignment = Assignment.query.get_or_404(assignment_id)
-    submissions = Submission.query.filter_by(assignment_id=assignment_id).all()
-    return render_template('view_submissions.html', submissions=submissions, assignment=assignment)
+    assignment = Assignment.query.filter_by(id=assignment_id, deleted_at=None).first_or_404()
+    # Bodies are fetched from submission_content when a preview is opened; students
+    # scheduled for purge are hidden along with their work
+    query = Submission.query.join(Submission.user).options(
+        contains_eager(Submission.user)
+    ).filter(Submission.assignment_id == assignment_id, User.deleted_at.is_(None))
+    page = keyset_paginate(query, [Submission.submitted_at, Submission.id],
+                           request.args.get('cursor'), get_page_size())
+    return render_template('view_submissions.html', submissions=page.items, assignment=assignment, page=page)
+
+@app.route('/assignment/<int:assignment_id>/analytics')
+@login_required
+def assignment_analytics(assignment_id):
+    if current_user.role not in ['admin', 'teacher']:
+        flash(_('Access denied'))
+        return redirect(url_for('student_dashboard'))
+    
+    assignment = Assignment.query.options(load_only(
+        Assignment.id, Assignment.title, Assignment.created_by, Assignment.answer_key
+    )).filter_by(id=assignment_id, deleted_at=None).first_or_404()
+    if current_user.role != 'admin' and assignment.created_by != current_user.id:
+        flash(_('You can only view analytics for assignments that you created'))
+        return redirect(url_for('student_dashboard'))
+    
+    stats = assignment_statistics(assignment_id)
+    return render_template('assignment_analytics.html', assignment=assignment, stats=stats)
+
+# Gradebook exports
+# Rows are read with server-side cursors (yield_per) and written to the response
+# as they arrive. Answer columns come from the answer table, never from
+# Submission.content, which is only read to extract answers that are missing.
+EXPORT_BATCH_SIZE = 1000
+
+def _streamed(statement):
+    return db.session.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+
+def _export_response(fmt, filename, header, rows):
+    if fmt == 'xlsx':
+        chunks, mimetype = gradebook.stream_xlsx(header, rows), gradebook.XLSX_MIMETYPE
+    else:
+        chunks, mimetype = gradebook.stream_csv(header, rows), gradebook.CSV_MIMETYPE
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def _export_question_keys(assignment_id, answer_key):
+    if answer_key:
+        return sorted(answer_key, key=analytics.natural_key)
+    keys = [row[0] for row in db.session.query(Answer.question_key).filter(Answer.assignment_id == assignment_id).distinct()]
+    return sorted(keys, key=analytics.natural_key)[:analytics.MAX_QUESTIONS]
+
+def assignment_export_rows(assignment_id, question_keys=None):
+    """(student, email, submitted at, grade, feedback, answers...) for each submission"""
+    statement = select(
+        Submission.id, User.username, User.email, Submission.submitted_at, Submission.grade, Submission.feedback
+    ).join(User, Submission.student_id == User.id).where(
+        Submission.assignment_id == assignment_id, User.deleted_at.is_(None))
+    if question_keys is None:
+        for row in _streamed(statement.order_by(User.username, Submission.id)):
+            yield tuple(row[1:])
+        return
+
+    # One row per answer, grouped back into one row per submission as they stream past
+    column = {key: i for i, key in enumerate(question_keys)}
+    statement = statement.add_columns(Answer.question_key, Answer.value).outerjoin(
+        Answer, and_(Answer.submission_id == Submission.id, Answer.question_key.in_(question_keys))
+    ).order_by(User.username, Submission.id, Answer.position)
+    for _, rows in groupby(_streamed(statement), key=lambda row: row[0]):
+        values = [[] for _ in question_keys]
+        for row in rows:
+            if row.question_key is not None:
+                values[column[row.question_key]].append(row.value)
+        yield tuple(row[1:6]) + tuple(', '.join(v) for v in values)
+
+def student_export_rows(student_id, created_by=None):
+    """(assignment, due date, submitted at, grade, feedback) for each assignment allocated to a student"""
+    statement = select(
+        Assignment.title, Assignment.due_date, Submission.submitted_at, Submission.grade, Submission.feedback
+    ).select_from(student_assignment).join(
+        Assignment, Assignment.id == student_assignment.c.assignment_id
+    ).outerjoin(Submission, and_(
+        Submission.assignment_id == student_assignment.c.assignment_id,
+        Submission.student_id == student_assignment.c.student_id
+    )).where(student_assignment.c.student_id == student_id, Assignment.deleted_at.is_(None))
+    if created_by is not None:
+        statement = statement.where(Assignment.created_by == created_by)
+    for row in _streamed(statement.order_by(Assignment.created_at, Assignment.id)):
+        yield tuple(row)
+
+def gradebook_rows(assignment_ids):
+    """(student, email, grade per assignment..., average) for every student allocated any of the assignments"""
+    column = {assignment_id: i for i, assignment_id in enumerate(assignment_ids)}
+    statement = select(
+        User.id, User.username, User.email, student_assignment.c.assignment_id, Submission.grade
+    ).select_from(student_assignment).join(
+        User, User.id == student_assignment.c.student_id
+    ).outerjoin(Submission, and_(
+        Submission.assignment_id == student_assignment.c.assignment_id,
+        Submission.student_id == student_assignment.c.student_id
+    )).where(
+        student_assignment.c.assignment_id.in_(assignment_ids), User.deleted_at.is_(None)
+    ).order_by(User.username, User.id)
+    for _, rows in groupby(_streamed(statement), key=lambda row: row[0]):
+        grades = [None] * len(assignment_ids)
+        for row in rows:
+            grades[column[row.assignment_id]] = row.grade
+        graded = [g for g in grades if g is not None]
+        average = round(sum(graded) / len(graded), 2) if graded else None
+        yield (row.username, row.email, *grades, average)
+
+def _parse_date_arg(name):
+    value = request.args.get(name)
+    try:
+        return datetime.strptime(value, '%Y-%m-%d') if value else None
+    except ValueError:
+        return None
+
+@app.route('/export/assignment/<int:assignment_id>.<any(csv, xlsx):fmt>')
+@login_required
+def export_assignment_grades(assignment_id, fmt):
+    """Grades of one assignment; ?answers=1 adds a column per question"""
+    if current_user.role not in ['admin', 'teacher']:
+        flash(_('Access denied'))
+        return redirect(url_for('student_dashboard'))
+    
+    assignment = Assignment.query.options(load_only(
+        Assignment.id, Assignment.title, Assignment.created_by, Assignment.answer_key
+    )).filter_by(id=assignment_id, deleted_at=None).first_or_404()
+    if current_user.role != 'admin' and assignment.created_by != current_user.id:
+        flash(_('You can only export assignments that you created'))
+        return redirect(url_for('student_dashboard'))
+    
+    header = [_('Student'), _('Email'), _('Submitted at'), _('Grade'), _('Feedback')]
+    question_keys = None
+    if request.args.get('answers'):
+        _extract_pending_answers(assignment_id)
+        question_keys = _export_question_keys(assignment_id, assignment.answer_key)
+        header += question_keys
+    logger.info(f"User {current_user.id} exported grades of assignment {assignment_id} as {fmt}")
+    return _export_response(fmt, f'assignment_{assignment_id}_grades', header,
+                            assignment_export_rows(assignment_id, question_keys))
+
+@app.route('/export/student/<int:student_id>.<any(csv, xlsx):fmt>')
+@login_required
+def export_student_grades(student_id, fmt):
+    """All grades of one student; teachers see their own assignments only"""
+    if current_user.role == 'student' and current_user.id != student_id:
+        flash(_('Access denied'))
+        return redirect(url_for('student_dashboard'))
+    
+    student = User.query.options(load_only(User.id, User.username)).filter_by(id=student_id, deleted_at=None).first_or_404()
+    created_by = current_user.id if current_user.role == 'teacher' else None
+    header = [_('Assignment'), _('Due date'), _('Submitted at'), _('Grade'), _('Feedback')]
+    return _export_response(fmt, f'{secure_filename(student.username) or student.id}_grades', header,
+                            student_export_rows(student_id, created_by))
+
+@app.route('/export/gradebook.<any(csv, xlsx):fmt>')
+@login_required
+def export_gradebook(fmt):
+    """Grade of every student in every assignment created between ?from= and ?to= (YYYY-MM-DD)"""
+    if current_user.role not in ['admin', 'teacher']:
+        flash(_('Access denied'))
+        return redirect(url_for('student_dashboard'))
+    
+    query = db.session.query(Assignment.id, Assignment.title).filter(Assignment.deleted_at.is_(None))
+    if current_user.role != 'admin':
+        query = query.filter(Assignment.created_by == current_user.id)
+    start, end = _parse_date_arg('from'), _parse_date_arg('to')
+    if start:
+        query = query.filter(Assignment.created_at >= start)
+    if end:
+        query = query.filter(Assignment.created_at < end + timedelta(days=1))
+    assignments = query.order_by(Assignment.created_at, Assignment.id).all()
+    
+    header = [_('Student'), _('Email')] + [assignment.title for assignment in assignments] + [_('Average')]
+    return _export_response(fmt, 'gradebook', header, gradebook_rows([a.id for a in assignments]))
+
+# Download of every submission of an assignment as one ZIP archive
+# The manifest (entry names, sizes and CRCs) is cached by the archive's ETag, so a
+# resumed download only reads the submissions its Range covers.
+ARCHIVE_BATCH_SIZE = 50
+archive_manifests = template_delta.TemplateCache(max_entries=32)
+
+class _SubmissionDocuments:
+    """Submission HTML for an archive, loaded ARCHIVE_BATCH_SIZE rows at a time in archive order"""
+
+    def __init__(self, submission_ids):
+        self.submission_ids = submission_ids
+        self.index = {submission_id: i for i, submission_id in enumerate(submission_ids)}
+        self.loaded = {}
+
+    def get(self, submission_id):
+        """The submission's HTML, or None once it has been purged"""
+        if submission_id not in self.loaded:
+            i = self.index[submission_id]
+            batch = self.submission_ids[i:i + ARCHIVE_BATCH_SIZE]
+            self.loaded = {submission.id: submission.content.encode('utf-8') for submission in
+                           Submission.with_content().filter(Submission.id.in_(batch))}
+        return self.loaded.pop(submission_id, None)
+
+def _archive_manifest(rows, documents):
+    """(name, size, crc, modified, submission_id or screenshot key) for every file in the archive"""
+    uploads = upload_storage()
+    manifest = []
+    for row in rows:
+        modified = row.submitted_at or datetime(1980, 1, 1)
+        document = documents.get(row.id)
+        if document is None:
+            continue  # Purged since the rows were read
+        name = f"{secure_filename(row.username) or 'student'}_{row.id}"
+        size, crc = zipstream.checksum([document])
+        manifest.append((f'{name}.html', size, crc, modified, row.id))
+        if row.screenshot_filename and uploads.exists(row.screenshot_filename):
+            size, crc = zipstream.checksum(uploads.chunks(row.screenshot_filename))
+            extension = os.path.splitext(row.screenshot_filename)[1]
+            manifest.append((f'screenshots/{name}{extension}', size, crc, modified, row.screenshot_filename))
+    return manifest
+
+def submission_archive(assignment_id):
+    """(zipstream entries, etag) for the archive of an assignment's submissions"""
+    rows = db.session.query(
+        Submission.id, User.username, Submission.submitted_at, Submission.screenshot_filename
+    ).join(User, Submission.student_id == User.id).filter(
+        Submission.assignment_id == assignment_id, User.deleted_at.is_(None)
+    ).order_by(Submission.id).all()
+    # Submissions and screenshots never change once made, so the rows identify the bytes
+    etag = 'archive-' + precompressed.content_hash(json.dumps(
+        [assignment_id] + [[row.id, row.username, row.screenshot_filename] for row in rows]))
+    documents = _SubmissionDocuments([row.id for row in rows])
+    manifest = archive_manifests.get(etag, lambda: _archive_manifest(rows, documents))
+
+    def read_document(submission_id):
+        document = documents.get(submission_id)
+        if document is None:
+            raise FileNotFoundError(f'submission {submission_id}')
+        return [document]
+
+    def reader(source):
+        if isinstance(source, int):
+            return lambda: read_document(source)
+        return lambda: upload_storage().chunks(source)
+    entries = [zipstream.Entry(name, size, crc, modified, reader(source))
+               for name, size, crc, modified, source in manifest]
+    return entries, etag
+
+@app.route('/assignment/<int:assignment_id>/submissions.zip')
+@login_required
+def download_submissions(assignment_id):
+    """Every submission's HTML and screenshot in one ZIP, resumable with Range requests"""
+    if current_user.role not in ['admin', 'teacher']:
+        flash(_('Access denied'))
+        return redirect(url_for('student_dashboard'))
+    
+    assignment = Assignment.query.options(load_only(Assignment.id, Assignment.created_by)).filter_by(
+        id=assignment_id, deleted_at=None).first_or_404()
+    if current_user.role != 'admin' and assignment.created_by != current_user.id:
+        flash(_('You can only download submissions to assignments that you created'))
+        return redirect(url_for('student_dashboard'))
+    
+    entries, etag = submission_archive(assignment_id)
+    size = zipstream.archive_size(entries)
+    start, stop, status = 0, size, 200
+    # A Range only applies to the archive its If-Range names, when one is given
+    if_range = request.if_range
+    if request.range and len(request.range.ranges) == 1 and (
+            if_range.etag == etag or not (if_range.etag or if_range.date)):
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            response = Response(status=416)
+            response.headers['Content-Range'] = f'bytes */{size}'
+            return response
+        (start, stop), status = byte_range, 206
+    
+    def chunks():
+        # A submission purged during the download ends the stream short of its
+        # Content-Length, so the client retries, and the retry is not served the
+        # cached manifest that still lists it
+        try:
+            yield from zipstream.stream(entries, start, stop)
+        except FileNotFoundError as e:
+            archive_manifests.discard(etag)
+            logger.warning(f"Archive of assignment {assignment_id} ended early, {e} is gone")
+    
+    response = Response(stream_with_context(chunks()), status=status, mimetype='application/zip')
+    response.headers['Content-Length'] = str(stop - start)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Content-Disposition'] = f'attachment; filename="assignment_{assignment_id}_submissions.zip"'
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.set_etag(etag)
+    if status == 206:
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    logger.info(f"User {current_user.id} downloading submissions of assignment {assignment_id} "
+                f"(bytes {start}-{stop - 1} of {size})")
+    return response
+
+@app.route('/assignment/<int:assignment_id>/autograde', methods=['POST'])
+@login_required
+def autograde_submissions(assignment_id):
+    if current_user.role not in ['admin', 'teacher']:
+        flash(_('Access denied'))
+        return redirect(url_for('student_dashboard'))
+    
+    assignment = Assignment.query.options(load_only(Assignment.id, Assignment.created_by)).filter_by(
+        id=assignment_id, deleted_at=None).first_or_404()
+    if current_user.role != 'admin' and assignment.created_by != current_user.id:
+        flash(_('You can only grade assignments that you created'))
+        return redirect(url_for('student_dashboard'))
+    
+    try:
+        result = autograde_assignment(assignment_id, regrade='regrade' in request.form)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error auto-grading assignment {assignment_id}: {e}")
+        logger.exception("Detailed error traceback:")
+        flash(_('Failed to auto-grade submissions'))
+        return redirect(url_for('view_submissions', assignment_id=assignment_id))
+    
+    if result is None:
+        flash(_('This worksheet has no answer key to grade against'))
+    else:
+        flash(_('Auto-graded %(count)d submissions', count=result['graded']))
+    return redirect(url_for('view_submissions', assignment_id=assignment_id))
+
+@app.route('/submission/<int:submission_id>/content')
+@login_required
+def submission_content(submission_id):
+    """Serve one submission's HTML on demand for the preview modal"""
+    # Load just enough to authorize and build the validator; content stays deferred
+    submission = Submission.query.options(load_only(
+        Submission.id, Submission.assignment_id, Submission.student_id,
+        Submission.submitted_at, Submission.content_base_hash
+    )).get_or_404(submission_id)
+    
+    if current_user.role not in ['admin', 'teacher'] and submission.student_id != current_user.id:
+        return "Access denied", 403
+    
+    # Submissions are never edited after they are made, so id + timestamp identify the body
+    etag = f"submission-{submission.id}-{int(submission.submitted_at.timestamp()) if submission.submitted_at else 0}"
+    return html_body_response(
+        lambda: submission.content,
+        etag
+    )
+
+@app.route('/submission/<int:submission_id>/screenshot', methods=['PUT'])
+@login_required
+def upload_screenshot(submission_id):
+    """Attach a screenshot to one's own ungraded submission, sent as the raw (possibly chunked) request body"""
+    submission = Submission.query.options(load_only(
+        Submission.id, Submission.assignment_id, Submission.student_id,
+        Submission.grade, Submission.screenshot_filename
+    )).get_or_404(submission_id)
+    
+    if submission.student_id != current_user.id:
+        return jsonify({'error': 'Access denied'}), 403
+    if submission.grade is not None:
+        return jsonify({'error': 'The submission has already been graded'}), 409
+    # Refused before reading when the size is declared; chunked bodies are cut off while streaming
+    if request.content_length is not None and request.content_length > app.config['SCREENSHOT_MAX_BYTES']:
+        return jsonify({'error': f"Screenshot is larger than {app.config['SCREENSHOT_MAX_BYTES']} bytes"}), 413
+    try:
+        filename = store_screenshot(request.stream)
+    except screenshots.UploadTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    except screenshots.NotAnImage as e:
+        return jsonify({'error': str(e)}), 415
+    previous = submission.screenshot_filename
+    
+    def attach():
+        db.session.execute(db.update(Submission).where(Submission.id == submission_id).values(
+            screenshot_filename=filename).execution_options(synchronize_session=False))
+        enqueue_job('process_screenshot', {'submission_id': submission_id, 'screenshot': filename})
+        bump_cache_versions(students=[current_user.id])
+        if previous and previous != filename:
+            release_uploads([previous])
+    try:
+        db_writer.run(db.session, attach)
+    except Exception as e:
+        db.session.rollback()
+        release_unused_uploads([filename])
+        logger.error(f"Error attaching screenshot to submission {submission_id}: {e}")
+        return jsonify({'error': 'Failed to save the screenshot'}), 500
+    start_job_worker()
+    return jsonify({'screenshot': filename}), 201
+
+@app.route('/submission/<int:submission_id>/thumbnail/<filename>')
+@login_required
+def screenshot_thumbnail(submission_id, filename):
+    """A small WebP of a submission's screenshot for the grading pages, made the first time it is requested"""
+    submission = db.session.query(Submission.student_id, Submission.screenshot_filename).filter(
+        Submission.id == submission_id).first()
+    # The URL names the current screenshot, so a replaced one is never served from a stale cache
+    if submission is None or submission.screenshot_filename != filename:
+        return "File not found", 404
+    if current_user.role not in ['admin', 'teacher'] and submission.student_id != current_user.id:
+        return "Access denied", 403
+    
+    key = filename
+    name = screenshots.thumbnail_name(key)
+    if not os.path.exists(os.path.join(app.config['THUMBNAIL_FOLDER'], name)):
+        if screenshots.Image is None:
+            return redirect(url_for('serve_uploaded_file', filename=key))
+        try:
+            with upload_storage().local_copy(key) as source:
+                screenshots.thumbnail(source, os.path.join(app.config['THUMBNAIL_FOLDER'], name))
+        except (KeyError, FileNotFoundError, screenshots.NotAnImage):
+            return "File not found", 404
+    # Thumbnails are named by the screenshot's key, which never changes meaning
+    response = send_from_directory(app.config['THUMBNAIL_FOLDER'], name, max_age=86400)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+@app.route('/assignment/<int:assignment_id>/content/<content_hash>.html')
+@login_required
+def assignment_content(assignment_id, content_hash):
+    """Serve a worksheet from a content-hashed URL so browsers can cache it forever"""
+    assignment = Assignment.query.options(load_only(
+        Assignment.id, Assignment.content_hash
+    )).filter_by(id=assignment_id, deleted_at=None).first_or_404()
+    
+    if current_user.role == 'student':
+        assignment_assigned = db.session.query(student_assignment).filter(
+            student_assignment.c.assignment_id == assignment_id,
+            student_assignment.c.student_id == current_user.id
+        ).first()
+        if not assignment_assigned:
+            return "Access denied", 403
+    
+    # Old links (or a guessed hash) are sent to the current version
+    if content_hash != assignment.content_hash:
+        return redirect(url_for('assignment_content', assignment_id=assignment_id,
+                                content_hash=assignment.content_hash))
+    
+    return html_body_response(
+        lambda: db.session.query(Assignment.html_content).filter(Assignment.id == assignment_id).scalar(),
+        assignment.content_hash,
+        cache_control='private, max-age=31536000, immutable',
+        sandbox=False,  # The page reads the filled-in form out of the frame on submit
+        cache_key=assignment.content_hash
+    )
 
 @app.route('/grade_submission/<int:submission_id>', methods=['GET', 'POST'])
 @login_required
@@ -770,17 +2591,20 @@ def grade_submission(submission_id):
         flash(_('Access denied'))
         return redirect(url_for('student_dashboard'))
     
-    submission = Submission.query.get_or_404(submission_id)
+    submission = Submission.with_content().get_or_404(submission_id)
     
     if request.method == 'POST':
         grade = request.form['grade']
         feedback = request.form['feedback']
         
-        submission.grade = float(grade)
-        submission.feedback = feedback
+        def write_grade():
+            submission.grade = float(grade)
+            submission.feedback = feedback
+            invalidate_stats([submission.assignment_id])
+            bump_cache_versions(students=[submission.student_id])
         
         try:
-            db.session.commit()
+            db_writer.run(db.session, write_grade)
             flash(_('Submission graded successfully'))
             return redirect(url_for('view_submissions', assignment_id=submission.assignment_id))
         except:
@@ -788,6 +2612,57 @@ def grade_submission(submission_id):
     
     return render_template('grade_submission.html', submission=submission)
 
+@app.route('/submissions/grades', methods=['POST'])
+@login_required
+def grade_submissions_batch():
+    """Save many grades at once
+
+    JSON: {"grades": [{"submission_id": 1, "grade": 90, "feedback": "..."}, ...]}
+    Form: grade-<submission_id> and feedback-<submission_id> fields; blank grades are skipped.
+    """
+    wants_json = request.is_json
+    if current_user.role not in ['admin', 'teacher']:
+        if wants_json:
+            return jsonify({'error': 'Access denied'}), 403
+        flash(_('Access denied'))
+        return redirect(url_for('student_dashboard'))
+    
+    if wants_json:
+        grades = (request.get_json(silent=True) or {}).get('grades')
+        if not isinstance(grades, list) or not all(isinstance(g, dict) for g in grades):
+            return jsonify({'error': 'grades must be a list of objects'}), 400
+        entries = [(g.get('submission_id'), g.get('grade'), g.get('feedback')) for g in grades]
+    else:
+        entries = [
+            (name[len('grade-'):], value, request.form.get('feedback-' + name[len('grade-'):]))
+            for name, value in request.form.items()
+            if name.startswith('grade-') and value.strip()
+        ]
+    
+    try:
+        graded, errors = apply_grades(entries, current_user)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error saving a batch of grades: {e}")
+        if wants_json:
+            return jsonify({'error': 'Failed to save grades'}), 500
+        flash(_('Failed to grade submissions'))
+        graded, errors = 0, None
+    
+    if wants_json:
+        if errors:
+            return jsonify({'error': 'No grades were saved', 'details': errors}), 400
+        return jsonify({'graded': graded}), 200
+    
+    if errors:
+        flash(_('No grades were saved: %(errors)s', errors='; '.join(errors[:5])))
+    elif errors is not None:
+        flash(_('Graded %(count)d submissions', count=graded))
+    assignment_id = request.form.get('assignment_id', type=int)
+    if assignment_id:
+        return redirect(url_for('view_submissions', assignment_id=assignment_id, cursor=request.form.get('cursor') or None))
+    return redirect(url_for('student_dashboard'))
+
 @app.route('/forgot_password', methods=['GET', 'POST'])
 def forgot_password():
     if request.method == 'POST':
@@ -832,8 +2707,9 @@ def admin_users():
         flash(_('Access denied'))
         return redirect(url_for('student_dashboard'))
     
-    users = User.query.all()
-    return render_template('admin_users.html', users=users)
+    query = User.query.filter(User.deleted_at.is_(None))
+    page = keyset_paginate(query, [User.id], request.args.get('cursor'), get_page_size(), descending=False)
+    return render_template('admin_users.html', users=page.items, page=page)
 
 @app.route('/admin/user/<int:user_id>/edit', methods=['GET', 'POST'])
 @login_required
@@ -842,7 +2718,7 @@ def admin_edit_user(user_id):
         flash(_('Access denied'))
         return redirect(url_for('student_dashboard'))
     
-    user = User.query.get_or_404(user_id)
+    user = User.query.filter_by(id=user_id, deleted_at=None).first_or_404()
     
     if request.method == 'POST':
         # Update user information
@@ -870,7 +2746,7 @@ def admin_delete_user(user_id):
         flash(_('Access denied'))
         return redirect(url_for('student_dashboard'))
     
-    user = User.query.get_or_404(user_id)
+    user = User.query.filter_by(id=user_id, deleted_at=None).first_or_404()
     
     # Prevent deleting current user
     if user.id == current_user.id:
@@ -878,11 +2754,20 @@ def admin_delete_user(user_id):
         return redirect(url_for('admin_users'))
     
     try:
-        db.session.delete(user)
+        # Soft-delete now; submissions, allocations and files are purged in the background
+        user.deleted_at = datetime.utcnow()
+        # Analytics of their assignments stop counting them straight away
+        invalidate_stats((row[0] for row in db.session.query(Submission.assignment_id).filter(
+            Submission.student_id == user.id).distinct()), answers=True)
+        task = schedule_purge('user', user.id, requested_by=current_user.id)
         db.session.commit()
+        start_job_worker()
         flash(_('User deleted successfully'))
-    except:
+        logger.info(f"User {user_id} scheduled for purge (task {task.id}) by {current_user.username}")
+    except Exception as e:
+        db.session.rollback()
         flash(_('Failed to delete user'))
+        logger.error(f"Error deleting user {user_id}: {e}")
     
     return redirect(url_for('admin_users'))
 
@@ -894,7 +2779,7 @@ def delete_assignment(assignment_id):
         flash(_('Access denied'))
         return redirect(url_for('student_dashboard'))
     
-    assignment = Assignment.query.get_or_404(assignment_id)
+    assignment = Assignment.query.filter_by(id=assignment_id, deleted_at=None).first_or_404()
     
     # Check if the current user created this assignment or is admin
     if current_user.role != 'admin' and assignment.created_by != current_user.id:
@@ -902,21 +2787,16 @@ def delete_assignment(assignment_id):
         return redirect(url_for('student_dashboard'))
     
     try:
-        # First delete all submissions related to this assignment
-        submissions = Submission.query.filter_by(assignment_id=assignment_id).all()
-        for submission in submissions:
-            db.session.delete(submission)
-        
-        # Remove assignment-student associations
-        delete_stmt = student_assignment.delete().where(student_assignment.c.assignment_id == assignment_id)
-        db.session.execute(delete_stmt)
-        
-        # Delete the assignment itself
-        db.session.delete(assignment)
+        # Hide the assignment now; submissions, allocations and files are purged in the background
+        assignment.deleted_at = datetime.utcnow()
+        assignment.is_active = False
+        task = schedule_purge('assignment', assignment.id, requested_by=current_user.id)
+        bump_cache_versions(assignments=[assignment.id], listing=True)
         db.session.commit()
+        start_job_worker()
         
         flash(_('Assignment deleted successfully'))
-        logger.info(f"Assignment {assignment_id} deleted by user {current_user.username}")
+        logger.info(f"Assignment {assignment_id} scheduled for purge (task {task.id}) by user {current_user.username}")
         
     except Exception as e:
         db.session.rollback()
@@ -925,6 +2805,30 @@ def delete_assignment(assignment_id):
     
     return redirect(url_for('student_dashboard'))
 
+@app.route('/admin/purge/<int:task_id>')
+@login_required
+def purge_status(task_id):
+    """Progress of a background purge task"""
+    if current_user.role not in ['admin', 'teacher']:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    task = PurgeTask.query.get_or_404(task_id)
+    if current_user.role != 'admin' and task.requested_by != current_user.id:
+        return jsonify({'error': 'Access denied'}), 403
+    return jsonify(task.to_dict()), 200
+
+@app.errorhandler(413)
+def request_too_large(error):
+    # Raised while reading the body, often by the CSRF check before any view runs
+    limit = app.config['MAX_CONTENT_LENGTH']
+    if request.endpoint == 'upload_screenshot':
+        return jsonify({'error': f"Screenshot is larger than {app.config['SCREENSHOT_MAX_BYTES']} bytes"}), 413
+    logger.warning(f"Refused a {request.content_length}-byte request to {request.path} (limit {limit})")
+    flash(_('The upload is too large (at most %(size)s MB)', size=limit // (1024 * 1024)))
+    if request.endpoint == 'submit_html_assignment':
+        return redirect(url_for('view_assignment', **request.view_args))
+    return redirect(request.referrer or url_for('index'))
+
 # Initialize the database
 @app.errorhandler(500)
 def internal_server_error(error):
@@ -945,7 +2849,7 @@ def view_submission_content(submission_id):
         flash(_('Access denied'))
         return redirect(url_for('student_dashboard'))
     
-    submission = Submission.query.get_or_404(submission_id)
+    submission = Submission.with_content().get_or_404(submission_id)
     
     # Create a clean HTML page to display the submission content
     html_content = f"""
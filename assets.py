@@ -0,0 +1,92 @@
+# Fingerprinted static assets and whitespace-trimmed templates, without a build step
+#
+# Stylesheets and scripts are plain files under static/. Templates link them with
+# asset_url('css/base.css'), which gives /assets/css/base.<hash>.css with a hash
+# of the file's content, so the URL changes whenever the file does and can be
+# cached for a year. Hashes are computed on first use and again whenever a file's
+# size or modification time changes, so an edited file is picked up without a
+# restart.
+#
+# MinifyHTML removes indentation and blank lines from template source when a
+# template is compiled, so it costs nothing per request and never touches the
+# values rendered into a page. <pre>, <textarea>, <script> and <style> elements,
+# Jinja tags and {% trans %} blocks (whose text is a message id) are left exactly
+# as written.
+import hashlib
+import os
+import re
+
+from jinja2.ext import Extension
+from werkzeug.security import safe_join
+
+HASH_LENGTH = 12
+FINGERPRINTED = re.compile(rf'^(?P<stem>.+)\.(?P<hash>[0-9a-f]{{{HASH_LENGTH}}})(?P<ext>\.[A-Za-z0-9]+)$')
+
+PRESERVED = re.compile(r'<(pre|textarea|script|style)\b.*?</\1\s*>|\{%-?\s*trans\b.*?endtrans\s*-?%\}'
+                       r'|\{\{.*?\}\}|\{%.*?%\}|\{#.*?#\}', re.S | re.I)
+LINE_BREAK = re.compile(r'[ \t\r\f\v]*\n\s*')
+
+
+class Fingerprints:
+    """Content hashes of the files under a static directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.hashes = {}  # path -> (mtime_ns, size, hash)
+
+    def file_path(self, path):
+        """Absolute path of an asset; raises FileNotFoundError for paths outside the directory"""
+        full = safe_join(self.directory, path)
+        if full is None or not os.path.isfile(full):
+            raise FileNotFoundError(path)
+        return full
+
+    def fingerprint(self, path):
+        stat = os.stat(self.file_path(path))
+        known = self.hashes.get(path)
+        if known and known[:2] == (stat.st_mtime_ns, stat.st_size):
+            return known[2]
+        digest = hashlib.sha256()
+        with open(self.file_path(path), 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                digest.update(chunk)
+        fingerprint = digest.hexdigest()[:HASH_LENGTH]
+        self.hashes[path] = (stat.st_mtime_ns, stat.st_size, fingerprint)
+        return fingerprint
+
+    def hashed_name(self, path):
+        """'css/base.css' -> 'css/base.<hash>.css'"""
+        stem, extension = os.path.splitext(path)
+        return f'{stem}.{self.fingerprint(path)}{extension}'
+
+    def resolve(self, hashed_name):
+        """(path, current) for a fingerprinted name, where current says whether its hash still matches
+
+        Raises FileNotFoundError when the name is not fingerprinted or the file does not exist.
+        """
+        match = FINGERPRINTED.match(hashed_name)
+        if match is None:
+            raise FileNotFoundError(hashed_name)
+        path = match['stem'] + match['ext']
+        return path, self.fingerprint(path) == match['hash']
+
+
+def minify_html(source):
+    """Collapse whitespace around line breaks to a single newline outside preserved regions"""
+    parts = []
+    position = 0
+    for match in PRESERVED.finditer(source):
+        parts.append(LINE_BREAK.sub('\n', source[position:match.start()]))
+        parts.append(match.group(0))
+        position = match.end()
+    parts.append(LINE_BREAK.sub('\n', source[position:]))
+    return ''.join(parts)
+
+
+class MinifyHTML(Extension):
+    """Jinja extension applying minify_html to .html templates as they are compiled"""
+
+    def preprocess(self, source, name, filename=None):
+        if name and name.endswith('.html'):
+            return minify_html(source)
+        return source
@@ -0,0 +1,94 @@
+# Automatic grading against the answer keys embedded in worksheets
+#
+# Worksheets declare their correct answers either in a script, as
+#   const correctAnswers = { 1: 'C', 2: 'D', ... };
+# keyed by question number (the question element's id is "q<number>"), or as
+# data-answer attributes on form fields. extract_answer_key() collects both into
+# {question_key: expected value}, using the question keys of answer_extraction.
+#
+# score_submissions() grades a whole assignment at once: the extracted answers
+# become an integer matrix (one row per submission, one column per question) that
+# is compared with the key vector in a single NumPy operation.
+import re
+
+import numpy as np
+
+import answer_extraction
+
+CORRECT_ANSWERS_PATTERN = re.compile(r'correctAnswers\s*=\s*\{(.*?)\}', re.DOTALL)
+KEY_VALUE_PATTERN = re.compile(
+    r'''(?:(\w+)|'([^']*)'|"([^"]*)")\s*:\s*(?:'([^']*)'|"([^"]*)"|(-?[\d.]+)|(true|false))'''
+)
+
+
+def _script_answer_key(html):
+    key = {}
+    match = CORRECT_ANSWERS_PATTERN.search(html)
+    if match:
+        for groups in KEY_VALUE_PATTERN.findall(match.group(1)):
+            name = next((g for g in groups[:3] if g), '')
+            value = next((g for g in groups[3:] if g), '')
+            if name:
+                key[name] = value
+    return key
+
+
+def extract_answer_key(html):
+    """{question_key: expected answer} declared by a worksheet, empty if it has none"""
+    if not html:
+        return {}
+    parser = answer_extraction.parse(html)
+    key = dict(parser.answer_key)
+    for name, value in _script_answer_key(html).items():
+        # Numbered keys refer to the question elements q1, q2, ...
+        question_key = f'q{name}' if name.isdigit() and f'q{name}' in parser.element_ids else name
+        key.setdefault(question_key, value)
+    return key
+
+
+def normalize(value):
+    return ' '.join(str(value).split()).casefold()
+
+
+def canonical(values):
+    """One comparable string for the answer(s) to a question, ignoring case, spacing and order"""
+    return ','.join(sorted(part.strip() for value in values for part in normalize(value).split(',')))
+
+
+def response_matrix(questions, answer_rows, submission_ids, codes):
+    """Integer matrix of answers, one row per submission and one column per question
+
+    answer_rows are (submission_id, question_key, value) tuples; several rows for
+    one question (checkboxes) are combined by canonical(). Every distinct answer
+    gets a code from `codes` (a dict extended as needed); 0 means unanswered.
+    """
+    column = {question: i for i, question in enumerate(questions)}
+    row = {submission_id: i for i, submission_id in enumerate(submission_ids)}
+
+    responses = {}
+    for submission_id, question_key, value in answer_rows:
+        if submission_id in row and question_key in column:
+            responses.setdefault((row[submission_id], column[question_key]), []).append(value)
+
+    matrix = np.zeros((len(submission_ids), len(questions)), dtype=np.int32)
+    for (i, j), values in responses.items():
+        matrix[i, j] = codes.setdefault(canonical(values), len(codes) + 1)
+    return matrix
+
+
+def key_vector(answer_key, questions, codes):
+    return np.array([codes.setdefault(canonical([answer_key[q]]), len(codes) + 1) for q in questions], dtype=np.int32)
+
+
+def score_submissions(answer_key, answer_rows, submission_ids):
+    """Score every submission against the key
+
+    Returns {submission_id: (correct, total)} for each of submission_ids.
+    """
+    questions = sorted(answer_key)
+    codes = {}
+    expected = key_vector(answer_key, questions, codes)
+    matrix = response_matrix(questions, answer_rows, submission_ids, codes)
+    correct = (matrix == expected).sum(axis=1) if questions else np.zeros(len(submission_ids), dtype=np.int64)
+    return {submission_id: (int(correct[i]), len(questions)) for i, submission_id in enumerate(submission_ids)}
+
@@ -0,0 +1,136 @@
+# Compressed storage for large text columns
+#
+# CompressedText stores a str as one format byte, one dictionary id byte and a raw
+# DEFLATE stream. Worksheets share most of their markup and CSS, so compression
+# uses a preset dictionary built from the worksheet corpus (dictionary id 0 means
+# none). Values written before compression existed are still read back as plain
+# text, and rewrite_compressed_columns() in app.py converts them in the background.
+#
+# Build a new dictionary from uploaded worksheets with:
+#   python compressed_text.py train uploads
+# New values then use the highest-numbered dictionary. Never delete or edit a
+# dictionary file once rows have been written with it.
+import glob
+import logging
+import os
+import re
+import sys
+import zlib
+from collections import Counter
+
+from sqlalchemy import LargeBinary, func
+from sqlalchemy.types import TypeDecorator
+
+logger = logging.getLogger(__name__)
+
+FORMAT_DEFLATE = 1
+
+DICTIONARY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'compression')
+DICTIONARY_PATTERN = re.compile(r'^worksheets-(\d+)\.zdict$')
+# DEFLATE can only refer back 32KB, so a larger dictionary is wasted
+DICTIONARY_SIZE = 32 * 1024
+COMPRESSION_LEVEL = 9
+
+
+def load_dictionaries(directory=DICTIONARY_DIR):
+    dictionaries = {}
+    for path in glob.glob(os.path.join(directory, 'worksheets-*.zdict')):
+        match = DICTIONARY_PATTERN.match(os.path.basename(path))
+        if match:
+            with open(path, 'rb') as f:
+                dictionaries[int(match.group(1))] = f.read()
+    return dictionaries
+
+
+DICTIONARIES = load_dictionaries()
+CURRENT_DICTIONARY = max(DICTIONARIES, default=0)
+
+
+def compress(text, dictionary_id=None):
+    dictionary_id = CURRENT_DICTIONARY if dictionary_id is None else dictionary_id
+    if dictionary_id:
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -15, 9,
+                                      zdict=DICTIONARIES[dictionary_id])
+    else:
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -15, 9)
+    data = compressor.compress(text.encode('utf-8')) + compressor.flush()
+    return bytes((FORMAT_DEFLATE, dictionary_id)) + data
+
+
+def is_compressed(value):
+    return isinstance(value, (bytes, bytearray, memoryview)) and len(value) >= 2 and value[0] == FORMAT_DEFLATE
+
+
+def decompress(value):
+    """Text for a stored value, whether compressed or written before compression"""
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    if not is_compressed(value):
+        # Text columns converted to binary in place (Postgres bytea)
+        return value.decode('utf-8')
+    dictionary_id = value[1]
+    if dictionary_id and dictionary_id not in DICTIONARIES:
+        raise ValueError(f'Compression dictionary {dictionary_id} is missing from {DICTIONARY_DIR}')
+    if dictionary_id:
+        decompressor = zlib.decompressobj(-15, zdict=DICTIONARIES[dictionary_id])
+    else:
+        decompressor = zlib.decompressobj(-15)
+    return (decompressor.decompress(value[2:]) + decompressor.flush()).decode('utf-8')
+
+
+def uncompressed_filter(column, dialect_name):
+    """SQL condition matching rows of `column` that still hold plain text"""
+    if dialect_name == 'sqlite':
+        return func.typeof(column) == 'text'
+    return func.substr(column, 1, 1) != bytes((FORMAT_DEFLATE,))
+
+
+class _Blob(LargeBinary):
+    # Leave values untouched: SQLite still returns str for rows written as TEXT
+    def result_processor(self, dialect, coltype):
+        return None
+
+
+class CompressedText(TypeDecorator):
+    """Text column stored compressed, decompressed when the attribute is loaded"""
+    impl = _Blob
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return compress(value) if isinstance(value, str) else value
+
+    def process_result_value(self, value, dialect):
+        return decompress(value)
+
+
+def train_dictionary(documents, size=DICTIONARY_SIZE):
+    """Preset dictionary of the lines most shared between `documents` (bytes)"""
+    shared = Counter()
+    for document in documents:
+        shared.update(line for line in set(document.splitlines(keepends=True)) if len(line.strip()) >= 8)
+    candidates = sorted(((count * len(line), line) for line, count in shared.items() if count >= 2), reverse=True)
+    chosen = []
+    total = 0
+    for _, line in candidates:
+        if total + len(line) <= size:
+            chosen.append(line)
+            total += len(line)
+    # DEFLATE encodes nearer matches more cheaply, so the most valuable lines go last
+    return b''.join(reversed(chosen))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3 or sys.argv[1] != 'train':
+        sys.exit('Usage: python compressed_text.py train <worksheet directory>')
+    paths = [p for p in glob.glob(os.path.join(sys.argv[2], '*')) if p.lower().endswith(('.html', '.htm'))]
+    documents = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            documents.append(f.read())
+    dictionary = train_dictionary(documents)
+    os.makedirs(DICTIONARY_DIR, exist_ok=True)
+    path = os.path.join(DICTIONARY_DIR, f'worksheets-{CURRENT_DICTIONARY + 1}.zdict')
+    with open(path, 'wb') as f:
+        f.write(dictionary)
+    print(f"Trained a {len(dictionary)} byte dictionary on {len(documents)} worksheets: {path}")
@@ -0,0 +1,94 @@
+# Shared test setup: a throwaway SQLite database (never instance/assignments.db),
+# empty tables and fresh file directories for every test, and the users and
+# assignment most tests start from
+import os
+import tempfile
+from collections import namedtuple
+
+# Must be set before app is imported anywhere
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+
+import pytest
+
+from app import app, db, User, Assignment, student_assignment, variant_cache, rendered_pages
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+# Queued jobs run when a test calls run_pending_jobs(), never on a thread
+app.config['JOBS_IN_BACKGROUND'] = False
+# Files written by a test are old enough to delete as soon as they are released
+app.config['UPLOAD_RELEASE_GRACE_SECONDS'] = 0
+
+PASSWORD = 'password123'
+
+Classroom = namedtuple('Classroom', ['teacher_id', 'assignment_id', 'student_ids'])
+
+
+def reset_database():
+    """Recreate every table and point the upload, thumbnail and cache directories at new ones"""
+    assert 'assignments.db' not in app.config['SQLALCHEMY_DATABASE_URI']
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+    app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+    app.config['THUMBNAIL_FOLDER'] = tempfile.mkdtemp()
+    app.config['NOTIFY_WEBHOOK_URLS'] = []
+    variant_cache.directory = tempfile.mkdtemp()
+    rendered_pages.clear()
+
+
+@pytest.fixture
+def database():
+    """An empty database; the fixture's value starts over again when called"""
+    reset_database()
+    return reset_database
+
+
+@pytest.fixture
+def classroom(database):
+    """Factory for a teacher, students and an assignment allocated to all of them
+
+    Students are student0, student1, ... (or the given list of names) and everyone's
+    password is PASSWORD. Extra keyword arguments are Assignment columns; with
+    assignment=False there is none. Returns a Classroom of ids.
+    """
+    def create(students=1, assignment=True, allocate=True, admin=False, **fields):
+        with app.app_context():
+            teacher = User(username='teacher', email='teacher@example.com', role='teacher')
+            teacher.set_password(PASSWORD)
+            db.session.add(teacher)
+            if admin:
+                db.session.add(User(username='admin', email='admin@example.com', role='admin',
+                                    password_hash=teacher.password_hash))
+            db.session.flush()
+            names = [f'student{i}' for i in range(students)] if isinstance(students, int) else students
+            if names:
+                db.session.execute(User.__table__.insert(), [
+                    {'username': name, 'email': f'{name}@example.com', 'role': 'student',
+                     'password_hash': teacher.password_hash} for name in names])
+            student_ids = [row[0] for row in db.session.query(User.id).filter(
+                User.role == 'student').order_by(User.id)]
+
+            assignment_id = None
+            if assignment:
+                fields.setdefault('title', 'Worksheet')
+                fields.setdefault('description', 'Answer')
+                new_assignment = Assignment(created_by=teacher.id, **fields)
+                db.session.add(new_assignment)
+                db.session.flush()
+                assignment_id = new_assignment.id
+                if allocate and student_ids:
+                    db.session.execute(student_assignment.insert(), [
+                        {'student_id': student_id, 'assignment_id': assignment_id} for student_id in student_ids])
+            db.session.commit()
+            return Classroom(teacher.id, assignment_id, student_ids)
+    return create
+
+
+@pytest.fixture
+def login():
+    """Function that logs a test client in as `username`"""
+    def log_in(client, username, password=PASSWORD):
+        return client.post('/login', data={'username': username, 'password': password})
+    return log_in
@@ -0,0 +1,304 @@
+# Database engine profile configured from the environment
+#
+# The production database is a Supabase Postgres in another region, so every new
+# connection costs a TLS handshake across the WAN and idle connections are cut by
+# the pooler. engine_options() turns DB_* environment variables into SQLAlchemy
+# engine options, and install_metrics() reports how much of each request was spent
+# connecting to and talking to the database.
+#
+# Environment variables (all optional):
+#   DB_POOL_SIZE              persistent connections per worker process (5)
+#   DB_MAX_OVERFLOW           extra connections allowed during bursts (10)
+#   DB_POOL_TIMEOUT           seconds to wait for a free connection (10)
+#   DB_POOL_RECYCLE           seconds before a connection is replaced (280)
+#   DB_POOL_PRE_PING          test connections on checkout: true/false (true)
+#   DB_CONNECT_TIMEOUT        seconds to establish a connection (10)
+#   DB_STATEMENT_TIMEOUT_MS   per-statement limit on the server, 0 disables (15000)
+#   DB_PGBOUNCER              'transaction' when connecting through PgBouncer or the
+#                             Supabase pooler in transaction mode
+#   DB_SLOW_REQUEST_MS        log requests whose database time exceeds this (500)
+#
+# SQLite (the local and fallback deployment) is run in WAL mode with pragmas set on
+# every connection by install_sqlite_pragmas(), and writes go through a
+# SerializedWriter so several gunicorn workers take turns instead of failing with
+# "database is locked":
+#   DB_SQLITE_BUSY_TIMEOUT_MS wait this long for another writer's lock (5000)
+#   DB_SQLITE_MMAP_MB         memory-mapped I/O size (256)
+#   DB_SQLITE_CACHE_MB        page cache per connection (64)
+#   DB_WRITE_RETRIES          retries of a write unit that still hit a lock (5)
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within one process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(environ, name, default):
+    try:
+        return int(environ.get(name, default))
+    except (TypeError, ValueError):
+        logger.warning(f"Ignoring invalid {name}={environ.get(name)!r}, using {default}")
+        return default
+
+
+def _env_bool(environ, name, default):
+    value = environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def is_pgbouncer_transaction_mode(environ=os.environ):
+    return environ.get('DB_PGBOUNCER', '').strip().lower() == 'transaction'
+
+
+def postgres_engine_options(url, environ):
+    options = {
+        'pool_size': _env_int(environ, 'DB_POOL_SIZE', 5),
+        'max_overflow': _env_int(environ, 'DB_MAX_OVERFLOW', 10),
+        'pool_timeout': _env_int(environ, 'DB_POOL_TIMEOUT', 10),
+        # Below the ~300s idle cut-off of hosted poolers, so we never hand out a dead socket
+        'pool_recycle': _env_int(environ, 'DB_POOL_RECYCLE', 280),
+        'pool_pre_ping': _env_bool(environ, 'DB_POOL_PRE_PING', True),
+        # Reuse the most recently returned connection so idle extras age out and get recycled
+        'pool_use_lifo': True,
+    }
+    connect_args = {
+        'connect_timeout': _env_int(environ, 'DB_CONNECT_TIMEOUT', 10),
+        'application_name': environ.get('DB_APPLICATION_NAME', 'too-easy-web'),
+    }
+    if url.get_driver_name() in ('psycopg2', 'psycopg'):
+        # Detect half-open connections across the WAN instead of hanging on them
+        connect_args.update({'keepalives': 1, 'keepalives_idle': 30,
+                             'keepalives_interval': 10, 'keepalives_count': 3})
+
+    statement_timeout = _env_int(environ, 'DB_STATEMENT_TIMEOUT_MS', 15000)
+    if is_pgbouncer_transaction_mode(environ):
+        # Transaction pooling hands each transaction to any server connection, so
+        # nothing session-scoped may be relied on: no server-side prepared
+        # statements and no startup parameters (PgBouncer rejects 'options').
+        # psycopg2 never prepares server-side; psycopg 3 does unless told not to.
+        if url.get_driver_name() == 'psycopg':
+            connect_args['prepare_threshold'] = None
+        if statement_timeout:
+            logger.info("DB_PGBOUNCER=transaction: set statement_timeout on the database role instead")
+    elif statement_timeout:
+        connect_args['options'] = f'-c statement_timeout={statement_timeout}'
+
+    options['connect_args'] = connect_args
+    return options
+
+
+def normalize_uri(database_uri):
+    """Pin bare postgres:// and postgresql:// URLs to psycopg2, the driver in requirements.txt"""
+    for prefix in ('postgres://', 'postgresql://'):
+        if database_uri.startswith(prefix):
+            return 'postgresql+psycopg2://' + database_uri[len(prefix):]
+    return database_uri
+
+
+def engine_options(database_uri, environ=os.environ):
+    """SQLAlchemy engine options for `database_uri` based on DB_* environment variables"""
+    url = make_url(database_uri)
+    if url.get_backend_name() == 'postgresql':
+        return postgres_engine_options(url, environ)
+    return {}
+
+
+def sqlite_database_path(database_uri):
+    """Filesystem path of a SQLite database URI, or None for other backends and :memory:"""
+    url = make_url(database_uri)
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        return None
+    return url.database
+
+
+def install_sqlite_pragmas(engine, environ=os.environ):
+    """Put every new SQLite connection in WAL mode with production pragmas"""
+    busy_timeout = _env_int(environ, 'DB_SQLITE_BUSY_TIMEOUT_MS', 5000)
+    mmap_bytes = _env_int(environ, 'DB_SQLITE_MMAP_MB', 256) * 1024 * 1024
+    cache_kib = _env_int(environ, 'DB_SQLITE_CACHE_MB', 64) * 1024
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            # Readers no longer block the writer and vice versa; persistent in the file
+            cursor.execute('PRAGMA journal_mode=WAL')
+            # In WAL mode NORMAL only syncs at checkpoints and is still corruption-safe
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.execute(f'PRAGMA busy_timeout={busy_timeout}')
+            cursor.execute(f'PRAGMA mmap_size={mmap_bytes}')
+            # Negative values are in KiB rather than pages
+            cursor.execute(f'PRAGMA cache_size=-{cache_kib}')
+        finally:
+            cursor.close()
+
+
+def is_lock_error(error):
+    message = str(getattr(error, 'orig', error)).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+
+class SerializedWriter:
+    """Run write units of work one at a time, retrying with backoff when SQLite reports a lock
+
+    With a lock_path the turn-taking also spans processes (gunicorn workers) through
+    an advisory file lock. A disabled writer just runs and commits, for servers such
+    as Postgres that handle concurrent writers themselves.
+    """
+
+    def __init__(self, lock_path=None, enabled=True, retries=5, backoff=0.05, max_backoff=1.0):
+        self.lock_path = lock_path
+        self.enabled = enabled
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._thread_lock = threading.Lock()
+
+    @classmethod
+    def for_database(cls, database_uri, environ=os.environ):
+        path = sqlite_database_path(database_uri)
+        return cls(lock_path=path + '.writelock' if path else None,
+                   enabled=make_url(database_uri).get_backend_name() == 'sqlite',
+                   retries=_env_int(environ, 'DB_WRITE_RETRIES', 5))
+
+    @contextmanager
+    def _turn(self):
+        with self._thread_lock:
+            if fcntl is None or not self.lock_path:
+                yield
+                return
+            with open(self.lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def run(self, session, work):
+        """Call work() and commit the session, returning work()'s result
+
+        work() must make all of its changes itself, since it is called again
+        after a rollback when the write is retried.
+        """
+        if not self.enabled:
+            result = work()
+            session.commit()
+            return result
+
+        attempt = 0
+        while True:
+            with self._turn():
+                try:
+                    result = work()
+                    session.commit()
+                    return result
+                except OperationalError as e:
+                    session.rollback()
+                    if not is_lock_error(e) or attempt >= self.retries:
+                        raise
+            delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+            attempt += 1
+            logger.warning(f"Database locked, retrying write in {delay:.2f}s (attempt {attempt}/{self.retries})")
+            # Jitter so that retrying workers don't collide again in lockstep
+            time.sleep(delay * random.uniform(0.5, 1.5))
+
+
+def describe(options):
+    """Loggable summary of engine options without connection secrets"""
+    shown = {k: v for k, v in options.items() if k != 'connect_args'}
+    shown['connect_args'] = sorted(options.get('connect_args', {}))
+    return shown
+
+
+# Per-request connection latency metrics
+
+class RequestMetrics:
+    __slots__ = ('connects', 'connect_ms', 'queries', 'query_ms')
+
+    def __init__(self):
+        self.connects = 0
+        self.connect_ms = 0.0
+        self.queries = 0
+        self.query_ms = 0.0
+
+    def server_timing(self):
+        return (f'db;desc="{self.queries} queries";dur={self.query_ms:.1f}, '
+                f'dbconnect;desc="{self.connects} connects";dur={self.connect_ms:.1f}')
+
+
+def install_metrics(app, engine, environ=os.environ):
+    """Measure connection setup and query time per request and report it in Server-Timing"""
+    from flask import g, has_request_context
+
+    slow_ms = _env_int(environ, 'DB_SLOW_REQUEST_MS', 500)
+
+    def current():
+        if not has_request_context():
+            return None
+        metrics = g.get('db_metrics')
+        if metrics is None:
+            metrics = g.db_metrics = RequestMetrics()
+        return metrics
+
+    @event.listens_for(engine, 'do_connect')
+    def timed_connect(dialect, conn_rec, cargs, cparams):
+        started = time.perf_counter()
+        connection = dialect.connect(*cargs, **cparams)
+        metrics = current()
+        if metrics is not None:
+            metrics.connects += 1
+            metrics.connect_ms += (time.perf_counter() - started) * 1000
+        return connection
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append((context, time.perf_counter()))
+
+    def finished(conn):
+        _, started = conn.info['query_started'].pop()
+        metrics = current()
+        if metrics is not None:
+            metrics.queries += 1
+            metrics.query_ms += (time.perf_counter() - started) * 1000
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        finished(conn)
+
+    @event.listens_for(engine, 'handle_error')
+    def failed_cursor_execute(exception_context):
+        # after_cursor_execute is skipped for a failed statement; without this its
+        # start time would stay behind and be paired with the next statement
+        conn = exception_context.connection
+        stack = conn.info.get('query_started') if conn is not None else None
+        # Errors raised before the cursor ran (or outside a statement) pushed nothing
+        if stack and stack[-1][0] is exception_context.execution_context:
+            finished(conn)
+
+    @app.after_request
+    def add_server_timing(response):
+        metrics = g.get('db_metrics')
+        if metrics is not None:
+            response.headers.add('Server-Timing', metrics.server_timing())
+            if metrics.query_ms + metrics.connect_ms > slow_ms:
+                from flask import request
+                logger.warning(
+                    f"Slow database time on {request.method} {request.path}: "
+                    f"{metrics.queries} queries {metrics.query_ms:.0f}ms, "
+                    f"{metrics.connects} connects {metrics.connect_ms:.0f}ms"
+                )
+        return response
@@ -0,0 +1,173 @@
+# Streaming spreadsheet writers for gradebook exports
+#
+# stream_csv() and stream_xlsx() turn an iterable of rows into an iterable of
+# byte chunks for a streamed response. Rows are consumed one at a time and the
+# output is handed on every CHUNK_SIZE bytes, so memory stays constant however
+# many rows the (server-side cursor) query yields.
+#
+# XLSX is written without a spreadsheet library: the workbook is a zip of a few
+# fixed XML parts plus one worksheet, which is compressed into the zip as it is
+# generated. Cells are inline strings or numbers, so no shared string table or
+# styles need to be kept in memory.
+import csv
+import io
+import re
+import zipfile
+from datetime import date, datetime
+
+CHUNK_SIZE = 64 * 1024
+
+CSV_MIMETYPE = 'text/csv; charset=utf-8'
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Spreadsheet apps run cells starting with these as formulas
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+# Characters XML 1.0 does not allow, even escaped
+INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M')
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def _csv_cell(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    text = _text(value)
+    return "'" + text if text.startswith(FORMULA_PREFIXES) else text
+
+
+class _Chunks(io.RawIOBase):
+    """Write-only stream collecting output until it is taken with drain()"""
+
+    def __init__(self):
+        self._parts = []
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        self.size = 0
+        return data
+
+
+def stream_csv(header, rows):
+    """UTF-8 CSV (with a BOM so Excel detects the encoding) as byte chunks"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow([_csv_cell(value) for value in row])
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def _column_name(index):
+    name = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        name = chr(65 + remainder) + name
+    return name
+
+
+def _xml(text):
+    text = INVALID_XML_CHARS.sub('', text)
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+
+
+def _xlsx_row(number, values, columns):
+    cells = []
+    for i, value in enumerate(values):
+        if value is None or value == '':
+            continue
+        ref = f'{columns[i]}{number}'
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            cells.append(f'<c r="{ref}"><v>{value!r}</v></c>')
+        else:
+            cells.append(f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{_xml(_text(value))}</t></is></c>')
+    return f'<row r="{number}">{"".join(cells)}</row>'
+
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+
+def _workbook(sheet_name):
+    # Sheet names are at most 31 characters and may not contain []:*?/\
+    sheet_name = re.sub(r'[\[\]:*?/\\]', ' ', sheet_name)[:31] or 'Sheet1'
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{_xml(sheet_name)}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+
+
+def stream_xlsx(header, rows, sheet_name='Grades'):
+    """A single-sheet XLSX workbook as byte chunks"""
+    out = _Chunks()
+    with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_DEFLATED) as workbook:
+        workbook.writestr('[Content_Types].xml', CONTENT_TYPES)
+        workbook.writestr('_rels/.rels', ROOT_RELS)
+        workbook.writestr('xl/workbook.xml', _workbook(sheet_name))
+        workbook.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELS)
+        columns = [_column_name(i) for i in range(len(header))]
+        with workbook.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(_xlsx_row(1, header, columns).encode('utf-8'))
+            for number, row in enumerate(rows, start=2):
+                if len(row) > len(columns):
+                    columns.extend(_column_name(i) for i in range(len(columns), len(row)))
+                sheet.write(_xlsx_row(number, row, columns).encode('utf-8'))
+                if out.size >= CHUNK_SIZE:
+                    yield out.drain()
+            sheet.write(b'</sheetData></worksheet>')
+    yield out.drain()
@@ -0,0 +1,405 @@
+# Versioned schema migrations for SQLite and PostgreSQL
+#
+# Replaces the ad hoc fix_*_schema.py / recreate_db_*.py scripts. Each migration
+# has an increasing version number and runs in its own transaction; the applied
+# versions are recorded in the schema_version table so that application boot can
+# compare one integer instead of reflecting the whole schema.
+#
+# Run pending migrations by hand with:  python migrations.py
+import json
+import logging
+from datetime import datetime
+
+import sqlalchemy as sa
+from sqlalchemy import text, inspect
+
+import autograde
+import compressed_text
+import precompressed
+import template_delta
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION_TABLE = 'schema_version'
+
+# Arbitrary key for pg_advisory_lock so concurrent workers don't migrate twice
+MIGRATION_LOCK_KEY = 727001
+
+MIGRATIONS = []
+
+
+class Migration:
+    def __init__(self, version, description, upgrade):
+        self.version = version
+        self.description = description
+        self.upgrade = upgrade
+
+    def __repr__(self):
+        return f'<Migration {self.version}: {self.description}>'
+
+
+def migration(version, description):
+    """Register a migration function taking an open SQLAlchemy connection"""
+    def decorator(func):
+        if any(m.version == version for m in MIGRATIONS):
+            raise ValueError(f'Duplicate migration version {version}')
+        MIGRATIONS.append(Migration(version, description, func))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return func
+    return decorator
+
+
+def latest_version():
+    return MIGRATIONS[-1].version if MIGRATIONS else 0
+
+
+# Helpers usable from migrations
+
+def column_exists(conn, table, column):
+    return column in {c['name'] for c in inspect(conn).get_columns(table)}
+
+
+def table_exists(conn, table):
+    return inspect(conn).has_table(table)
+
+
+def add_column_if_missing(conn, table, column, ddl):
+    if not column_exists(conn, table, column):
+        conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}'))
+        logger.info(f"Added column {table}.{column}")
+
+
+def create_index(conn, name, table, columns):
+    cols = ', '.join(columns)
+    conn.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON "{table}" ({cols})'))
+    logger.info(f"Ensured index {name} on {table}({cols})")
+
+
+# Migrations
+
+@migration(1, 'Columns previously patched by the fix_*_schema.py scripts')
+def add_legacy_columns(conn):
+    add_column_if_missing(conn, 'assignment', 'created_by', 'INTEGER')
+    add_column_if_missing(conn, 'assignment', 'html_filename', 'VARCHAR(255)')
+    add_column_if_missing(conn, 'assignment', 'html_content', 'TEXT')
+    add_column_if_missing(conn, 'submission', 'screenshot_filename', 'VARCHAR(255)')
+
+
+@migration(2, 'Indexes for dashboard, submission and allocation hot paths')
+def add_performance_indexes(conn):
+    create_index(conn, 'ix_submission_assignment_student', 'submission', ['assignment_id', 'student_id'])
+    create_index(conn, 'ix_submission_student', 'submission', ['student_id'])
+    create_index(conn, 'ix_student_assignment_student', 'student_assignment', ['student_id'])
+    create_index(conn, 'ix_assignment_active_creator', 'assignment', ['is_active', 'created_by'])
+
+
+@migration(3, 'Soft-delete columns and the purge_task table')
+def add_soft_delete_and_purge_tasks(conn):
+    add_column_if_missing(conn, 'assignment', 'deleted_at', 'TIMESTAMP')
+    add_column_if_missing(conn, 'user', 'deleted_at', 'TIMESTAMP')
+    purge_task = sa.Table(
+        'purge_task', sa.MetaData(),
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('target_type', sa.String(20), nullable=False),
+        sa.Column('target_id', sa.Integer, nullable=False),
+        sa.Column('status', sa.String(20), nullable=False),
+        sa.Column('phase', sa.String(30)),
+        sa.Column('submissions_deleted', sa.Integer, nullable=False, default=0),
+        sa.Column('allocations_deleted', sa.Integer, nullable=False, default=0),
+        sa.Column('files_deleted', sa.Integer, nullable=False, default=0),
+        sa.Column('error', sa.Text),
+        sa.Column('requested_by', sa.Integer),
+        sa.Column('created_at', sa.DateTime),
+        sa.Column('updated_at', sa.DateTime),
+        sa.Column('finished_at', sa.DateTime),
+        sa.Index('ix_purge_task_status', 'status'),
+    )
+    purge_task.create(conn, checkfirst=True)
+
+
+@migration(4, 'Keyset pagination indexes and non-null sort keys')
+def add_pagination_indexes(conn):
+    # Keyset cursors compare (timestamp, id) tuples, which NULLs would break
+    conn.execute(text('UPDATE assignment SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL'))
+    conn.execute(text('UPDATE submission SET submitted_at = CURRENT_TIMESTAMP WHERE submitted_at IS NULL'))
+    create_index(conn, 'ix_assignment_created', 'assignment', ['created_at', 'id'])
+    create_index(conn, 'ix_submission_assignment_submitted', 'submission', ['assignment_id', 'submitted_at', 'id'])
+
+
+@migration(5, 'Content hashes for cacheable worksheet URLs')
+def add_assignment_content_hash(conn):
+    add_column_if_missing(conn, 'assignment', 'content_hash', 'VARCHAR(64)')
+    while True:
+        rows = conn.execute(text(
+            'SELECT id, html_content FROM assignment '
+            'WHERE content_hash IS NULL AND html_content IS NOT NULL LIMIT 50'
+        )).fetchall()
+        if not rows:
+            break
+        conn.execute(
+            text('UPDATE assignment SET content_hash = :content_hash WHERE id = :id'),
+            [{'id': row[0], 'content_hash': precompressed.content_hash(compressed_text.decompress(row[1]))}
+             for row in rows]
+        )
+
+
+@migration(6, 'Store submissions as deltas against their worksheet')
+def add_submission_deltas(conn):
+    add_column_if_missing(conn, 'submission', 'content_base_hash', 'VARCHAR(64)')
+    last_id = 0
+    converted = saved = 0
+    while True:
+        rows = conn.execute(text(
+            'SELECT s.id, s.content, a.html_content, a.content_hash '
+            'FROM submission s JOIN assignment a ON a.id = s.assignment_id '
+            'WHERE s.id > :last_id AND s.content_base_hash IS NULL AND a.content_hash IS NOT NULL '
+            'ORDER BY s.id LIMIT 50'
+        ), {'last_id': last_id}).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        updates = []
+        for submission_id, content, template, content_hash in rows:
+            # Raw SQL sees stored values, which may already be compressed. Deltas are
+            # written back as plain text and compressed by the background rewrite.
+            content = compressed_text.decompress(content)
+            delta = template_delta.encode(compressed_text.decompress(template), content)
+            if delta is not None:
+                updates.append({'id': submission_id, 'content': delta, 'content_hash': content_hash})
+                saved += len(content) - len(delta)
+        if updates:
+            conn.execute(text(
+                'UPDATE submission SET content = :content, content_base_hash = :content_hash WHERE id = :id'
+            ), updates)
+            converted += len(updates)
+    logger.info(f"Converted {converted} submissions to deltas, {saved} characters smaller")
+    if converted:
+        logger.info("Run VACUUM on the database to return the freed space to the filesystem")
+
+
+@migration(7, 'Binary storage for compressed html_content and submission content')
+def compress_large_text_columns(conn):
+    # SQLite stores the compressed bytes in the existing TEXT columns as they are.
+    # Postgres needs bytea; existing values stay readable as UTF-8 until the
+    # background rewrite (flask compress-columns) compresses them.
+    if conn.dialect.name != 'postgresql':
+        return
+    for table, column in [('assignment', 'html_content'), ('submission', 'content')]:
+        conn.execute(text(
+            f'ALTER TABLE "{table}" ALTER COLUMN {column} TYPE BYTEA '
+            f"USING convert_to({column}, 'UTF8')"
+        ))
+        logger.info(f"Converted {table}.{column} to BYTEA")
+
+
+@migration(8, 'Answers table for extracted form field values')
+def add_answers_table(conn):
+    # Rows are filled in by the answer backfill (flask extract-answers) after boot
+    add_column_if_missing(conn, 'submission', 'answers_version', 'INTEGER')
+    metadata = sa.MetaData()
+    # Just enough of the referenced tables for the foreign keys to resolve
+    sa.Table('submission', metadata, sa.Column('id', sa.Integer, primary_key=True))
+    sa.Table('assignment', metadata, sa.Column('id', sa.Integer, primary_key=True))
+    answer = sa.Table(
+        'answer', metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('submission_id', sa.Integer, nullable=False),
+        sa.Column('assignment_id', sa.Integer, nullable=False),
+        sa.Column('position', sa.Integer, nullable=False),
+        sa.Column('question_key', sa.String(255), nullable=False),
+        sa.Column('element_type', sa.String(20), nullable=False),
+        sa.Column('value', sa.Text, nullable=False),
+        sa.ForeignKeyConstraint(['submission_id'], ['submission.id']),
+        sa.ForeignKeyConstraint(['assignment_id'], ['assignment.id']),
+        sa.Index('ix_answer_submission', 'submission_id', 'position'),
+        sa.Index('ix_answer_assignment_question', 'assignment_id', 'question_key'),
+    )
+    answer.create(conn, checkfirst=True)
+
+
+@migration(9, 'Answer keys extracted from worksheets for auto-grading')
+def add_assignment_answer_keys(conn):
+    add_column_if_missing(conn, 'assignment', 'answer_key', 'JSON')
+    last_id = 0
+    while True:
+        rows = conn.execute(text(
+            'SELECT id, html_content FROM assignment '
+            'WHERE id > :last_id AND html_content IS NOT NULL ORDER BY id LIMIT 50'
+        ), {'last_id': last_id}).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        updates = []
+        for assignment_id, html_content in rows:
+            answer_key = autograde.extract_answer_key(compressed_text.decompress(html_content))
+            if answer_key:
+                updates.append({'id': assignment_id, 'answer_key': json.dumps(answer_key, ensure_ascii=False)})
+        if updates:
+            conn.execute(text('UPDATE assignment SET answer_key = :answer_key WHERE id = :id'), updates)
+
+
+@migration(10, 'Materialized per-assignment analytics')
+def add_assignment_stats_table(conn):
+    # Rows are created and filled when a teacher first opens the analytics page
+    metadata = sa.MetaData()
+    sa.Table('assignment', metadata, sa.Column('id', sa.Integer, primary_key=True))
+    stats = sa.Table(
+        'assignment_stats', metadata,
+        sa.Column('assignment_id', sa.Integer, primary_key=True),
+        sa.Column('version', sa.Integer, nullable=False),
+        sa.Column('grade_stats', sa.JSON, nullable=True),
+        sa.Column('question_stats', sa.JSON, nullable=True),
+        sa.Column('computed_at', sa.DateTime, nullable=True),
+        sa.ForeignKeyConstraint(['assignment_id'], ['assignment.id']),
+    )
+    stats.create(conn, checkfirst=True)
+
+
+@migration(11, 'Background job queue')
+def add_job_table(conn):
+    job = sa.Table(
+        'job', sa.MetaData(),
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('kind', sa.String(50), nullable=False),
+        sa.Column('payload', sa.JSON, nullable=False),
+        sa.Column('status', sa.String(20), nullable=False),
+        sa.Column('attempts', sa.Integer, nullable=False, default=0),
+        sa.Column('max_attempts', sa.Integer, nullable=False, default=5),
+        sa.Column('run_at', sa.DateTime, nullable=False),
+        sa.Column('locked_by', sa.String(100)),
+        sa.Column('error', sa.Text),
+        sa.Column('created_at', sa.DateTime),
+        sa.Column('updated_at', sa.DateTime),
+        sa.Column('finished_at', sa.DateTime),
+        sa.Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
+    job.create(conn, checkfirst=True)
+
+
+@migration(12, 'Content-addressed upload storage')
+def add_upload_storage_keys(conn):
+    # Files already uploaded keep their flat names until `flask migrate-uploads`
+    add_column_if_missing(conn, 'submission', 'archive_filename', 'VARCHAR(255)')
+    create_index(conn, 'ix_assignment_html_filename', 'assignment', ['html_filename'])
+    create_index(conn, 'ix_submission_screenshot', 'submission', ['screenshot_filename'])
+    create_index(conn, 'ix_submission_archive', 'submission', ['archive_filename'])
+
+
+@migration(13, 'Version counters for the page cache')
+def add_cache_version_table(conn):
+    # Rows are created by the first write that bumps them; a missing row reads as 0
+    cache_version = sa.Table(
+        'cache_version', sa.MetaData(),
+        sa.Column('scope', sa.String(16), primary_key=True),
+        sa.Column('key_id', sa.Integer, primary_key=True, autoincrement=False),
+        sa.Column('version', sa.Integer, nullable=False),
+    )
+    cache_version.create(conn, checkfirst=True)
+
+
+@migration(14, 'Purge tasks run on the job queue')
+def queue_unfinished_purges(conn):
+    # Tasks left by the old purge worker get a job; their finished batches are skipped
+    job = sa.Table(
+        'job', sa.MetaData(),
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('kind', sa.String(50)),
+        sa.Column('payload', sa.JSON),
+        sa.Column('status', sa.String(20)),
+        sa.Column('attempts', sa.Integer),
+        sa.Column('max_attempts', sa.Integer),
+        sa.Column('run_at', sa.DateTime),
+        sa.Column('created_at', sa.DateTime),
+        sa.Column('updated_at', sa.DateTime),
+    )
+    now = datetime.utcnow()
+    rows = conn.execute(text(
+        "SELECT id FROM purge_task WHERE status IN ('pending', 'running', 'failed') ORDER BY id")).fetchall()
+    if rows:
+        conn.execute(job.insert(), [
+            {'kind': 'purge', 'payload': {'task_id': task_id}, 'status': 'pending', 'attempts': 0,
+             'max_attempts': 5, 'run_at': now, 'created_at': now, 'updated_at': now}
+            for (task_id,) in rows])
+
+
+# Engine
+
+def ensure_version_table(conn):
+    conn.execute(text(
+        f'CREATE TABLE IF NOT EXISTS {SCHEMA_VERSION_TABLE} ('
+        'version INTEGER PRIMARY KEY, '
+        'description VARCHAR(255), '
+        'applied_at TIMESTAMP)'
+    ))
+
+
+def get_schema_version(engine):
+    """Return the current schema version, or None if the database was never stamped"""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(text(f'SELECT MAX(version) FROM {SCHEMA_VERSION_TABLE}')).scalar() or 0
+    except Exception:
+        return None
+
+
+def _record(conn, m):
+    conn.execute(
+        text(f'INSERT INTO {SCHEMA_VERSION_TABLE} (version, description, applied_at) '
+             'VALUES (:version, :description, :applied_at)'),
+        {'version': m.version, 'description': m.description, 'applied_at': datetime.utcnow()}
+    )
+
+
+def stamp(engine, version=None):
+    """Mark migrations up to `version` as applied without running them (for fresh create_all databases)"""
+    version = latest_version() if version is None else version
+    with engine.begin() as conn:
+        ensure_version_table(conn)
+        applied = {row[0] for row in conn.execute(text(f'SELECT version FROM {SCHEMA_VERSION_TABLE}'))}
+        for m in MIGRATIONS:
+            if m.version <= version and m.version not in applied:
+                _record(conn, m)
+    logger.info(f"Stamped schema version {version}")
+
+
+def upgrade(engine, target=None):
+    """Apply pending migrations up to `target` (default: latest). Returns the versions applied."""
+    target = latest_version() if target is None else target
+    applied_now = []
+    is_postgres = engine.dialect.name == 'postgresql'
+
+    with engine.connect() as lock_conn:
+        if is_postgres:
+            lock_conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': MIGRATION_LOCK_KEY})
+            lock_conn.commit()
+        try:
+            with engine.begin() as conn:
+                ensure_version_table(conn)
+            current = get_schema_version(engine) or 0
+
+            for m in MIGRATIONS:
+                if m.version <= current or m.version > target:
+                    continue
+                logger.info(f"Applying migration {m.version}: {m.description}")
+                with engine.begin() as conn:
+                    m.upgrade(conn)
+                    _record(conn, m)
+                applied_now.append(m.version)
+        finally:
+            if is_postgres:
+                lock_conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': MIGRATION_LOCK_KEY})
+                lock_conn.commit()
+
+    if applied_now:
+        logger.info(f"Schema migrated to version {applied_now[-1]}")
+    return applied_now
+
+
+if __name__ == '__main__':
+    from app import app, db
+
+    with app.app_context():
+        print(f"Current schema version: {get_schema_version(db.engine)}")
+        applied = upgrade(db.engine)
+        print(f"Applied migrations: {applied or 'none'}")
+        print(f"Schema version now: {get_schema_version(db.engine)}")
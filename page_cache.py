@@ -0,0 +1,150 @@
+# Rendered pages kept between requests and retired by version counters
+#
+# A page is cached under a key made of everything it shows: the endpoint and its
+# arguments, the viewer, the locale and the version counters of the rows it was
+# rendered from. Writes bump those counters instead of deleting entries, so a
+# stale page is simply never looked up again and falls out of the LRU. Entries
+# also expire after a TTL, or sooner when the page shows something that changes
+# with the clock, such as an assignment becoming overdue.
+#
+# Pages are rendered with CSRF_PLACEHOLDER where the session's CSRF token goes and
+# the caller substitutes the real token on every request, so a cached page never
+# carries one session's token to another.
+#
+# The LRU is per process. With a DirectoryBackend, pages are also kept as files in
+# a directory every worker can read, so a page rendered by one worker at the bell
+# is served by all of them.
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CSRF_PLACEHOLDER = '__csrf_token_placeholder__'
+DEFAULT_TTL = 300
+MAX_ENTRIES = 512
+
+
+def cache_key(parts):
+    """Digest of a key made of strings, numbers, None and nested lists or tuples"""
+    raw = json.dumps(parts, separators=(',', ':'), default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+class DirectoryBackend:
+    """Pages as files named by key, sharded by the first two characters like precompressed.VariantCache"""
+
+    # Retired pages are never read again, so expired files are swept every this many writes
+    PRUNE_EVERY = 500
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._writes = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.html')
+
+    def get(self, key, now):
+        """(expires, text) for `key`, or None if it is missing or expired"""
+        path = self.path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                expires = float(f.readline())
+                if expires > now:
+                    return expires, f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+        self._remove(path)
+        return None
+
+    def set(self, key, text, expires):
+        path = self.path(key)
+        # Write-then-rename so concurrent workers never read a partial page
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(f'{expires:.3f}\n')
+                f.write(text)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not cache page {path}: {e}")
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self, now=None):
+        """Remove expired pages; returns how many were removed"""
+        now = time.time() if now is None else now
+        removed = 0
+        for directory, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        expired = float(f.readline()) <= now
+                except (OSError, ValueError):
+                    expired = True
+                if expired and self._remove(path):
+                    removed += 1
+        return removed
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+
+class PageCache:
+    """LRU of rendered pages by key, in front of an optional shared backend; ttl=0 disables it"""
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=DEFAULT_TTL, backend=None, clock=time.time):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, parts, render):
+        """Text cached under `parts`, else render() -> (text, max_age) kept for up to max_age seconds
+
+        max_age None means the cache's TTL; the TTL is also the upper bound.
+        """
+        if self.ttl <= 0:
+            return render()[0]
+        key = cache_key(parts)
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    return entry[1]
+                del self._entries[key]
+        entry = self.backend.get(key, now) if self.backend is not None else None
+        if entry is None:
+            text, max_age = render()
+            lifetime = self.ttl if max_age is None else min(max_age, self.ttl)
+            if lifetime <= 0:
+                return text
+            entry = (now + lifetime, text)
+            if self.backend is not None:
+                self.backend.set(key, text, entry[0])
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,87 @@
+# Precompressed variants of immutable response bodies
+#
+# Worksheet HTML never changes once uploaded, so it is addressed by a hash of its
+# content and each compressed encoding is produced once and kept on disk. Every
+# later request for the same worksheet just reads the stored bytes.
+import gzip
+import hashlib
+import logging
+import os
+import tempfile
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; gzip is always available
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Preferred first when the client rates several encodings equally
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+
+FILE_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def content_hash(data):
+    """Hex digest used in URLs, ETags and cache keys for a body (str or bytes)"""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=11)
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=9)
+    raise ValueError(f'Unsupported encoding: {encoding}')
+
+
+def negotiate(accept_encodings, available=ENCODINGS):
+    """Pick the best encoding from a werkzeug Accept-Encoding header, or None for identity"""
+    best, best_quality = None, 0
+    for encoding in available:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class VariantCache:
+    """Compressed bodies on disk, sharded by the first two characters of the key"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, key, encoding):
+        return os.path.join(self.directory, key[:2], key + FILE_SUFFIXES[encoding])
+
+    def get(self, key, encoding, load):
+        """Return the `encoding` variant of `key`, compressing `load()` bytes on a miss"""
+        path = self.path(key, encoding)
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+        data = compress(load(), encoding)
+        self._write(path, data)
+        return data
+
+    def warm(self, key, data):
+        """Store every supported variant of freshly uploaded content"""
+        for encoding in ENCODINGS:
+            path = self.path(key, encoding)
+            if not os.path.exists(path):
+                self._write(path, compress(data, encoding))
+
+    def _write(self, path, data):
+        # Write-then-rename so concurrent workers never read a partial file
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not cache compressed variant {path}: {e}")
@@ -0,0 +1,190 @@
+# WSGI middleware compressing responses with brotli or gzip
+#
+# Text responses (pages, JSON, CSV, scripts, stylesheets) are compressed for
+# clients that accept it; images, archives and responses that already carry a
+# Content-Encoding pass through untouched. Immutable responses (Cache-Control:
+# immutable with a strong ETag, such as content-keyed uploads and fingerprinted
+# static files) are compressed once at the highest level and served from a
+# precompressed.VariantCache afterwards; everything else is compressed on the fly
+# at a cheaper level, chunk by chunk, so streamed responses keep streaming.
+#
+# A compressed response is a different representation, so its ETag gets the
+# encoding as a suffix ("abc" -> "abc-br") and the suffix is removed from
+# If-None-Match before the application sees it, keeping 304s working.
+import itertools
+import re
+import zlib
+
+from werkzeug.datastructures import ResponseCacheControl
+from werkzeug.http import parse_accept_header, parse_cache_control_header
+
+import precompressed
+
+# Smaller bodies are not worth the CPU or the framing overhead
+MIN_SIZE = 512
+# Larger immutable bodies are compressed on the fly instead of read into memory for the cache
+CACHE_MAX_BYTES = 8 * 1024 * 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE_TYPES = {
+    'application/javascript', 'application/json', 'application/xml', 'application/xhtml+xml',
+    'application/manifest+json', 'image/svg+xml',
+}
+
+ETAG_SUFFIXES = {'br': '-br', 'gzip': '-gzip'}
+SUFFIXED_ETAG = re.compile(r'"([^"]*)(-br|-gzip)"')
+
+
+def compressible(content_type):
+    mimetype = (content_type or '').split(';')[0].strip().lower()
+    return (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+            or mimetype.endswith('+json') or mimetype.endswith('+xml'))
+
+
+class StreamCompressor:
+    """Incremental brotli or gzip, flushed after every chunk so nothing waits in the buffer"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self.compressor = precompressed.brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip framing
+
+    def compress(self, chunk):
+        if self.encoding == 'br':
+            return self.compressor.process(chunk) + self.compressor.flush()
+        return self.compressor.compress(chunk) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+
+def _header(headers, name):
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _without(headers, *names):
+    names = {name.lower() for name in names}
+    return [(key, value) for key, value in headers if key.lower() not in names]
+
+
+def _add_vary(headers):
+    vary = _header(headers, 'Vary')
+    if vary is None:
+        return headers + [('Vary', 'Accept-Encoding')]
+    if 'accept-encoding' in vary.lower() or vary.strip() == '*':
+        return headers
+    return _without(headers, 'Vary') + [('Vary', f'{vary}, Accept-Encoding')]
+
+
+def _close(iterable):
+    if hasattr(iterable, 'close'):
+        iterable.close()
+
+
+class CompressionMiddleware:
+    def __init__(self, app, cache=None, min_size=MIN_SIZE):
+        self.app = app
+        self.cache = cache
+        self.min_size = min_size
+
+    def __call__(self, environ, start_response):
+        encoding = precompressed.negotiate(parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING')))
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            environ['HTTP_IF_NONE_MATCH'] = SUFFIXED_ETAG.sub(r'"\1"', if_none_match)
+
+        captured = []
+        written = []
+
+        def capture(status, headers, exc_info=None):
+            captured[:] = [status, headers, exc_info]
+            return written.append
+
+        app_iter = self.app(environ, capture)
+        chunks = iter(app_iter)
+        first = []
+        if not captured:  # start_response may wait for the first chunk
+            first = [next(chunks, b'')]
+        status, headers, exc_info = captured
+
+        code = int(status.split(' ', 1)[0])
+        if code == 304 and if_none_match:
+            # Give back the ETag the client sent, suffix and all (a 304 has no Content-Type to go by)
+            etag = _header(headers, 'ETag') or ''
+            for suffix in ETAG_SUFFIXES.values():
+                if etag.endswith('"') and etag[:-1] + suffix + '"' in if_none_match:
+                    headers = _add_vary(_without(headers, 'ETag') + [('ETag', etag[:-1] + suffix + '"')])
+                    break
+        if not compressible(_header(headers, 'Content-Type')):
+            start_response(status, headers, exc_info)
+            return self._body(app_iter, written + first, chunks)
+        headers = _add_vary(headers)
+        if not self._should_compress(encoding, environ, code, headers):
+            start_response(status, headers, exc_info)
+            return self._body(app_iter, written + first, chunks)
+
+        etag = _header(headers, 'ETag')
+        headers = _without(headers, 'Content-Length', 'Accept-Ranges', 'ETag')
+        headers.append(('Content-Encoding', encoding))
+        if etag and etag.endswith('"'):
+            headers.append(('ETag', etag[:-1] + ETAG_SUFFIXES[encoding] + '"'))
+
+        length = _header(captured[1], 'Content-Length')
+        cache_control = parse_cache_control_header(_header(headers, 'Cache-Control'), cls=ResponseCacheControl)
+        if (self.cache is not None and etag and not etag.startswith('W/') and cache_control.immutable
+                and length is not None and int(length) <= CACHE_MAX_BYTES):
+            def load():
+                return b''.join(written + first + list(chunks))
+            try:
+                data = self.cache.get(precompressed.content_hash(f'etag:{etag}'), encoding, load)
+            finally:
+                _close(app_iter)
+            start_response(status, headers + [('Content-Length', str(len(data)))], exc_info)
+            return [data]
+
+        start_response(status, headers, exc_info)
+        return self._compressed(app_iter, written + first, chunks, StreamCompressor(encoding))
+
+    def _should_compress(self, encoding, environ, code, headers):
+        if not encoding or environ.get('REQUEST_METHOD') == 'HEAD' or code != 200:
+            return False
+        # Ranges are of the identity representation; offloaded bodies are sent by the proxy
+        if environ.get('HTTP_RANGE') or _header(headers, 'Content-Encoding'):
+            return False
+        if _header(headers, 'X-Sendfile') or _header(headers, 'X-Accel-Redirect'):
+            return False
+        if 'no-transform' in (_header(headers, 'Cache-Control') or '').lower():
+            return False
+        length = _header(headers, 'Content-Length')
+        return length is None or int(length) >= self.min_size
+
+    @staticmethod
+    def _body(app_iter, prefix, chunks):
+        if not prefix:
+            return app_iter
+
+        def body():
+            try:
+                yield from itertools.chain(prefix, chunks)
+            finally:
+                _close(app_iter)
+        return body()
+
+    @staticmethod
+    def _compressed(app_iter, prefix, chunks, compressor):
+        try:
+            for chunk in itertools.chain(prefix, chunks):
+                if chunk:
+                    yield compressor.compress(chunk)
+            yield compressor.finish()
+        finally:
+            _close(app_iter)
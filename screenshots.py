@@ -0,0 +1,123 @@
+# Screenshot ingestion: streamed uploads, WebP re-encoding and thumbnails
+#
+# Uploads are copied to disk in CHUNK_SIZE pieces and abandoned as soon as they
+# pass the size cap, so a large or endless body never sits in memory. Only files
+# that start with a known image signature are kept. The job queue then re-encodes
+# each screenshot to WebP no larger than MAX_DIMENSION on either side, and small
+# thumbnails for the grading pages are made the first time one is requested.
+import os
+import tempfile
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; screenshots are then kept as uploaded
+    Image = ImageOps = None
+
+CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+MAX_DIMENSION = 1920
+THUMBNAIL_SIZE = (320, 240)
+WEBP_QUALITY = 80
+THUMBNAIL_QUALITY = 70
+# Decoding a tiny file can still allocate width * height pixels; refuse more than this
+MAX_PIXELS = 40_000_000
+
+SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+]
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class NotAnImage(Exception):
+    pass
+
+
+def image_type(header):
+    """'png', 'jpg', 'gif' or 'webp' for the first bytes of a file, None if it is none of them"""
+    for signature, extension in SIGNATURES:
+        if header.startswith(signature):
+            return extension
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def receive(stream, directory, max_bytes=MAX_UPLOAD_BYTES):
+    """Copy an upload stream into a temporary file in `directory`
+
+    Returns (temporary path, image type). Raises UploadTooLarge past max_bytes and
+    NotAnImage when the data has no image signature; nothing is left on disk then.
+    """
+    fd, path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+    try:
+        size = 0
+        header = b''
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f'Screenshot is larger than {max_bytes} bytes')
+                if len(header) < 12:
+                    header += chunk[:12 - len(header)]
+                f.write(chunk)
+        kind = image_type(header)
+        if kind is None:
+            raise NotAnImage('Screenshot is not a PNG, JPEG, GIF or WebP image')
+        return path, kind
+    except BaseException:
+        os.remove(path)
+        raise
+
+
+def _open(path):
+    image = Image.open(path)
+    width, height = image.size
+    if width * height > MAX_PIXELS:
+        raise NotAnImage(f'Screenshot is {width}x{height}, more than {MAX_PIXELS} pixels')
+    image.draft('RGB', (MAX_DIMENSION, MAX_DIMENSION))  # JPEGs decode at a reduced scale
+    image = ImageOps.exif_transpose(image)
+    return image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+
+
+def _save_webp(image, target, quality):
+    tmp = target + '.tmp'
+    image.save(tmp, 'WEBP', quality=quality, method=4)
+    os.replace(tmp, target)
+
+
+def reencode(source, target, max_dimension=MAX_DIMENSION):
+    """Write `source` to `target` as WebP fitting in max_dimension x max_dimension"""
+    try:
+        image = _open(source)
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        _save_webp(image, target, WEBP_QUALITY)
+    except FileNotFoundError:
+        raise
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        raise NotAnImage(str(e)) from e
+
+
+def thumbnail(source, target, size=THUMBNAIL_SIZE):
+    """Write a WebP thumbnail of `source` to `target`, creating its directory"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        image = _open(source)
+        image.thumbnail(size, Image.LANCZOS)
+        _save_webp(image, target, THUMBNAIL_QUALITY)
+    except FileNotFoundError:
+        raise
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        raise NotAnImage(str(e)) from e
+
+
+def thumbnail_name(filename):
+    return os.path.splitext(os.path.basename(filename))[0] + '.webp'
@@ -0,0 +1,198 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const draftKey = 'assignment_' + document.body.dataset.assignmentId + '_draft';
+    const submitBtn = document.getElementById('submitBtn');
+    const assignmentFrame = document.getElementById('assignmentFrame');
+    const submissionForm = document.getElementById('submissionForm');
+    const submittedContent = document.getElementById('submittedContent');
+    const submittedScreenshot = document.getElementById('submittedScreenshot');
+    const screenshotUpload = document.getElementById('screenshotUpload');
+
+    function screenshotTooLarge(file, input) {
+        const maxBytes = Number(input.dataset.maxBytes);
+        if (file && maxBytes && file.size > maxBytes) {
+            alert('The screenshot is too large (at most ' + Math.floor(maxBytes / (1024 * 1024)) + ' MB).');
+            return true;
+        }
+        return false;
+    }
+
+    if (submitBtn && assignmentFrame && submissionForm && submittedContent) {
+        submitBtn.addEventListener('click', function() {
+            try {
+                console.log('Starting submission capture...');
+                const iframeDoc = assignmentFrame.contentDocument || assignmentFrame.contentWindow.document;
+
+                if (!iframeDoc) {
+                    console.error('Could not access iframe document');
+                    alert('Error: Cannot access assignment content. Please try refreshing the page.');
+                    return;
+                }
+
+                console.log('Iframe document accessed successfully');
+
+                let inputCount = 0;
+                const inputs = iframeDoc.querySelectorAll('input');
+                inputs.forEach(input => {
+                    inputCount++;
+                    if (input.type === 'checkbox' || input.type === 'radio') {
+                        if (input.checked) {
+                            input.setAttribute('checked', 'checked');
+                        } else {
+                            input.removeAttribute('checked');
+                        }
+                    } else {
+                        input.setAttribute('value', input.value);
+                    }
+                });
+                console.log('Processed', inputCount, 'input elements');
+
+                let textareaCount = 0;
+                const textareas = iframeDoc.querySelectorAll('textarea');
+                textareas.forEach(textarea => {
+                    textareaCount++;
+                    textarea.textContent = textarea.value;
+                });
+                console.log('Processed', textareaCount, 'textarea elements');
+
+                let selectCount = 0;
+                const selects = iframeDoc.querySelectorAll('select');
+                selects.forEach(select => {
+                    selectCount++;
+                    const options = select.querySelectorAll('option');
+                    options.forEach(option => {
+                        if (option.value === select.value) {
+                            option.setAttribute('selected', 'selected');
+                        } else {
+                            option.removeAttribute('selected');
+                        }
+                    });
+                });
+                console.log('Processed', selectCount, 'select elements');
+
+                const serializer = new XMLSerializer();
+                let htmlContent = serializer.serializeToString(iframeDoc);
+                console.log('Serialized HTML length:', htmlContent.length);
+
+                submittedContent.value = htmlContent;
+
+                if (submittedScreenshot && screenshotTooLarge(submittedScreenshot.files[0], submittedScreenshot)) {
+                    submittedScreenshot.value = '';
+                    return;
+                }
+
+                // Confirm submission
+                if (confirm('Are you sure you want to submit this assignment? Once submitted, you cannot make changes.')) {
+                    // Submit the form
+                    submissionForm.submit();
+                }
+            } catch (error) {
+                console.error('Error accessing iframe content:', error);
+                alert('Error accessing assignment content. Please make sure you have completed the assignment and try again.');
+            }
+        });
+
+        // Auto-save functionality
+        let autoSaveTimer;
+
+        function autoSaveContent() {
+            try {
+                const iframeDoc = assignmentFrame.contentDocument || assignmentFrame.contentWindow.document;
+
+                iframeDoc.querySelectorAll('input').forEach(input => {
+                    if (input.type === 'checkbox' || input.type === 'radio') {
+                        if (input.checked) {
+                            input.setAttribute('checked', 'checked');
+                        } else {
+                            input.removeAttribute('checked');
+                        }
+                    } else {
+                        input.setAttribute('value', input.value);
+                    }
+                });
+
+                iframeDoc.querySelectorAll('textarea').forEach(textarea => {
+                    textarea.textContent = textarea.value;
+                });
+
+                iframeDoc.querySelectorAll('select').forEach(select => {
+                    const options = select.querySelectorAll('option');
+                    options.forEach(option => {
+                        if (option.value === select.value) {
+                            option.setAttribute('selected', 'selected');
+                        } else {
+                            option.removeAttribute('selected');
+                        }
+                    });
+                });
+
+                const serializer = new XMLSerializer();
+                let htmlContent = serializer.serializeToString(iframeDoc);
+
+                if (htmlContent && htmlContent.trim()) {
+                    localStorage.setItem(draftKey, htmlContent);
+                    console.log('Auto-saved draft');
+                }
+            } catch (error) {
+                console.log('Could not auto-save:', error);
+            }
+        }
+
+        // Load saved draft once the worksheet has arrived from its own URL
+        assignmentFrame.addEventListener('load', function() {
+            try {
+                const savedDraft = localStorage.getItem(draftKey);
+                if (savedDraft && assignmentFrame.contentDocument) {
+                    assignmentFrame.contentDocument.documentElement.outerHTML = savedDraft;
+                    console.log('Loaded saved draft');
+                }
+            } catch (error) {
+                console.log('Could not load draft:', error);
+            }
+        });
+
+        // Set up auto-save every 30 seconds
+        autoSaveTimer = setInterval(autoSaveContent, 30000);
+
+        // Clear auto-save on page unload
+        window.addEventListener('beforeunload', function() {
+            clearInterval(autoSaveTimer);
+        });
+    }
+
+    // Attach or replace the screenshot of a submission that has not been graded yet
+    if (screenshotUpload) {
+        const status = screenshotUpload.querySelector('.screenshot-status');
+        screenshotUpload.addEventListener('submit', async function(event) {
+            event.preventDefault();
+            const file = screenshotUpload.elements.screenshot.files[0];
+            if (!file || screenshotTooLarge(file, screenshotUpload)) {
+                return;
+            }
+            status.textContent = 'Uploading...';
+            try {
+                const response = await fetch(screenshotUpload.action, {
+                    method: 'PUT',
+                    headers: {'Content-Type': file.type || 'application/octet-stream',
+                              'X-CSRFToken': screenshotUpload.elements.csrf_token.value},
+                    body: file
+                });
+                const result = await response.json().catch(function() { return {}; });
+                status.textContent = response.ok ? 'Screenshot uploaded.' : (result.error || response.statusText);
+            } catch (error) {
+                status.textContent = 'Upload failed. Please try again.';
+            }
+        });
+    }
+
+    // Clear draft on successful submission (handled by form submission)
+    if (submissionForm) {
+        const originalSubmit = submissionForm.onsubmit;
+        submissionForm.onsubmit = function() {
+            localStorage.removeItem(draftKey);
+            if (originalSubmit) {
+                return originalSubmit.call(this);
+            }
+            return true;
+        };
+    }
+});
@@ -0,0 +1,47 @@
+function openHTMLAssignment(event, assignmentId) {
+    // Prevent default link behavior
+    event.preventDefault();
+
+    // Get the original href
+    const originalHref = event.currentTarget.href;
+
+    // Try to open in new tab with multiple approaches
+    try {
+        // Method 1: Standard window.open
+        const newWindow = window.open(originalHref, '_blank');
+
+        // If window.open was blocked, try alternative methods
+        if (!newWindow || newWindow.closed || typeof newWindow.closed == 'undefined') {
+            // Method 2: Create a temporary link and click it
+            const tempLink = document.createElement('a');
+            tempLink.href = originalHref;
+            tempLink.target = '_blank';
+            tempLink.style.display = 'none';
+            document.body.appendChild(tempLink);
+            tempLink.click();
+            document.body.removeChild(tempLink);
+
+            // If still not working, show a message
+            setTimeout(() => {
+                if (!window.focus) {
+                    alert('Please allow pop-ups for this site to open HTML assignments in new tabs.');
+                }
+            }, 100);
+        } else {
+            // Focus the new window
+            newWindow.focus();
+        }
+    } catch (error) {
+        console.error('Error opening HTML assignment:', error);
+
+        // Fallback: Open in same tab with a message
+        if (confirm('Unable to open in new tab. Would you like to open in this tab instead?')) {
+            window.location.href = originalHref;
+        }
+    }
+}
+
+// Confirmation function for assignment deletion
+function confirmDeleteAssignment() {
+    return confirm('Are you sure you want to delete this assignment? This action cannot be undone and will also delete all associated submissions.');
+}
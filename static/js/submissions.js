@@ -0,0 +1,72 @@
+function showSubmissionModal(submissionId) {
+    const modal = document.getElementById('modal-' + submissionId);
+    // Load the answer only the first time its modal is opened
+    const iframe = modal.querySelector('iframe[data-src]');
+    if (iframe && !iframe.getAttribute('src')) {
+        iframe.setAttribute('src', iframe.dataset.src);
+    }
+    modal.style.display = 'block';
+}
+
+// Inline grading: changed rows are saved through the batch grading API in groups
+const GRADE_BATCH_SIZE = 100;
+
+function toggleInlineGrading() {
+    document.getElementById('submissions-table').classList.toggle('inline-grading');
+    document.getElementById('inline-grading-form').classList.toggle('inline-grading');
+}
+
+function changedGrades() {
+    const grades = [];
+    document.querySelectorAll('.inline-grade').forEach(function(input) {
+        const id = input.dataset.submissionId;
+        const feedback = document.querySelector('.inline-feedback[data-submission-id="' + id + '"]');
+        if (input.value.trim() !== '' && (input.value !== input.defaultValue || feedback.value !== feedback.defaultValue)) {
+            grades.push({submission_id: Number(id), grade: Number(input.value), feedback: feedback.value});
+        }
+    });
+    return grades;
+}
+
+async function saveGrades(event) {
+    event.preventDefault();
+    const form = event.target;
+    const status = document.getElementById('inline-grading-status');
+    const grades = changedGrades();
+    let saved = 0;
+    for (let i = 0; i < grades.length; i += GRADE_BATCH_SIZE) {
+        const batch = grades.slice(i, i + GRADE_BATCH_SIZE);
+        const response = await fetch(form.action, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json', 'X-CSRFToken': form.elements.csrf_token.value},
+            body: JSON.stringify({grades: batch})
+        });
+        const result = await response.json().catch(function() { return {}; });
+        if (!response.ok) {
+            status.textContent = (result.details || [result.error || response.statusText]).join('; ');
+            return;
+        }
+        saved += result.graded;
+        batch.forEach(function(grade) {
+            const input = document.querySelector('.inline-grade[data-submission-id="' + grade.submission_id + '"]');
+            const feedback = document.querySelector('.inline-feedback[data-submission-id="' + grade.submission_id + '"]');
+            input.defaultValue = input.value;
+            feedback.defaultValue = feedback.value;
+            input.parentNode.querySelector('.grade-value').textContent = input.value;
+        });
+    }
+    status.textContent = status.dataset.savedLabel + ' ' + saved;
+}
+
+document.getElementById('inline-grading-form')?.addEventListener('submit', saveGrades);
+
+function closeSubmissionModal(submissionId) {
+    document.getElementById('modal-' + submissionId).style.display = 'none';
+}
+
+// Close modal when clicking outside of it
+window.onclick = function(event) {
+    if (event.target.classList.contains('submission-modal')) {
+        event.target.style.display = 'none';
+    }
+}
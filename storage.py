@@ -0,0 +1,338 @@
+# Storage for uploaded files: a local directory or an S3-compatible bucket
+#
+# Files are addressed by content: the key of a file is the SHA-256 of its bytes
+# plus an extension ("<64 hex digits>.webp"), stored sharded by hash prefix
+# (ab/cd/abcd...webp) so that no directory or listing grows past a few hundred
+# entries. Identical uploads, such as the same worksheet from two teachers,
+# share one stored file, and a key never changes meaning, so it can be cached
+# forever. Callers release keys they stop using with release_uploads() in app.py, which
+# deletes a file only once no row refers to it.
+#
+# Because files are shared, a deletion can race with an upload of the same content
+# whose row is not committed yet. put_file() therefore touches a file it finds
+# already stored, and delete_if_untouched() keeps any file touched after a cutoff,
+# which the caller sets far enough back that such an upload has committed since.
+#
+# Files written before content addressing have flat names ("assignment_1_2024...
+# .html") and are still read from the root of the local directory.
+import hashlib
+import hmac
+import os
+import re
+import shutil
+import tempfile
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+CHUNK_SIZE = 64 * 1024
+
+KEY_PATTERN = re.compile(r'^[0-9a-f]{64}\.[a-z0-9]{1,8}$')
+LEGACY_NAME_PATTERN = re.compile(r'^[\w-][\w.-]*$')
+
+EMPTY_SHA256 = hashlib.sha256(b'').hexdigest()
+
+
+class StorageError(Exception):
+    pass
+
+
+def is_content_key(key):
+    return bool(key) and KEY_PATTERN.match(key) is not None
+
+
+def shard(key):
+    return f'{key[:2]}/{key[2:4]}/{key}'
+
+
+def _extension(extension):
+    extension = extension.lower().lstrip('.')
+    if not re.match(r'^[a-z0-9]{1,8}$', extension):
+        raise ValueError(f'Invalid file extension: {extension!r}')
+    return extension
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _file_chunks(path):
+    with open(path, 'rb') as f:
+        yield from iter(lambda: f.read(CHUNK_SIZE), b'')
+
+
+class LocalStorage:
+    """Files in a directory on this machine (or a disk shared between instances)"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        if is_content_key(key):
+            return os.path.join(self.root, *shard(key).split('/'))
+        if LEGACY_NAME_PATTERN.match(key or '') and os.path.basename(key) == key:
+            return os.path.join(self.root, key)
+        raise KeyError(key)
+
+    def relative_path(self, key):
+        """The file's path under root with forward slashes, for a proxy serving root itself"""
+        self.path(key)  # Validates the key
+        return shard(key) if is_content_key(key) else key
+
+    def staging_dir(self):
+        """Where to write files before put_file(), on the same filesystem so the move is atomic"""
+        path = os.path.join(self.root, '.staging')
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def put_file(self, path, extension):
+        """Store the file at `path` (which is moved or removed) and return its key"""
+        key = f'{file_digest(path)}.{_extension(extension)}'
+        target = self.path(key)
+        try:
+            os.utime(target)  # Already stored; the new mtime keeps a concurrent release from deleting it
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(path, target)
+        else:
+            os.remove(path)
+        return key
+
+    def put_bytes(self, data, extension):
+        fd, path = tempfile.mkstemp(dir=self.staging_dir())
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        return self.put_file(path, extension)
+
+    def exists(self, key):
+        try:
+            return os.path.isfile(self.path(key))
+        except KeyError:
+            return False
+
+    def size(self, key):
+        return os.path.getsize(self.path(key))
+
+    def chunks(self, key):
+        """The file's bytes as an iterable of chunks; raises FileNotFoundError when it is missing"""
+        path = self.path(key)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(key)
+        return _file_chunks(path)
+
+    def local_path(self, key):
+        """A path the file can be read from directly, or None if the backend has none"""
+        return self.path(key)
+
+    @contextmanager
+    def local_copy(self, key):
+        path = self.path(key)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(key)
+        yield path
+
+    def delete(self, key):
+        """Remove a file; returns True if it existed"""
+        try:
+            os.remove(self.path(key))
+            return True
+        except (FileNotFoundError, KeyError):
+            return False
+
+    def delete_if_untouched(self, key, since):
+        """Remove a file unless it was stored or touched at or after `since` (a Unix time)
+
+        Returns False only when the file was kept for being that recent.
+        """
+        try:
+            path = self.path(key)
+        except KeyError:
+            return True
+        # Moved aside first: put_file can no longer touch it, only store it afresh
+        aside = os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.{os.getpid()}.{threading.get_ident()}')
+        try:
+            os.rename(path, aside)
+        except FileNotFoundError:
+            return True
+        if os.stat(aside).st_mtime >= since:
+            os.replace(aside, path)  # Any copy stored meanwhile has the same content
+            return False
+        os.remove(aside)
+        return True
+
+    def legacy_names(self):
+        """Flat-named files written before content addressing"""
+        try:
+            return [entry.name for entry in os.scandir(self.root)
+                    if entry.is_file() and not entry.name.startswith('.')]
+        except FileNotFoundError:
+            return []
+
+
+def sigv4_headers(method, url, region, access_key, secret_key, payload_hash, headers=None, now=None, service='s3'):
+    """Headers (including Authorization) signing a request with AWS Signature Version 4"""
+    parts = urllib.parse.urlsplit(url)
+    now = now or datetime.now(timezone.utc)
+    amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+    date = amz_date[:8]
+    signed = {k.lower(): str(v).strip() for k, v in (headers or {}).items()}
+    signed.update({'host': parts.netloc, 'x-amz-content-sha256': payload_hash, 'x-amz-date': amz_date})
+    names = sorted(signed)
+    query = '&'.join(f'{urllib.parse.quote(k, safe="-_.~")}={urllib.parse.quote(v, safe="-_.~")}'
+                     for k, v in sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True)))
+    canonical_request = '\n'.join([
+        method,
+        urllib.parse.quote(parts.path or '/', safe='/-_.~'),
+        query,
+        ''.join(f'{name}:{signed[name]}\n' for name in names),
+        ';'.join(names),
+        payload_hash,
+    ])
+    scope = f'{date}/{region}/{service}/aws4_request'
+    string_to_sign = '\n'.join([
+        'AWS4-HMAC-SHA256', amz_date, scope, hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()])
+    key = ('AWS4' + secret_key).encode('utf-8')
+    for part in (date, region, service, 'aws4_request'):
+        key = hmac.new(key, part.encode('utf-8'), hashlib.sha256).digest()
+    signature = hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+    signed['authorization'] = (f'AWS4-HMAC-SHA256 Credential={access_key}/{scope}, '
+                               f'SignedHeaders={";".join(names)}, Signature={signature}')
+    del signed['host']  # Added by urllib from the URL
+    return signed
+
+
+class S3Storage:
+    """Files in a bucket of S3 or an S3-compatible server (MinIO, R2, ...), addressed path-style"""
+
+    def __init__(self, endpoint_url, bucket, access_key, secret_key, region='us-east-1', prefix='', timeout=30):
+        self.endpoint_url = endpoint_url.rstrip('/')
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.timeout = timeout
+
+    def url(self, key):
+        if not is_content_key(key):
+            raise KeyError(key)
+        return f'{self.endpoint_url}/{self.bucket}/{self.prefix}{shard(key)}'
+
+    def _request(self, method, key, body=None, payload_hash=EMPTY_SHA256, headers=None):
+        url = self.url(key)
+        headers = sigv4_headers(method, url, self.region, self.access_key, self.secret_key, payload_hash, headers)
+        request = urllib.request.Request(url, data=body, method=method, headers=headers)
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                raise FileNotFoundError(key) from e
+            raise StorageError(f'{method} {key} failed: {e.code} {e.reason}') from e
+        except urllib.error.URLError as e:
+            raise StorageError(f'{method} {key} failed: {e.reason}') from e
+
+    def staging_dir(self):
+        return tempfile.gettempdir()
+
+    def put_file(self, path, extension):
+        digest = file_digest(path)
+        key = f'{digest}.{_extension(extension)}'
+        try:
+            try:
+                self.touch(key)
+            except FileNotFoundError:
+                with open(path, 'rb') as f:
+                    # The content hash doubles as the payload hash S3 verifies
+                    self._request('PUT', key, body=f, payload_hash=digest,
+                                  headers={'Content-Length': os.path.getsize(path)}).close()
+        finally:
+            os.remove(path)
+        return key
+
+    def touch(self, key):
+        """Renew an object's Last-Modified by copying it onto itself; FileNotFoundError if it is missing"""
+        source = urllib.parse.urlsplit(self.url(key)).path
+        self._request('PUT', key, body=b'', headers={
+            'x-amz-copy-source': source, 'x-amz-metadata-directive': 'REPLACE'}).close()
+
+    def put_bytes(self, data, extension):
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        return self.put_file(path, extension)
+
+    def exists(self, key):
+        try:
+            self._request('HEAD', key).close()
+            return True
+        except (FileNotFoundError, KeyError):
+            return False
+
+    def size(self, key):
+        with self._request('HEAD', key) as response:
+            return int(response.headers['Content-Length'])
+
+    def chunks(self, key):
+        response = self._request('GET', key)
+
+        def read():
+            with response:
+                yield from iter(lambda: response.read(CHUNK_SIZE), b'')
+        return read()
+
+    def local_path(self, key):
+        return None
+
+    @contextmanager
+    def local_copy(self, key):
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(key)[1])
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in self.chunks(key):
+                    f.write(chunk)
+            yield path
+        finally:
+            os.remove(path)
+
+    def delete(self, key):
+        try:
+            self._request('DELETE', key).close()
+            return True
+        except (FileNotFoundError, KeyError):
+            return False
+
+    def delete_if_untouched(self, key, since):
+        # S3 has no atomic move, so only a touch landing between the HEAD and the
+        # DELETE (one round trip) goes unseen
+        try:
+            with self._request('HEAD', key) as response:
+                modified = parsedate_to_datetime(response.headers['Last-Modified']).timestamp()
+        except (FileNotFoundError, KeyError):
+            return True
+        if modified >= since:
+            return False
+        self.delete(key)
+        return True
+
+    def legacy_names(self):
+        return []
+
+
+def from_config(config):
+    """The backend named by config['STORAGE_BACKEND']: 'local' (UPLOAD_FOLDER) or 's3'"""
+    backend = config.get('STORAGE_BACKEND', 'local')
+    if backend == 'local':
+        return LocalStorage(config['UPLOAD_FOLDER'])
+    if backend == 's3':
+        return S3Storage(config['S3_ENDPOINT_URL'], config['S3_BUCKET'], config['S3_ACCESS_KEY_ID'],
+                         config['S3_SECRET_ACCESS_KEY'], config.get('S3_REGION') or 'us-east-1',
+                         config.get('S3_PREFIX') or '')
+    raise ValueError(f'Unknown storage backend: {backend}')
@@ -0,0 +1,214 @@
+# Submissions stored as a delta against their assignment's worksheet
+#
+# A submission is the worksheet document re-serialized in the browser with the
+# student's answers filled in, so almost all of it repeats the assignment's
+# html_content. encode() keeps only what differs: copies of ranges of the
+# template plus the inserted text. decode() rebuilds the exact original string.
+#
+# A delta is a JSON array whose first element is the format version followed by
+# operations, either a string to insert or a pair of integers (skip, length)
+# copying `length` characters from the template starting `skip` characters after
+# the end of the previous copy.
+import bisect
+import difflib
+import json
+import threading
+from collections import OrderedDict
+
+FORMAT_VERSION = 1
+
+# Copies shorter than this cost more as "skip,length" than as literal text
+MIN_COPY = 12
+# Changed regions are diffed character by character unless len(old) * len(new)
+# exceeds this, which would make difflib too slow; those are stored as literal text
+MAX_CHAR_DIFF = 4000000
+# Only worth storing as a delta when it is at most this fraction of the full document
+MAX_RATIO = 0.5
+
+
+class DeltaError(ValueError):
+    pass
+
+
+def _unique_positions(lines, lo, hi):
+    seen = {}
+    for i in range(lo, hi):
+        seen[lines[i]] = i if lines[i] not in seen else None
+    return {line: i for line, i in seen.items() if i is not None}
+
+
+def _longest_increasing(pairs):
+    """Longest run of (i, j) pairs, sorted by i, whose j also increases (patience sorting)"""
+    tails, tail_idx, prev = [], [], [None] * len(pairs)
+    for k, (_, j) in enumerate(pairs):
+        pos = bisect.bisect_left(tails, j)
+        if pos == len(tails):
+            tails.append(j)
+            tail_idx.append(k)
+        else:
+            tails[pos] = j
+            tail_idx[pos] = k
+        prev[k] = tail_idx[pos - 1] if pos else None
+    result = []
+    k = tail_idx[-1] if tail_idx else None
+    while k is not None:
+        result.append(pairs[k])
+        k = prev[k]
+    return result[::-1]
+
+
+def _match_lines(a, b, alo, ahi, blo, bhi, matches):
+    """Append matching (i, j) line pairs to `matches` using patience diff"""
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        matches.append((alo, blo))
+        alo += 1
+        blo += 1
+    suffix = []
+    while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+        ahi -= 1
+        bhi -= 1
+        suffix.append((ahi, bhi))
+    if alo < ahi and blo < bhi:
+        unique_a = _unique_positions(a, alo, ahi)
+        unique_b = _unique_positions(b, blo, bhi)
+        anchors = _longest_increasing(sorted(
+            (i, unique_b[line]) for line, i in unique_a.items() if line in unique_b
+        ))
+        if anchors:
+            for i, j in anchors:
+                _match_lines(a, b, alo, i, blo, j, matches)
+                matches.append((i, j))
+                alo, blo = i + 1, j + 1
+            _match_lines(a, b, alo, ahi, blo, bhi, matches)
+    matches.extend(reversed(suffix))
+
+
+class _DeltaBuilder:
+    def __init__(self, base):
+        self.base = base
+        self.ops = [FORMAT_VERSION]
+        self.pos = 0
+
+    def insert(self, text):
+        if not text:
+            return
+        if isinstance(self.ops[-1], str):
+            self.ops[-1] += text
+        else:
+            self.ops.append(text)
+
+    def copy(self, start, length):
+        if length < MIN_COPY:
+            self.insert(self.base[start:start + length])
+            return
+        if start == self.pos and len(self.ops) > 1 and not isinstance(self.ops[-1], str):
+            self.ops[-1] += length  # Continues the previous copy
+        else:
+            self.ops.extend((start - self.pos, length))
+        self.pos = start + length
+
+    def replace(self, start, old, new):
+        """Changed region: diff it character by character when small enough"""
+        if not old or len(old) * len(new) > MAX_CHAR_DIFF:
+            self.insert(new)
+            return
+        for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, old, new, autojunk=False).get_opcodes():
+            if tag == 'equal':
+                self.copy(start + i1, i2 - i1)
+            else:
+                self.insert(new[j1:j2])
+
+
+def diff(base, content):
+    """Delta turning `base` into `content`, as a JSON string"""
+    a = base.splitlines(keepends=True)
+    b = content.splitlines(keepends=True)
+    offsets = [0]
+    for line in a:
+        offsets.append(offsets[-1] + len(line))
+
+    matches = []
+    _match_lines(a, b, 0, len(a), 0, len(b), matches)
+    matches.append((len(a), len(b)))  # Sentinel closing the last gap
+
+    builder = _DeltaBuilder(base)
+    ai = bj = 0
+    run_start = None
+    for i, j in matches:
+        if i == ai and j == bj and i < len(a):
+            # Extends the current run of matching lines
+            run_start = offsets[i] if run_start is None else run_start
+            ai, bj = i + 1, j + 1
+            continue
+        if run_start is not None:
+            builder.copy(run_start, offsets[ai] - run_start)
+            run_start = None
+        builder.replace(offsets[ai], base[offsets[ai]:offsets[i]], ''.join(b[bj:j]))
+        if i < len(a):
+            run_start = offsets[i]
+        ai, bj = i + 1, j + 1
+    if run_start is not None:
+        builder.copy(run_start, offsets[len(a)] - run_start)
+    return json.dumps(builder.ops, ensure_ascii=False, separators=(',', ':'))
+
+
+def encode(base, content):
+    """Delta for `content` against `base`, or None when storing it in full is better"""
+    if not base or not content:
+        return None
+    delta = diff(base, content)
+    if len(delta) > len(content) * MAX_RATIO:
+        return None
+    if decode(base, delta) != content:  # Never store something that doesn't round-trip
+        return None
+    return delta
+
+
+def decode(base, delta):
+    """Rebuild the full document from `base` and a delta made by encode()"""
+    try:
+        ops = json.loads(delta)
+    except ValueError as e:
+        raise DeltaError(f'Malformed delta: {e}') from e
+    if not ops or ops[0] != FORMAT_VERSION:
+        raise DeltaError(f'Unsupported delta format {ops[:1]}')
+
+    parts = []
+    pos = 0
+    it = iter(ops[1:])
+    for op in it:
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            start = pos + op
+            pos = start + next(it)
+            if start < 0 or pos > len(base):
+                raise DeltaError('Delta copies outside the template')
+            parts.append(base[start:pos])
+    return ''.join(parts)
+
+
+class TemplateCache:
+    """Small LRU of templates by content hash; a hash always names the same text"""
+
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, content_hash, load):
+        with self._lock:
+            if content_hash in self._entries:
+                self._entries.move_to_end(content_hash)
+                return self._entries[content_hash]
+        template = load()
+        if template is not None:
+            with self._lock:
+                self._entries[content_hash] = template
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return template
+
+    def discard(self, content_hash):
+        with self._lock:
+            self._entries.pop(content_hash, None)
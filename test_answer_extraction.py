@@ -0,0 +1,95 @@
+# Test extraction of submitted answers into the answer table
+import pytest
+import answer_extraction
+from app import (app, db, Assignment, Submission, Answer, backfill_answers, run_pending_jobs,
+                 run_purge_task, schedule_purge)
+
+
+# As serialized by XMLSerializer after interactive_assignment.html records field state
+SUBMITTED = '''<html xmlns="http://www.w3.org/1999/xhtml"><head><script>var t = '<input value="no">';</script></head><body>
+<input type="text" id="q1" value="貓 &amp; 狗" />
+<input type="radio" name="q2" id="q2a" value="A" /><input type="radio" name="q2" id="q2b" value="B" checked="checked" />
+<input type="checkbox" name="q3" value="x" checked="checked" /><input type="checkbox" name="q3" value="y" checked="checked" />
+<textarea name="q4">第一行
+第二行 &lt;b&gt;</textarea><textarea name="q5" />
+<select id="q6"><option value="1">One</option><option value="2" selected="selected">Two</option></select>
+<input type="button" value="Check" /><input value="unnamed" />
+</body></html>'''
+
+
+@pytest.fixture
+def quiz(classroom):
+    """(assignment id, student id) of a one-question quiz allocated to student"""
+    _, assignment_id, (student_id,) = classroom(students=['student'], title='Quiz')
+    with app.app_context():
+        db.session.get(Assignment, assignment_id).set_html_content('<html><body><input id="q1"></body></html>')
+        db.session.commit()
+    return assignment_id, student_id
+
+
+def stored_answers():
+    return [(a.question_key, a.element_type, a.value) for a in Answer.query.order_by(Answer.position)]
+
+
+EXPECTED = [
+    ('q1', 'text', '貓 & 狗'),
+    ('q2', 'radio', 'B'),
+    ('q3', 'checkbox', 'x'),
+    ('q3', 'checkbox', 'y'),
+    ('q4', 'textarea', '第一行\n第二行 <b>'),
+    ('q5', 'textarea', ''),
+    ('q6', 'select', '2'),
+    ('input-1', 'text', 'unnamed'),
+]
+
+
+def test_parser_reads_recorded_field_state():
+    answers = answer_extraction.extract_answers(SUBMITTED)
+    assert [(a.question_key, a.element_type, a.value) for a in answers] == EXPECTED
+    assert [a.position for a in answers] == list(range(len(EXPECTED)))
+    # Chunk boundaries inside tags and entities don't change the result
+    chunks = [SUBMITTED[i:i + 7] for i in range(0, len(SUBMITTED), 7)]
+    assert answer_extraction.extract_answers(chunks) == answers
+
+
+def test_submit_extracts_answers(quiz, login):
+    assignment_id, _ = quiz
+    with app.test_client() as client:
+        login(client, 'student')
+        response = client.post(f'/submit_html_assignment/{assignment_id}', data={'content': SUBMITTED})
+        assert response.status_code == 302
+
+    with app.app_context():
+        # Extraction is queued rather than done while the student waits
+        assert stored_answers() == []
+        assert Submission.query.one().answers_version is None
+        assert run_pending_jobs() >= 1
+        assert stored_answers() == EXPECTED
+        submission = Submission.query.one()
+        assert submission.answers_version == answer_extraction.EXTRACTOR_VERSION
+        assert [a.value for a in submission.answers][:2] == ['貓 & 狗', 'B']
+        assert {a.assignment_id for a in submission.answers} == {assignment_id}
+
+
+def test_backfill_and_purge(quiz):
+    assignment_id, student_id = quiz
+    with app.app_context():
+        db.session.add(Submission(assignment_id=assignment_id, student_id=student_id, content=SUBMITTED))
+        db.session.commit()
+        assert stored_answers() == []
+
+        assert backfill_answers() == 1
+        assert backfill_answers() == 0
+        assert stored_answers() == EXPECTED
+
+        # Re-extraction after an extractor change replaces the rows
+        Submission.query.one().answers_version = 0
+        db.session.commit()
+        assert backfill_answers() == 1
+        assert stored_answers() == EXPECTED
+
+        task = schedule_purge('assignment', assignment_id)
+        db.session.commit()
+        run_purge_task(task.id)
+        assert Answer.query.count() == 0
+
@@ -0,0 +1,149 @@
+# Test the per-assignment analytics and their materialized, incrementally invalidated storage
+import time
+
+import numpy as np
+import pytest
+
+import analytics
+import answer_extraction
+from app import app, db, User, Assignment, Submission, Answer, AssignmentStats
+
+CLASS_SIZE = 10000
+ANSWER_KEY = {'q1': 'A', 'q2': 'B', 'q3': 'C', 'q10': 'D'}
+WORKSHEET = ''.join(
+    f'<div class="question" id="{q}"><div class="option" data-answer="A">A</div>'
+    f'<div class="option" data-answer="D">D</div></div>' for q in ANSWER_KEY
+)
+
+
+def test_grade_statistics():
+    stats = analytics.grade_statistics([50.0, None, 100.0, 75.0, 95.0])
+    assert stats['submitted'] == 5
+    assert stats['graded'] == 4
+    assert stats['mean'] == 80.0 and stats['median'] == 85.0
+    assert stats['min'] == 50.0 and stats['max'] == 100.0
+    assert [b['count'] for b in stats['distribution']] == [0, 0, 0, 0, 0, 1, 0, 1, 0, 2]
+    assert analytics.grade_statistics([None])['mean'] is None
+    assert analytics.completion_rate(5, 10) == 0.5
+    assert analytics.completion_rate(1, 0) is None
+
+
+def test_question_statistics():
+    rows = [(1, 'q1', 'A'), (1, 'q2', 'C'), (2, 'q1', 'a'), (2, 'q10', 'D'), (3, 'q1', 'B')]
+    stats = analytics.question_statistics(ANSWER_KEY, rows, [1, 2, 3, 4])
+    assert [q['question'] for q in stats] == ['q1', 'q2', 'q3', 'q10']
+    q1 = stats[0]
+    assert q1['answered_rate'] == 0.75 and q1['correct_rate'] == 0.5 and q1['most_common'] == 'a'
+    assert stats[2] == {'question': 'q3', 'answered_rate': 0.0, 'correct_rate': 0.0, 'most_common': None}
+    # Without a key, every field is reported by how often it was answered
+    stats = analytics.question_statistics(None, rows, [1, 2], question_keys=['q2', 'q1'])
+    assert [(q['question'], q['answered_rate'], q['correct_rate']) for q in stats] == [('q1', 1.0, None), ('q2', 0.5, None)]
+
+
+@pytest.fixture
+def seeded_class(classroom):
+    """A worksheet with an answer key, allocated to CLASS_SIZE students who have all submitted and one who has not"""
+    rng = np.random.default_rng(3)
+    _, assignment_id, student_ids = classroom(students=[f's{i}' for i in range(CLASS_SIZE + 1)], title='Quiz',
+                                              description='', html_filename='quiz.html', answer_key=ANSWER_KEY)
+    with app.app_context():
+        db.session.get(Assignment, assignment_id).set_html_content(WORKSHEET)
+        grades = rng.integers(0, 101, CLASS_SIZE).astype(float)
+        db.session.execute(Submission.__table__.insert(), [
+            {'assignment_id': assignment_id, 'student_id': s, 'content': '<p>answered</p>', 'grade': g,
+             'answers_version': answer_extraction.EXTRACTOR_VERSION}
+            for s, g in zip(student_ids[:CLASS_SIZE], grades)
+        ])
+        submission_ids = [row[0] for row in db.session.query(Submission.id).order_by(Submission.id)]
+        choices = rng.choice(list('ABCD'), size=(CLASS_SIZE, len(ANSWER_KEY)))
+        db.session.execute(Answer.__table__.insert(), [
+            {'submission_id': sid, 'assignment_id': assignment_id, 'position': j, 'question_key': q,
+             'element_type': 'choice', 'value': str(choices[i, j])}
+            for i, sid in enumerate(submission_ids) for j, q in enumerate(ANSWER_KEY)
+        ])
+        db.session.commit()
+    expected_correct = {q: float(np.round((choices[:, j] == ANSWER_KEY[q]).mean(), 2))
+                        for j, q in enumerate(ANSWER_KEY)}
+    return assignment_id, student_ids[CLASS_SIZE], grades, expected_correct
+
+
+def stored_stats(assignment_id):
+    with app.app_context():
+        return db.session.get(AssignmentStats, assignment_id)
+
+
+def test_materialized_analytics(seeded_class, login):
+    assignment_id, last_student, grades, expected_correct = seeded_class
+    with app.test_client() as client:
+        login(client, 'teacher')
+        started = time.perf_counter()
+        response = client.get(f'/assignment/{assignment_id}/analytics')
+        first = time.perf_counter() - started
+        assert response.status_code == 200
+        assert b'Completion rate' in response.data
+        assert first < 10, first
+
+        stats = stored_stats(assignment_id)
+        assert stats.grade_stats['submitted'] == CLASS_SIZE
+        assert '{:.0f}%'.format(100 * CLASS_SIZE / (CLASS_SIZE + 1)).encode() in response.data
+        assert stats.grade_stats['mean'] == round(grades.mean(), 2)
+        assert stats.grade_stats['median'] == round(float(np.median(grades)), 2)
+        assert {q['question']: q['correct_rate'] for q in stats.question_stats} == expected_correct
+
+        # Served from the stored rows until something changes
+        started = time.perf_counter()
+        assert client.get(f'/assignment/{assignment_id}/analytics').status_code == 200
+        assert time.perf_counter() - started < first
+        assert stored_stats(assignment_id).computed_at == stats.computed_at
+
+        # A grade change only invalidates the grade statistics
+        with app.app_context():
+            first_submission = db.session.query(Submission.id).order_by(Submission.id).first()[0]
+        response = client.post('/submissions/grades', json={'grades': [{'submission_id': first_submission, 'grade': 100}]})
+        assert response.status_code == 200
+        invalidated = stored_stats(assignment_id)
+        assert invalidated.grade_stats is None and invalidated.question_stats is not None
+        assert invalidated.version == stats.version + 1
+        client.get(f'/assignment/{assignment_id}/analytics')
+        regraded = stored_stats(assignment_id)
+        expected_grades = grades.copy()
+        expected_grades[0] = 100
+        assert regraded.grade_stats['mean'] == round(expected_grades.mean(), 2)
+
+    # A new submission invalidates both
+    with app.app_context():
+        username = db.session.get(User, last_student).username
+    with app.test_client() as client:
+        login(client, username)
+        response = client.post(f'/submit_html_assignment/{assignment_id}', data={
+            'content': WORKSHEET.replace('class="option" data-answer="A"', 'class="option selected" data-answer="A"')})
+        assert response.status_code == 302
+    invalidated = stored_stats(assignment_id)
+    assert invalidated.grade_stats is None and invalidated.question_stats is None
+    with app.app_context():
+        from app import assignment_statistics
+        assert assignment_statistics(assignment_id)['grades']['completion_rate'] == 1.0
+    stats = stored_stats(assignment_id)
+    assert stats.grade_stats['submitted'] == CLASS_SIZE + 1
+    assert stats.question_stats[0]['answered_rate'] == 1.0
+
+
+def test_stale_computation_is_not_stored(seeded_class):
+    assignment_id, _, _, _ = seeded_class
+    with app.app_context():
+        from app import assignment_statistics, invalidate_stats
+        import app as app_module
+        original = app_module._compute_grade_stats
+
+        def racing(assignment_id):
+            result = original(assignment_id)
+            invalidate_stats([assignment_id])  # A grade changes while computing
+            db.session.commit()
+            return result
+        app_module._compute_grade_stats = racing
+        try:
+            assert assignment_statistics(assignment_id)['grades']['submitted'] == CLASS_SIZE
+        finally:
+            app_module._compute_grade_stats = original
+        assert db.session.get(AssignmentStats, assignment_id).grade_stats is None
+
@@ -0,0 +1,86 @@
+# Test the content-hashed, cacheable worksheet endpoint used by interactive_assignment
+import gzip
+import io
+import os
+
+import pytest
+import precompressed
+from app import app, Assignment, variant_cache
+
+WORKSHEET = '<html><body><h1>練習</h1>' + '<p>閱讀理解 <input data-answer="A"></p>' * 800 + '</body></html>'
+
+
+@pytest.fixture
+def worksheet(classroom, login):
+    """(id, content hash) of a worksheet the teacher uploaded for student but not other"""
+    _, _, (student_id, _) = classroom(students=['student', 'other'], assignment=False)
+
+    with app.test_client() as client:
+        login(client, 'teacher')
+        client.post('/create_assignment', data={
+            'title': 'Reading',
+            'description': 'Read and answer',
+            'is_active': 'on',
+            'student_ids': [str(student_id)],
+            'html_file': (io.BytesIO(WORKSHEET.encode('utf-8')), 'reading.html'),
+        }, content_type='multipart/form-data')
+
+    with app.app_context():
+        assignment = Assignment.query.one()
+        return assignment.id, assignment.content_hash
+
+
+def test_upload_hashes_and_precompresses(worksheet):
+    assignment_id, content_hash = worksheet
+    assert content_hash == precompressed.content_hash(WORKSHEET)
+    for encoding in precompressed.ENCODINGS:
+        assert os.path.exists(variant_cache.path(content_hash, encoding))
+
+
+def test_interactive_page_links_instead_of_inlining(worksheet, login):
+    assignment_id, content_hash = worksheet
+    with app.test_client() as client:
+        login(client, 'student')
+        response = client.get(f'/view_assignment/{assignment_id}')
+        assert response.status_code == 200
+        assert '閱讀理解'.encode('utf-8') not in response.data
+        assert f'/assignment/{assignment_id}/content/{content_hash}.html'.encode() in response.data
+        assert len(response.data) < 30000
+
+
+def test_content_endpoint_is_immutable_and_compressed(worksheet, login):
+    assignment_id, content_hash = worksheet
+    url = f'/assignment/{assignment_id}/content/{content_hash}.html'
+    with app.test_client() as client:
+        login(client, 'student')
+
+        response = client.get(url)
+        assert response.get_data(as_text=True) == WORKSHEET
+        assert response.headers['ETag'] == f'"{content_hash}"'
+        assert 'immutable' in response.headers['Cache-Control']
+        assert 'Content-Security-Policy' not in response.headers
+
+        response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(response.data).decode('utf-8') == WORKSHEET
+
+        if precompressed.brotli:
+            response = client.get(url, headers={'Accept-Encoding': 'gzip, br'})
+            assert response.headers['Content-Encoding'] == 'br'
+            assert precompressed.brotli.decompress(response.data).decode('utf-8') == WORKSHEET
+
+        response = client.get(url, headers={'If-None-Match': f'"{content_hash}"'})
+        assert response.status_code == 304
+
+        response = client.get(f'/assignment/{assignment_id}/content/stale.html')
+        assert response.status_code == 302
+        assert response.location.endswith(url)
+
+
+def test_content_endpoint_is_authorized(worksheet, login):
+    assignment_id, content_hash = worksheet
+    with app.test_client() as client:
+        login(client, 'other')
+        response = client.get(f'/assignment/{assignment_id}/content/{content_hash}.html')
+        assert response.status_code == 403
+
@@ -0,0 +1,128 @@
+# Test answer key extraction and batch auto-grading of a whole assignment
+import glob
+import io
+import os
+import random
+import time
+
+import answer_extraction
+import autograde
+from app import app, db, User, Assignment, Submission, Answer, autograde_assignment, assignment_statistics
+
+MATH_PAPER = glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads', '*S2_Math_All_40_Questions*'))[0]
+CLASS_SIZE = 300
+
+
+def read_paper():
+    with open(MATH_PAPER, encoding='utf-8') as f:
+        return f.read()
+
+
+def answered(html, choices):
+    """The paper as submitted after clicking `choices` ({question number: letter})"""
+    for number, letter in choices.items():
+        start = html.index(f'id="q{number}"')
+        option = html.index(f'class="option" data-answer="{letter}"', start)
+        html = html[:option] + f'class="option selected" data-answer="{letter}"' + html[option + len('class="option" data-answer="X"'):]
+    return html
+
+
+def test_answer_key_from_script():
+    key = autograde.extract_answer_key(read_paper())
+    assert len(key) == 25
+    assert key['q1'] == 'C' and key['q40'] == 'B'
+
+
+def test_answer_key_from_data_attributes():
+    key = autograde.extract_answer_key('<input id="a" data-answer="42"><select name="b" data-answer="x"></select>')
+    assert key == {'a': '42', 'b': 'x'}
+    assert autograde.extract_answer_key('<html><body>No key</body></html>') == {}
+
+
+def test_score_matrix():
+    key = {'q1': 'A', 'q2': 'b', 'q3': 'x, y'}
+    rows = [(1, 'q1', 'A'), (1, 'q2', ' B '), (1, 'q3', 'y'), (1, 'q3', 'x'),
+            (2, 'q1', 'C'), (2, 'other', 'A')]
+    assert autograde.score_submissions(key, rows, [1, 2, 3]) == {1: (3, 3), 2: (0, 3), 3: (0, 3)}
+
+
+def test_grade_a_class_in_one_pass(classroom, login):
+    classroom(students=0, assignment=False)
+    with app.test_client() as client:
+        login(client, 'teacher')
+        client.post('/create_assignment', data={
+            'title': 'S2 Math', 'description': 'Paper', 'is_active': 'on',
+            'html_file': (io.BytesIO(read_paper().encode('utf-8')), 'math.html'),
+        }, content_type='multipart/form-data')
+
+    paper = read_paper()
+    rng = random.Random(7)
+    with app.app_context():
+        assignment = Assignment.query.one()
+        key = assignment.answer_key
+        assert len(key) == 25
+        numbers = [int(q[1:]) for q in key]
+        expected = {}
+        db.session.execute(User.__table__.insert(), [
+            {'username': f'student{i}', 'email': f'student{i}@example.com', 'password_hash': 'x', 'role': 'student'}
+            for i in range(CLASS_SIZE)
+        ])
+        for i, (student_id,) in enumerate(db.session.query(User.id).filter_by(role='student')):
+            choices = {n: rng.choice('ABCD') for n in numbers if rng.random() < 0.9}
+            correct = sum(key[f'q{n}'] == letter for n, letter in choices.items())
+            db.session.add(Submission(assignment_id=assignment.id, student_id=student_id,
+                                      content=answered(paper, choices), grade=50.0 if i == 0 else None,
+                                      feedback='Well done' if i == 1 else None))
+            expected[student_id] = (correct, i)
+        db.session.commit()
+        assignment_id = assignment.id
+
+    with app.test_client() as client:
+        login(client, 'teacher')
+        response = client.get(f'/view_submissions/{assignment_id}')
+        assert b'Auto-grade' in response.data
+        started = time.perf_counter()
+        response = client.post(f'/assignment/{assignment_id}/autograde')
+        elapsed = time.perf_counter() - started
+        assert response.status_code == 302
+        assert elapsed < 30, elapsed
+
+    with app.app_context():
+        submissions = {s.student_id: s for s in Submission.query}
+        for student_id, (correct, i) in expected.items():
+            submission = submissions[student_id]
+            if i == 0:
+                assert submission.grade == 50.0  # Already graded by hand
+            else:
+                assert submission.grade == round(100.0 * correct / 25, 1)
+            if i == 1:
+                assert submission.feedback == 'Well done'
+            elif i > 1:
+                assert submission.feedback == f'Auto-graded: {correct}/25 correct'
+        assert Answer.query.filter_by(element_type='choice').count() > CLASS_SIZE * 20
+
+        result = autograde_assignment(assignment_id, regrade=True)
+        assert result['graded'] == CLASS_SIZE
+        first = next(s for s in Submission.query if expected[s.student_id][1] == 0)
+        assert first.grade == round(100.0 * expected[first.student_id][0] / 25, 1)
+
+
+def test_undecodable_submission_does_not_block_grading(classroom):
+    _, assignment_id, student_ids = classroom(students=2, title='Sums', description='Add',
+                                              html_content='<input id="q1" data-answer="4">', answer_key={'q1': '4'})
+    with app.app_context():
+        # A delta against a worksheet version that no longer exists
+        broken = Submission(assignment_id=assignment_id, student_id=student_ids[0],
+                            stored_content='{"ops": []}', content_base_hash='0' * 64)
+        db.session.add_all([broken, Submission(assignment_id=assignment_id, student_id=student_ids[1],
+                                               content='<input id="q1" value="4">')])
+        db.session.commit()
+
+        result = autograde_assignment(assignment_id)
+        assert result['graded'] == 2
+        grades = {s.student_id: s.grade for s in Submission.query}
+        assert grades == {student_ids[0]: 0.0, student_ids[1]: 100.0}
+        # Marked as extracted, so later reads skip it instead of failing on it again
+        assert {s.answers_version for s in Submission.query} == {answer_extraction.EXTRACTOR_VERSION}
+        assert assignment_statistics(assignment_id)['questions'] is not None
+
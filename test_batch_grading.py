@@ -0,0 +1,121 @@
+# Test grading many submissions in one request
+import pytest
+from app import app, db, User, Assignment, Submission
+
+
+@pytest.fixture
+def submitted_class(classroom):
+    """Factory for two teachers, each with one assignment that every student has submitted"""
+    def create(students=5):
+        classroom(students=students, assignment=False)
+        with app.app_context():
+            teacher = User.query.filter_by(username='teacher').one()
+            db.session.add(User(username='other', email='other@example.com', role='teacher',
+                                password_hash=teacher.password_hash))
+            db.session.flush()
+            pupils = User.query.filter_by(role='student').order_by(User.id).all()
+            ids = {}
+            for teacher in User.query.filter_by(role='teacher').order_by(User.id):
+                assignment = Assignment(title=f'{teacher.username} worksheet', description='', created_by=teacher.id,
+                                        html_filename='a.html', html_content='<p>Q</p>')
+                db.session.add(assignment)
+                db.session.flush()
+                submissions = [Submission(assignment_id=assignment.id, student_id=p.id, content='<p>A</p>',
+                                          feedback='Keep' if i == 0 else None) for i, p in enumerate(pupils)]
+                db.session.add_all(submissions)
+                db.session.flush()
+                ids[teacher.username] = (assignment.id, [s.id for s in submissions])
+            db.session.commit()
+            return ids
+    return create
+
+
+def grades_of(submission_ids):
+    with app.app_context():
+        return {s.id: (s.grade, s.feedback) for s in Submission.query.filter(Submission.id.in_(submission_ids))}
+
+
+def test_json_batch(submitted_class, login):
+    ids = submitted_class()
+    assignment_id, mine = ids['teacher']
+    with app.test_client() as client:
+        login(client, 'teacher')
+        response = client.post('/submissions/grades', json={'grades': [
+            {'submission_id': mine[0], 'grade': 90},
+            {'submission_id': mine[1], 'grade': '75.5', 'feedback': 'Good'},
+            {'submission_id': mine[2], 'grade': 60, 'feedback': ''},
+        ]})
+        assert response.status_code == 200, response.get_json()
+        assert response.get_json() == {'graded': 3}
+    grades = grades_of(mine)
+    assert grades[mine[0]] == (90.0, 'Keep')  # No feedback given, so it is left alone
+    assert grades[mine[1]] == (75.5, 'Good')
+    assert grades[mine[2]] == (60.0, '')
+    assert grades[mine[3]] == (None, None)
+
+
+def test_invalid_batches_change_nothing(submitted_class, login):
+    ids = submitted_class()
+    _, mine = ids['teacher']
+    _, theirs = ids['other']
+    with app.test_client() as client:
+        login(client, 'teacher')
+        for grades in (
+            [{'submission_id': mine[0], 'grade': 80}, {'submission_id': theirs[0], 'grade': 80}],
+            [{'submission_id': mine[0], 'grade': 80}, {'submission_id': 99999, 'grade': 80}],
+            [{'submission_id': mine[0], 'grade': 80}, {'submission_id': mine[1], 'grade': 'A+'}],
+            [{'submission_id': mine[0], 'grade': -5}],
+        ):
+            response = client.post('/submissions/grades', json={'grades': grades})
+            assert response.status_code == 400
+            assert response.get_json()['details']
+        assert client.post('/submissions/grades', json={'grades': 'nope'}).status_code == 400
+    assert all(grade is None for grade, _ in grades_of(mine + theirs).values())
+
+    with app.test_client() as client:
+        login(client, 'student0')
+        assert client.post('/submissions/grades', json={'grades': []}).status_code == 403
+
+
+def test_form_batch_from_inline_grading(submitted_class, login):
+    ids = submitted_class()
+    assignment_id, mine = ids['teacher']
+    with app.test_client() as client:
+        login(client, 'teacher')
+        page = client.get(f'/view_submissions/{assignment_id}')
+        assert f'name="grade-{mine[0]}"'.encode() in page.data
+        response = client.post('/submissions/grades', data={
+            'assignment_id': assignment_id,
+            f'grade-{mine[0]}': '88', f'feedback-{mine[0]}': 'Nice',
+            f'grade-{mine[1]}': '', f'feedback-{mine[1]}': 'Skipped without a grade',
+        })
+        assert response.status_code == 302
+        assert f'/view_submissions/{assignment_id}' in response.headers['Location']
+    grades = grades_of(mine)
+    assert grades[mine[0]] == (88.0, 'Nice')
+    assert grades[mine[1]] == (None, None)
+
+
+def test_large_batch_is_one_statement(submitted_class, login):
+    ids = submitted_class(students=150)
+    _, mine = ids['teacher']
+    statements = []
+    from sqlalchemy import event
+    with app.app_context():
+        engine = db.engine
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('UPDATE submission'):
+            statements.append(executemany)
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        with app.test_client() as client:
+            login(client, 'teacher')
+            response = client.post('/submissions/grades', json={'grades': [
+                {'submission_id': sid, 'grade': i % 100} for i, sid in enumerate(mine)]})
+            assert response.get_json() == {'graded': 150}
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    assert statements == [True]
+    assert sorted(g for g, _ in grades_of(mine).values()) == sorted(float(i % 100) for i in range(150))
+
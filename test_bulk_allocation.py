@@ -0,0 +1,92 @@
+# Test bulk cohort allocation of assignments to students
+import io
+import time
+
+import pytest
+from sqlalchemy import event
+from app import app, db, User, Assignment, student_assignment, allocate_students
+
+COHORT_SIZE = 2000
+
+
+@pytest.fixture
+def cohort(classroom):
+    """Teacher and assignment ids, with COHORT_SIZE students the assignment is not yet allocated to"""
+    teacher_id, assignment_id, _ = classroom(students=COHORT_SIZE, allocate=False,
+                                             title='Cohort worksheet', description='For everyone')
+    return teacher_id, assignment_id
+
+
+def allocated_ids(assignment_id):
+    return {row[0] for row in db.session.query(student_assignment.c.student_id).filter(
+        student_assignment.c.assignment_id == assignment_id)}
+
+
+def test_allocate_whole_cohort_in_one_statement(cohort):
+    _, assignment_id = cohort
+    with app.app_context():
+
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        started = time.perf_counter()
+        try:
+            result = allocate_students(assignment_id)
+            db.session.commit()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        elapsed = time.perf_counter() - started
+
+        assert result['allocated'] == COHORT_SIZE
+        assert len(statements) == 1
+        assert elapsed < 1.0
+        # Re-allocating skips students who already have the assignment
+        assert allocate_students(assignment_id)['allocated'] == 0
+
+
+def test_allocate_selected_ids_rejects_invalid(cohort):
+    teacher_id, assignment_id = cohort
+    with app.app_context():
+        student_ids = [row[0] for row in db.session.query(User.id).filter_by(role='student').limit(1500)]
+
+        result = allocate_students(assignment_id, [str(i) for i in student_ids] + ['abc', str(teacher_id), '999999'])
+        db.session.commit()
+
+        assert result['allocated'] == 1500
+        assert result['invalid_ids'] == ['abc', teacher_id, 999999]
+        assert allocated_ids(assignment_id) == set(student_ids)
+
+
+def test_allocation_api(cohort, login):
+    _, assignment_id = cohort
+    with app.app_context():
+        student_ids = [row[0] for row in db.session.query(User.id).filter_by(role='student').limit(3)]
+
+    with app.test_client() as client:
+        login(client, 'teacher')
+        response = client.post(f'/api/assignments/{assignment_id}/allocate', json={})
+        assert response.status_code == 400
+
+        response = client.post(f'/api/assignments/{assignment_id}/allocate', json={'student_ids': student_ids})
+        assert response.status_code == 200
+        assert response.get_json() == {'allocated': 3, 'invalid_ids': []}
+
+        response = client.post(f'/api/assignments/{assignment_id}/allocate', json={'all_students': True})
+        assert response.get_json()['allocated'] == COHORT_SIZE - 3
+
+
+def test_create_assignment_allocates_all_students_by_default(cohort, login):
+    with app.test_client() as client:
+        login(client, 'teacher')
+        response = client.post('/create_assignment', data={
+            'title': 'New worksheet',
+            'description': 'Everyone',
+            'is_active': 'on',
+            'html_file': (io.BytesIO(b'<html><body>Q1</body></html>'), 'worksheet.html'),
+        }, content_type='multipart/form-data')
+        assert response.status_code == 302
+
+    with app.app_context():
+        assignment = Assignment.query.filter_by(title='New worksheet').one()
+        assert len(allocated_ids(assignment.id)) == COHORT_SIZE
+
@@ -0,0 +1,75 @@
+# Test transparent compression of worksheet and submission HTML at rest
+import glob
+
+import pytest
+from sqlalchemy import text
+import compressed_text
+from app import app, db, Assignment, Submission, rewrite_compressed_columns
+
+WORKSHEET = '<html><head><style>body { font-family: sans-serif; }</style></head><body>' + \
+    ''.join(f'<p>第{i}題：閱讀下列短文並回答問題。</p><input name="q{i}">' for i in range(200)) + '</body></html>'
+
+
+@pytest.fixture
+def assignment_id(classroom):
+    """WORKSHEET with one submitted answer"""
+    _, assignment_id, (student_id,) = classroom(title='Reading', description='Read')
+    with app.app_context():
+        db.session.get(Assignment, assignment_id).set_html_content(WORKSHEET)
+        db.session.add(Submission(assignment_id=assignment_id, student_id=student_id, content='<html>answer</html>'))
+        db.session.commit()
+    return assignment_id
+
+
+def stored(sql):
+    return db.session.execute(text(sql)).one()
+
+
+def test_values_are_compressed_at_rest(assignment_id):
+    with app.app_context():
+        kind, size = stored('SELECT typeof(html_content), length(html_content) FROM assignment')
+        assert kind == 'blob'
+        assert size * 5 < len(WORKSHEET.encode('utf-8'))
+        assert stored('SELECT typeof(content) FROM submission')[0] == 'blob'
+
+        db.session.expire_all()
+        assert Assignment.query.get(assignment_id).html_content == WORKSHEET
+        assert Submission.with_content().one().content == '<html>answer</html>'
+
+
+def test_plain_text_rows_are_read_and_rewritten(assignment_id):
+    with app.app_context():
+        # Rows as they were written before compression
+        db.session.execute(text('UPDATE assignment SET html_content = :html'), {'html': WORKSHEET})
+        db.session.execute(text("UPDATE submission SET content = '<html>old answer</html>'"))
+        db.session.commit()
+        db.session.expire_all()
+        assert Assignment.query.get(assignment_id).html_content == WORKSHEET
+        assert stored('SELECT typeof(html_content) FROM assignment')[0] == 'text'
+
+        assert rewrite_compressed_columns(batch_size=1) == 2
+        assert rewrite_compressed_columns() == 0
+        assert stored('SELECT typeof(html_content) FROM assignment')[0] == 'blob'
+        assert stored('SELECT typeof(content) FROM submission')[0] == 'blob'
+        db.session.expire_all()
+        assert Assignment.query.get(assignment_id).html_content == WORKSHEET
+        assert Submission.with_content().one().content == '<html>old answer</html>'
+
+
+def test_dictionary_format():
+    assert compressed_text.CURRENT_DICTIONARY >= 1
+    worksheet = open(sorted(glob.glob('uploads/*.html'))[0], encoding='utf-8').read()
+    with_dictionary = compressed_text.compress(worksheet)
+    without_dictionary = compressed_text.compress(worksheet, dictionary_id=0)
+    assert with_dictionary[:2] == bytes((compressed_text.FORMAT_DEFLATE, compressed_text.CURRENT_DICTIONARY))
+    assert len(with_dictionary) < len(without_dictionary)
+    assert compressed_text.decompress(with_dictionary) == worksheet
+    assert compressed_text.decompress(memoryview(without_dictionary)) == worksheet
+    # Text converted to bytea in place is plain UTF-8
+    assert compressed_text.decompress('練習'.encode('utf-8')) == '練習'
+    try:
+        compressed_text.decompress(bytes((compressed_text.FORMAT_DEFLATE, 250)) + b'x')
+        assert False, 'unknown dictionaries are reported'
+    except ValueError:
+        pass
+
@@ -0,0 +1,52 @@
+# Test that large TEXT columns are deferred on list queries and loaded only on opt-in
+import pytest
+import sqlalchemy as sa
+
+from app import app, db, Assignment, Submission
+
+
+@pytest.fixture
+def assignment_id(classroom):
+    """A worksheet with one submitted answer"""
+    _, assignment_id, (student_id,) = classroom(description='Read and answer', html_content='<html>worksheet</html>')
+    with app.app_context():
+        db.session.add(Submission(assignment_id=assignment_id, student_id=student_id,
+                                  content='<html>answer body</html>'))
+        db.session.commit()
+    return assignment_id
+
+
+def test_list_queries_skip_large_columns(assignment_id):
+    with app.app_context():
+        db.session.expire_all()
+
+        # What the query actually selected, not what its SQL happens to contain
+        assert 'html_content' in sa.inspect(Assignment.query.first()).unloaded
+        assert 'stored_content' in sa.inspect(Submission.query.first()).unloaded
+        db.session.expire_all()
+        assert 'html_content' not in sa.inspect(Assignment.with_content().first()).unloaded
+        assert 'stored_content' not in sa.inspect(Submission.with_content().first()).unloaded
+
+
+def test_deferred_columns_load_on_access(assignment_id):
+    with app.app_context():
+        db.session.expire_all()
+
+        assignment = Assignment.query.get(assignment_id)
+        assert 'html_content' not in assignment.__dict__
+        assert assignment.html_content == '<html>worksheet</html>'
+
+        submission = Submission.with_content().first()
+        assert submission.__dict__['stored_content'] == '<html>answer body</html>'
+
+
+def test_teacher_pages_render(assignment_id, login):
+    with app.test_client() as client:
+        login(client, 'teacher')
+        response = client.get('/student_dashboard')
+        assert response.status_code == 200
+        assert b'Worksheet' in response.data
+        response = client.get(f'/view_submissions/{assignment_id}')
+        assert response.status_code == 200
+        assert b'/submission/1/content' in response.data
+
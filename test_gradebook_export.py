@@ -0,0 +1,169 @@
+# Test the streamed CSV/XLSX gradebook exports
+import csv
+import io
+import zipfile
+from datetime import datetime
+from xml.etree import ElementTree
+
+import pytest
+from sqlalchemy import event
+
+import answer_extraction
+import gradebook
+from app import app, db, User, Assignment, Submission, Answer, student_assignment
+
+SHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+LARGE_CLASS = 20000
+
+
+def read_csv(data):
+    return list(csv.reader(io.StringIO(data.decode('utf-8-sig'))))
+
+
+def read_xlsx(data):
+    """Rows of the first sheet as lists of strings/floats, empty cells as None"""
+    with zipfile.ZipFile(io.BytesIO(data)) as workbook:
+        assert workbook.testzip() is None
+        sheet = ElementTree.fromstring(workbook.read('xl/worksheets/sheet1.xml'))
+    rows = []
+    for row in sheet.iter(SHEET_NS + 'row'):
+        cells = {}
+        for cell in row:
+            column = ''.join(ch for ch in cell.get('r') if ch.isalpha())
+            index = 0
+            for ch in column:
+                index = index * 26 + ord(ch) - 64
+            if cell.get('t') == 'inlineStr':
+                cells[index - 1] = cell.find(f'{SHEET_NS}is/{SHEET_NS}t').text
+            else:
+                cells[index - 1] = float(cell.find(SHEET_NS + 'v').text)
+        rows.append([cells.get(i) for i in range(max(cells) + 1)] if cells else [])
+    return rows
+
+
+def test_writers():
+    rows = [['=HYPERLINK("x")', 90.5, None, datetime(2025, 1, 2, 3, 4)], ['Zoë <b>&', -1, 'tab\x01', 'ok']]
+    parsed = read_csv(b''.join(gradebook.stream_csv(['A', 'B', 'C', 'D'], rows)))
+    assert parsed == [['A', 'B', 'C', 'D'], ['\'=HYPERLINK("x")', '90.5', '', '2025-01-02 03:04'],
+                      ['Zoë <b>&', '-1', 'tab\x01', 'ok']]
+    parsed = read_xlsx(b''.join(gradebook.stream_xlsx(['A', 'B', 'C', 'D'], rows, sheet_name='Term 1: [draft]')))
+    assert parsed == [['A', 'B', 'C', 'D'], ['=HYPERLINK("x")', 90.5, None, '2025-01-02 03:04'],
+                      ['Zoë <b>&', -1.0, 'tab', 'ok']]
+
+
+@pytest.fixture
+def school(classroom):
+    """Two assignments by one teacher, one by another, and three students"""
+    classroom(students=['ann', 'bob', 'cat'], assignment=False)
+    with app.app_context():
+        teacher = User.query.filter_by(username='teacher').one()
+        db.session.add(User(username='other', email='other@example.com', role='teacher',
+                            password_hash=teacher.password_hash))
+        db.session.flush()
+        users = {user.username: user for user in User.query}
+        assignments = {}
+        for title, owner, created in (('Fractions', 'teacher', datetime(2025, 9, 10)),
+                                      ('Decimals', 'teacher', datetime(2025, 10, 10)),
+                                      ('Elsewhere', 'other', datetime(2025, 9, 15))):
+            assignment = Assignment(title=title, description='', created_by=users[owner].id, html_filename='x.html',
+                                    created_at=created, answer_key={'q1': 'A', 'q2': 'B'})
+            db.session.add(assignment)
+            db.session.flush()
+            assignments[title] = assignment.id
+            for student in ('ann', 'bob', 'cat'):
+                db.session.execute(student_assignment.insert().values(
+                    student_id=users[student].id, assignment_id=assignment.id))
+        grades = {('Fractions', 'ann'): 80.0, ('Fractions', 'bob'): None, ('Decimals', 'ann'): 60.0,
+                  ('Elsewhere', 'cat'): 100.0}
+        for (title, student), grade in grades.items():
+            submission = Submission(assignment_id=assignments[title], student_id=users[student].id,
+                                    content='<p>done</p>', grade=grade, feedback='=1+1' if grade else None,
+                                    answers_version=answer_extraction.EXTRACTOR_VERSION)
+            db.session.add(submission)
+            db.session.flush()
+            if title == 'Fractions':
+                db.session.execute(Answer.__table__.insert(), [
+                    {'submission_id': submission.id, 'assignment_id': assignments[title], 'position': i,
+                     'question_key': key, 'element_type': 'checkbox', 'value': value}
+                    for i, (key, value) in enumerate([('q1', 'A'), ('q2', 'B'), ('q2', 'C'), ('extra', 'x')])
+                ])
+        db.session.commit()
+        return assignments, {name: user.id for name, user in users.items()}
+
+
+def test_assignment_export(school, login):
+    assignments, users = school
+    statements = []
+    with app.app_context():
+        engine = db.engine
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    with app.test_client() as client:
+        login(client, 'teacher')
+        response = client.get(f"/export/assignment/{assignments['Fractions']}.csv")
+        assert response.status_code == 200 and response.is_streamed
+        assert response.headers['Content-Disposition'].endswith('.csv"')
+        rows = read_csv(response.data)
+        assert rows[0] == ['Student', 'Email', 'Submitted at', 'Grade', 'Feedback']
+        assert [r[0] for r in rows[1:]] == ['ann', 'bob']
+        assert rows[1][3:] == ['80.0', "'=1+1"]
+
+        event.listen(engine, 'before_cursor_execute', listener)
+        try:
+            response = client.get(f"/export/assignment/{assignments['Fractions']}.xlsx?answers=1")
+            rows = read_xlsx(response.data)
+        finally:
+            event.remove(engine, 'before_cursor_execute', listener)
+        assert response.mimetype == gradebook.XLSX_MIMETYPE
+        assert rows[0][-2:] == ['q1', 'q2']
+        assert rows[1][0] == 'ann' and rows[1][-2:] == ['A', 'B, C']
+        assert not any('submission.content' in s for s in statements)
+
+        # Another teacher's assignment
+        response = client.get(f"/export/assignment/{assignments['Elsewhere']}.csv")
+        assert response.status_code == 302
+
+
+def test_student_and_term_exports(school, login):
+    assignments, users = school
+    with app.test_client() as client:
+        login(client, 'ann')
+        rows = read_csv(client.get(f"/export/student/{users['ann']}.csv").data)
+        assert [(r[0], r[3]) for r in rows[1:]] == [('Fractions', '80.0'), ('Elsewhere', ''), ('Decimals', '60.0')]
+        assert client.get(f"/export/student/{users['bob']}.csv").status_code == 302
+        assert client.get('/export/gradebook.csv').status_code == 302
+
+    with app.test_client() as client:
+        login(client, 'teacher')
+        rows = read_csv(client.get(f"/export/student/{users['cat']}.csv").data)
+        assert [r[0] for r in rows[1:]] == ['Fractions', 'Decimals']  # Not the other teacher's
+
+        rows = read_xlsx(client.get('/export/gradebook.xlsx').data)
+        assert rows[0] == ['Student', 'Email', 'Fractions', 'Decimals', 'Average']
+        assert rows[1] == ['ann', 'ann@example.com', 80.0, 60.0, 70.0]
+        assert rows[2] == ['bob', 'bob@example.com']
+        assert rows[3] == ['cat', 'cat@example.com']
+
+        rows = read_csv(client.get('/export/gradebook.csv?from=2025-10-01&to=2025-12-31').data)
+        assert rows[0] == ['Student', 'Email', 'Decimals', 'Average']
+        assert rows[1] == ['ann', 'ann@example.com', '60.0', '60.0']
+
+
+def test_large_export_streams(classroom, login):
+    _, assignment_id, student_ids = classroom(students=[f's{i:05d}' for i in range(LARGE_CLASS)], allocate=False,
+                                              title='Big', description='', html_filename='x.html')
+    with app.app_context():
+        db.session.execute(Submission.__table__.insert(), [
+            {'assignment_id': assignment_id, 'student_id': s, 'content': '', 'grade': float(i % 101)}
+            for i, s in enumerate(student_ids)])
+        db.session.commit()
+
+    with app.test_client() as client:
+        login(client, 'teacher')
+        response = client.get(f'/export/assignment/{assignment_id}.xlsx')
+        chunks = list(response.response)
+        assert len(chunks) > 1
+        assert max(len(chunk) for chunk in chunks) < 4 * gradebook.CHUNK_SIZE
+        rows = read_xlsx(b''.join(chunks))
+        assert len(rows) == LARGE_CLASS + 1
+        assert rows[1][0] == 's00000' and rows[-1][0] == f's{LARGE_CLASS - 1:05d}'
+
@@ -0,0 +1,210 @@
+# Test the database-backed job queue and the work queued by submissions
+import io
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from PIL import Image
+
+import app as app_module
+import storage
+from app import app, db, Submission, Answer, Job, enqueue_job, claim_job, job_handler, run_pending_jobs
+
+WORKSHEET = '<html><body><input type="text" id="q1" name="q1"></body></html>'
+SUBMITTED = '<html><body><input type="text" id="q1" name="q1" value="<b>42</b>"></body></html>'
+
+
+@pytest.fixture
+def worksheet(classroom):
+    """(assignment id, student id) of a one-question worksheet allocated to student"""
+    _, assignment_id, (student_id,) = classroom(students=['student'], title='Fractions <1>',
+                                                html_content=WORKSHEET)
+    return assignment_id, student_id
+
+
+@pytest.fixture
+def submit(login):
+    """Function that submits the answered worksheet as student"""
+    def post(assignment_id, screenshot=None):
+        data = {'content': SUBMITTED}
+        if screenshot is not None:
+            data['screenshot'] = screenshot
+        with app.test_client() as client:
+            login(client, 'student')
+            response = client.post(f'/submit_html_assignment/{assignment_id}', data=data,
+                                   content_type='multipart/form-data')
+            assert response.status_code == 302
+    return post
+
+
+def png_bytes():
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 30), 'red').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def uploads():
+    """Names of the stored files, wherever they are sharded"""
+    return sorted(name for _, _, files in os.walk(app.config['UPLOAD_FOLDER']) for name in files)
+
+
+def stored_path(key):
+    return storage.LocalStorage(app.config['UPLOAD_FOLDER']).path(key)
+
+
+def test_submit_queues_follow_up_work(worksheet, submit):
+    assignment_id, student_id = worksheet
+    submit(assignment_id, screenshot=(io.BytesIO(png_bytes()), 'page.png'))
+
+    with app.app_context():
+        # The request only committed the submission and its jobs
+        submission = Submission.query.one()
+        assert submission.answers_version is None
+        assert Answer.query.count() == 0
+        assert sorted(job.kind for job in Job.query) == ['archive_submission', 'extract_answers', 'process_screenshot']
+        assert uploads() == [submission.screenshot_filename]
+
+        # Replacing the screenshot queues the archive again, to link the new file,
+        # and the replaced PNG and first archive are then deleted
+        assert run_pending_jobs() == 6
+        assert {job.status for job in Job.query} == {'done'}
+        assert [a.value for a in Answer.query] == ['<b>42</b>']
+        submission = Submission.query.one()
+        assert submission.screenshot_filename.endswith('.webp')
+
+        archive = submission.archive_filename
+        assert storage.is_content_key(archive) and archive.endswith('.html')
+        assert archive in uploads()
+        with open(stored_path(archive), encoding='utf-8') as f:
+            html = f.read()
+        # The submitted document and title are escaped, not injected into the archive
+        assert 'Fractions &lt;1&gt;' in html
+        assert 'value=&#34;&lt;b&gt;42&lt;/b&gt;&#34;' in html
+        assert f'/uploads/{submission.screenshot_filename}' in html
+
+        # Running a job again is harmless
+        db.session.execute(db.update(Job).values(status='pending'))
+        db.session.commit()
+        assert run_pending_jobs() == 6
+        assert Answer.query.count() == 1
+        assert uploads() == sorted([archive, submission.screenshot_filename])
+
+
+def test_failed_jobs_are_retried_with_backoff(database):
+    calls = []
+
+    @job_handler('test_flaky')
+    def flaky(fail_times):
+        calls.append(1)
+        if len(calls) <= fail_times:
+            raise RuntimeError('temporarily unavailable')
+
+    with app.app_context():
+        retried = enqueue_job('test_flaky', {'fail_times': 1})
+        doomed = enqueue_job('test_flaky', {'fail_times': 100}, max_attempts=2)
+        db.session.commit()
+        retried, doomed = retried.id, doomed.id
+
+        assert run_pending_jobs() == 2
+        job = db.session.get(Job, retried)
+        assert job.status == 'pending' and job.attempts == 1 and 'temporarily' in job.error
+        assert job.run_at > datetime.utcnow() + timedelta(seconds=20)
+        # Not due yet, so nothing runs
+        assert run_pending_jobs() == 0
+
+        db.session.execute(db.update(Job).values(run_at=datetime.utcnow()))
+        db.session.commit()
+        assert run_pending_jobs() == 2
+        db.session.expire_all()
+        assert db.session.get(Job, retried).status == 'done'
+        job = db.session.get(Job, doomed)
+        assert job.status == 'failed' and job.attempts == 2 and job.finished_at is not None
+        # The second delay doubles the first
+        assert app_module.job_retry_delay(2) == 2 * app_module.job_retry_delay(1)
+
+
+def test_stale_running_job_is_reclaimed(database):
+    with app.app_context():
+        job = enqueue_job('test_flaky', {'fail_times': 0})
+        db.session.commit()
+        job_id = job.id
+
+        assert claim_job('crashed-worker') == job_id
+        # Claimed jobs are not handed out twice...
+        assert claim_job('other-worker') is None
+        # ...until their worker has been silent for too long
+        db.session.execute(db.update(Job).values(
+            updated_at=datetime.utcnow() - timedelta(seconds=app_module.JOB_STALE_SECONDS + 1)))
+        db.session.commit()
+        assert claim_job('other-worker') == job_id
+        db.session.expire_all()
+        job = db.session.get(Job, job_id)
+        assert job.locked_by == 'other-worker' and job.attempts == 2
+
+        # A job that keeps killing its worker is given up after max_attempts
+        doomed = enqueue_job('test_flaky', {'fail_times': 0}, max_attempts=1)
+        db.session.commit()
+        doomed_id = doomed.id
+        db.session.execute(db.update(Job).values(status='running', attempts=1, run_at=datetime.utcnow(),
+            updated_at=datetime.utcnow() - timedelta(seconds=app_module.JOB_STALE_SECONDS + 1)))
+        db.session.commit()
+        assert claim_job('third-worker') == job_id
+        assert claim_job('third-worker') is None
+        assert app_module.fail_abandoned_jobs() == 1
+        db.session.expire_all()
+        job = db.session.get(Job, doomed_id)
+        assert job.status == 'failed' and job.finished_at is not None and job.locked_by is None
+
+
+def test_background_worker_drains_queue(worksheet, submit, monkeypatch):
+    assignment_id, _ = worksheet
+    monkeypatch.setitem(app.config, 'JOBS_IN_BACKGROUND', True)
+    submit(assignment_id)
+    worker = app_module._job_worker
+    assert worker is not None
+    # The thread exits once nothing is pending
+    worker.join(timeout=30)
+    assert not worker.is_alive() and app_module._job_worker is None
+
+    with app.app_context():
+        assert {job.status for job in Job.query} == {'done'}
+        assert Answer.query.count() == 1
+
+
+def test_webhook_fan_out(worksheet, submit):
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            received.append((self.path, json.loads(self.rfile.read(int(self.headers['Content-Length'])))))
+            self.send_response(200 if self.path == '/ok' else 503)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    try:
+        assignment_id, student_id = worksheet
+        app.config['NOTIFY_WEBHOOK_URLS'] = [base + '/ok', base + '/down']
+
+        submit(assignment_id)
+
+        with app.app_context():
+            run_pending_jobs()
+            assert sorted(path for path, _ in received) == ['/down', '/ok']
+            body = received[0][1]
+            assert body['event'] == 'submission.created' and body['student_id'] == student_id
+            deliveries = {job.payload['url']: job for job in Job.query.filter_by(kind='deliver_webhook')}
+            # Only the failing endpoint is retried
+            assert deliveries[base + '/ok'].status == 'done'
+            assert deliveries[base + '/down'].status == 'pending'
+            assert '503' in deliveries[base + '/down'].error
+    finally:
+        server.shutdown()
+
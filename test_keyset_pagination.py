@@ -0,0 +1,80 @@
+# Test keyset pagination of submissions, users and the teacher dashboard
+import re
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import app, db, User, Submission, keyset_paginate, PAGE_SIZE_MAX
+
+
+@pytest.fixture
+def submitted(classroom):
+    """Factory for an assignment with one submission per student; returns its id"""
+    def create(count=120):
+        assignment_id = classroom(students=count, admin=True).assignment_id
+        with app.app_context():
+            # Several submissions share a timestamp so the id tie-breaker matters
+            base = datetime(2024, 1, 1, 8, 0, 0)
+            students = db.session.query(User.id).filter(User.role == 'student').order_by(User.id)
+            for i, (student_id,) in enumerate(students):
+                db.session.add(Submission(assignment_id=assignment_id, student_id=student_id,
+                                          content=f'<html>answer {i}</html>',
+                                          submitted_at=base + timedelta(minutes=i // 4)))
+            db.session.commit()
+        return assignment_id
+    return create
+
+
+def test_pages_cover_every_row_once_in_order(submitted):
+    assignment_id = submitted()
+    with app.app_context():
+        query = Submission.query.filter(Submission.assignment_id == assignment_id)
+        columns = [Submission.submitted_at, Submission.id]
+
+        seen, cursor, pages = [], None, 0
+        while True:
+            page = keyset_paginate(query, columns, cursor, page_size=50)
+            seen.extend(page.items)
+            pages += 1
+            if not page.next_cursor:
+                break
+            cursor = page.next_cursor
+
+        assert pages == 3
+        assert len({s.id for s in seen}) == 120
+        keys = [(s.submitted_at, s.id) for s in seen]
+        assert keys == sorted(keys, reverse=True)
+
+
+def test_malformed_cursor_falls_back_to_first_page(submitted):
+    submitted(10)
+    with app.app_context():
+        page = keyset_paginate(User.query, [User.id], 'not-a-cursor', page_size=5, descending=False)
+        assert [u.id for u in page.items] == [1, 2, 3, 4, 5]
+        assert page.cursor is None
+
+
+def test_paginated_routes(submitted, login):
+    assignment_id = submitted()
+
+    with app.test_client() as client:
+        login(client, 'admin')
+
+        response = client.get(f'/view_submissions/{assignment_id}?per_page=50')
+        assert response.status_code == 200
+        assert response.data.count(b'class="grade-btn"') == 50
+        # Styled from the stylesheet, not an inline block
+        assert b'/assets/css/pagination.' in response.data and b'.page-link {' not in response.data
+        next_link = re.search(rb'href="([^"]*cursor=[^"]*)"', response.data).group(1).decode().replace('&amp;', '&')
+        response = client.get(next_link)
+        assert response.data.count(b'class="grade-btn"') == 50
+
+        response = client.get('/admin/users?per_page=0')
+        assert response.data.count(b'class="edit-btn"') == 1
+        response = client.get('/admin/users?per_page=100000')
+        assert response.data.count(b'class="edit-btn"') == min(PAGE_SIZE_MAX, 122)
+
+        response = client.get('/student_dashboard?per_page=1')
+        assert response.status_code == 200
+        assert b'Worksheet' in response.data
+
@@ -0,0 +1,186 @@
+# Test the page cache: version-keyed dashboards and shells, CSRF tokens and flashes
+import io
+import os
+import re
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+
+import page_cache
+from app import (app, db, Assignment, Submission, bump_cache_versions, get_cache_versions,
+                 seconds_until_overdue, DashboardRow)
+
+WORKSHEET = '<html><body><input name="q1"></body></html>'
+
+
+@pytest.fixture
+def users(classroom):
+    """A teacher and one student, with no assignments yet"""
+    classroom(students=['student'], assignment=False)
+
+
+@pytest.fixture
+def login(login):
+    """Logs in and shows the "Login successful!" flash, so the next page can be cached"""
+    def log_in(client, username):
+        login(client, username)
+        client.get('/student_dashboard')
+    return log_in
+
+
+def create_assignment(client, title):
+    response = client.post('/create_assignment', data={
+        'title': title, 'description': 'Answer', 'is_active': 'on',
+        'html_file': (io.BytesIO(WORKSHEET.encode('utf-8')), 'worksheet.html'),
+    }, content_type='multipart/form-data')
+    assert response.status_code == 302
+    with app.app_context():
+        return Assignment.query.filter_by(title=title).one().id
+
+
+def rename_behind_the_cache(assignment_id, title):
+    """Change a title without bumping any counter, so only a cached page still shows the old one"""
+    with app.app_context():
+        Assignment.query.get(assignment_id).title = title
+        db.session.commit()
+
+
+def page(client, url):
+    return client.get(url).get_data(as_text=True)
+
+
+def test_student_pages_follow_submissions_and_grades(users, login):
+    teacher, student = app.test_client(), app.test_client()
+    login(teacher, 'teacher')
+    assignment_id = create_assignment(teacher, 'Fractions')
+    login(student, 'student')
+    assert 'Fractions' in page(student, '/student_dashboard')
+    assert 'Fractions' in page(student, f'/view_assignment/{assignment_id}')
+
+    rename_behind_the_cache(assignment_id, 'Decimals')
+    assert 'Fractions' in page(student, '/student_dashboard')
+    assert 'Fractions' in page(student, f'/view_assignment/{assignment_id}')
+
+    response = student.post(f'/submit_html_assignment/{assignment_id}', data={'content': WORKSHEET})
+    assert response.status_code == 302
+    page(student, '/student_dashboard')  # Shows the flashed confirmation, uncached
+    dashboard = page(student, '/student_dashboard')
+    assert 'Decimals' in dashboard and 'Pending Grading' in dashboard
+    shell = page(student, f'/view_assignment/{assignment_id}')
+    assert 'Decimals' in shell and 'submissionForm' not in shell
+
+    with app.app_context():
+        submission_id = Submission.query.one().id
+    teacher.post(f'/grade_submission/{submission_id}', data={'grade': '87', 'feedback': 'Well done'})
+    assert 'Grade: 87.0' in page(student, '/student_dashboard')
+    assert 'Well done' in page(student, f'/view_assignment/{assignment_id}')
+
+
+def test_dashboards_follow_new_and_deleted_assignments(users, login):
+    teacher, student = app.test_client(), app.test_client()
+    login(teacher, 'teacher')
+    login(student, 'student')
+    first = create_assignment(teacher, 'Fractions')
+    page(teacher, '/student_dashboard')
+    assert 'Fractions' in page(teacher, '/student_dashboard')
+    assert 'Fractions' in page(student, '/student_dashboard')
+
+    second = create_assignment(teacher, 'Decimals')
+    page(teacher, '/student_dashboard')
+    assert 'Decimals' in page(teacher, '/student_dashboard')
+    assert 'Decimals' in page(student, '/student_dashboard')
+
+    teacher.post(f'/assignment/{first}/delete')
+    page(teacher, '/student_dashboard')
+    assert 'Fractions' not in page(teacher, '/student_dashboard')
+    dashboard = page(student, '/student_dashboard')
+    assert 'Fractions' not in dashboard and 'Decimals' in dashboard
+    assert f'/view_assignment/{second}' in dashboard
+
+
+def test_csrf_tokens_are_filled_in_per_session(users):
+    tokens = []
+    app.config['WTF_CSRF_ENABLED'] = True
+    try:
+        for _ in range(2):
+            with app.test_client() as client:
+                login_page = page(client, '/login')
+                assert page_cache.CSRF_PLACEHOLDER not in login_page
+                token = re.search(r'name="csrf_token" value="([^"]+)"', login_page).group(1)
+                tokens.append(token)
+                # The token in the cached page is accepted for this session
+                response = client.post('/login', data={
+                    'username': 'teacher', 'password': 'password123', 'csrf_token': token})
+                assert response.status_code == 302
+    finally:
+        app.config['WTF_CSRF_ENABLED'] = False
+    assert tokens[0] != tokens[1]
+
+
+def test_flashed_messages_are_never_cached(users, login):
+    with app.test_client() as client:
+        page(client, '/login')
+        login(client, 'teacher')
+        client.get('/logout')
+        assert 'You have been logged out.' in page(client, '/login')
+        assert 'You have been logged out.' not in page(client, '/login')
+
+
+def test_counters(database):
+    with app.app_context():
+        assert get_cache_versions(('assignment', 1), ('student', 2)) == [0, 0]
+        bump_cache_versions(assignments=[1], listing=True)
+        db.session.commit()
+        first, student, listing = get_cache_versions(('assignment', 1), ('student', 2), ('listing', 0))
+        assert first > 0 and student == 0 and listing > 0
+        bump_cache_versions(assignments=[1, 1], students=[2])
+        db.session.commit()
+        assignment, student, unchanged = get_cache_versions(('assignment', 1), ('student', 2), ('listing', 0))
+        assert assignment == first + 1 and student > 0 and unchanged == listing
+
+
+def test_entries_expire():
+    now = [1000.0]
+    shared = page_cache.DirectoryBackend(tempfile.mkdtemp())
+    cache = page_cache.PageCache(ttl=300, backend=shared, clock=lambda: now[0])
+    renders = []
+
+    def render(text, max_age=None):
+        def run():
+            renders.append(text)
+            return text, max_age
+        return run
+
+    assert cache.get(['a'], render('one')) == 'one'
+    assert cache.get(['a'], render('two')) == 'one'
+    # Another worker finds the page in the shared directory
+    other = page_cache.PageCache(ttl=300, backend=shared, clock=lambda: now[0])
+    assert other.get(['a'], render('three')) == 'one'
+    now[0] += 301
+    assert cache.get(['a'], render('four')) == 'four'
+
+    # A shorter max_age, e.g. until an assignment turns overdue
+    assert cache.get(['b'], render('five', max_age=10)) == 'five'
+    now[0] += 11
+    assert cache.get(['b'], render('six')) == 'six'
+    assert renders == ['one', 'four', 'five', 'six']
+
+    now[0] += 1000
+    assert shared.prune(now[0]) == 2 and not os.listdir(os.path.join(shared.directory, page_cache.cache_key(['a'])[:2]))
+
+    disabled = page_cache.PageCache(ttl=0)
+    assert disabled.get(['c'], render('seven')) == 'seven' and disabled.get(['c'], render('eight')) == 'eight'
+
+
+def test_dashboard_expires_when_an_assignment_turns_overdue():
+    now = datetime(2026, 3, 2, 9, 0)
+
+    def row(due_date, due_state):
+        return DashboardRow(1, 'Title', '', True, now, due_date, None, None, None, due_state)
+
+    assert seconds_until_overdue([], now) is None
+    assert seconds_until_overdue([row(None, 'none'), row(now - timedelta(hours=1), 'overdue')], now) is None
+    assert seconds_until_overdue([row(now + timedelta(hours=2), 'open'),
+                                  row(now + timedelta(minutes=5), 'open')], now) == 300
+
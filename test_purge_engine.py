@@ -0,0 +1,148 @@
+# Test soft-delete and the background purge of assignments and users
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as app_module
+from app import (app, db, Submission, Assignment, User, PurgeTask, Job, student_assignment,
+                 schedule_purge, claim_job, run_purge_task, run_pending_jobs, assignment_statistics)
+
+
+def touch(filename):
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], filename), 'w') as f:
+        f.write('x')
+
+
+@pytest.fixture
+def school(classroom, monkeypatch):
+    """Five submissions to a teacher's assignment, each with its old flat-named files"""
+    monkeypatch.setattr(app_module, 'PURGE_BATCH_SIZE', 2)
+    teacher_id, assignment_id, student_ids = classroom(
+        students=5, admin=True, html_filename='assignment_1_20240101000000.html')
+    touch('assignment_1_20240101000000.html')
+    with app.app_context():
+        for student_id in student_ids:
+            screenshot = f'screenshot_{assignment_id}_{student_id}_20240101000000.png'
+            touch(screenshot)
+            touch(f'html_submission_{assignment_id}_{student_id}_20240101000000.html')
+            db.session.add(Submission(assignment_id=assignment_id, student_id=student_id,
+                                      content='<html>answer</html>', screenshot_filename=screenshot))
+        db.session.commit()
+    return teacher_id, assignment_id, student_ids
+
+
+def test_delete_assignment_soft_deletes_then_purges(school, login):
+    _, assignment_id, _ = school
+
+    with app.test_client() as client:
+        login(client, 'teacher')
+        response = client.post(f'/assignment/{assignment_id}/delete')
+        assert response.status_code == 302
+
+    with app.app_context():
+        assignment = Assignment.query.get(assignment_id)
+        assert assignment.deleted_at is not None and not assignment.is_active
+        assert Submission.query.count() == 5
+        task = PurgeTask.query.one()
+        assert task.status == 'pending'
+        assert Job.query.one().payload == {'task_id': task.id}
+
+        run_purge_task(task.id)
+        task = PurgeTask.query.one()
+        assert task.status == 'done'
+        assert task.submissions_deleted == 5
+        assert task.allocations_deleted == 5
+        assert task.files_deleted == 11
+        assert Assignment.query.get(assignment_id) is None
+        assert Submission.query.count() == 0
+        assert db.session.query(student_assignment).count() == 0
+        # Files go once the purge has committed
+        assert len(os.listdir(app.config['UPLOAD_FOLDER'])) == 11
+        run_pending_jobs()
+        assert os.listdir(app.config['UPLOAD_FOLDER']) == []
+
+
+def test_interrupted_purge_is_resumed(school):
+    teacher_id, assignment_id, _ = school
+    with app.app_context():
+        stale = schedule_purge('assignment', assignment_id)
+        live = schedule_purge('user', teacher_id)
+        db.session.commit()
+        stale_job, live_job = [job.id for job in Job.query.order_by(Job.id)]
+        assert claim_job('crashed-worker') == stale_job
+        assert claim_job('live-worker') == live_job
+
+        # The first worker crashed after the first batch: progress recorded, claim stale
+        for submission in Submission.query.order_by(Submission.id).limit(2).all():
+            db.session.delete(submission)
+        stale.status, stale.phase, stale.submissions_deleted = 'running', 'submissions', 2
+        db.session.execute(db.update(Job).where(Job.id == stale_job).values(
+            updated_at=datetime.utcnow() - timedelta(hours=1)))
+        db.session.commit()
+
+        assert run_pending_jobs() >= 1
+        stale = PurgeTask.query.get(stale.id)
+        assert stale.status == 'done'
+        assert stale.submissions_deleted == 5
+        assert Assignment.query.get(assignment_id) is None
+        # A job with a fresh claim belongs to the other worker
+        assert PurgeTask.query.get(live.id).status == 'pending'
+        assert db.session.get(Job, live_job).status == 'running'
+
+
+def test_admin_delete_user_purges_dependents(school, login):
+    teacher_id, assignment_id, _ = school
+
+    with app.test_client() as client:
+        login(client, 'admin')
+        client.post(f'/admin/user/{teacher_id}/delete')
+
+    with app.app_context():
+        task = PurgeTask.query.one()
+        task_id = task.id
+        assert task.target_type == 'user'
+        assert User.query.get(teacher_id).deleted_at is not None
+
+    with app.test_client() as client:
+        login(client, 'teacher')
+        response = client.get('/student_dashboard')
+        assert response.status_code == 302
+
+        login(client, 'admin')
+        response = client.get(f'/admin/purge/{task_id}')
+        assert response.get_json()['status'] == 'pending'
+
+    with app.app_context():
+        run_pending_jobs()
+        assert User.query.get(teacher_id) is None
+        assert Assignment.query.get(assignment_id) is None
+        assert Submission.query.count() == 0
+        assert PurgeTask.query.get(task_id).status == 'done'
+
+
+def test_deleted_students_are_hidden_before_the_purge(school, login):
+    _, assignment_id, student_ids = school
+    with app.app_context():
+        for grade, submission in zip([50, 60, 70, 80, 90], Submission.query.order_by(Submission.student_id)):
+            submission.grade = grade
+        db.session.commit()
+        assert assignment_statistics(assignment_id)['grades']['submitted'] == 5
+
+    with app.test_client() as client:
+        login(client, 'admin')
+        client.post(f'/admin/user/{student_ids[0]}/delete')
+        login(client, 'teacher')
+        page = client.get(f'/view_submissions/{assignment_id}').get_data(as_text=True)
+        assert 'student0' not in page and 'student1' in page
+        assert 'student0' not in client.get(f'/export/assignment/{assignment_id}.csv?answers=1').get_data(as_text=True)
+        gradebook = client.get('/export/gradebook.csv').get_data(as_text=True)
+        assert 'student0' not in gradebook and 'student4' in gradebook
+        assert client.get(f'/assignment/{assignment_id}/analytics').status_code == 200
+
+    with app.app_context():
+        grades = assignment_statistics(assignment_id)['grades']
+        assert grades['submitted'] == 4 and grades['allocated'] == 4
+        # Not purged yet
+        assert Submission.query.count() == 5
+
@@ -0,0 +1,136 @@
+# Test the response compression middleware and its cache of immutable variants
+import gzip
+import io
+import os
+import zlib
+
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+import precompressed
+import response_compression
+from app import app, Assignment, variant_cache
+
+WORKSHEET = '<html><body>' + ''.join(f'<p>Question {i}: <input name="q{i}"></p>' for i in range(100)) + '</body></html>'
+
+
+def decode(response):
+    encoding = response.headers.get('Content-Encoding')
+    if encoding == 'br':
+        return precompressed.brotli.decompress(response.data)
+    if encoding == 'gzip':
+        return gzip.decompress(response.data)
+    return response.data
+
+
+def cached_variants():
+    return sorted(name for _, _, files in os.walk(variant_cache.directory) for name in files)
+
+
+def test_streamed_responses_stay_streamed():
+    produced = []
+
+    def rows():
+        for i in range(50):
+            produced.append(i)
+            yield f'{i},student{i},{i * 2}\n'.encode()
+
+    def wsgi(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/csv')])
+        return rows()
+
+    client = Client(response_compression.CompressionMiddleware(wsgi))
+    response = client.get('/', headers={'Accept-Encoding': 'gzip'}, buffered=False)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    body = iter(response.response)
+    # Each chunk is flushed as it is produced, so it can be decoded before the next exists
+    decompressor = zlib.decompressobj(31)
+    first = b''
+    while not first:
+        first = decompressor.decompress(next(body))
+    assert first == b'0,student0,0\n' and produced == [0]
+    rest = decompressor.decompress(b''.join(body)) + decompressor.flush()
+    assert (first + rest).decode().count('\n') == 50
+
+
+def test_etags_are_per_encoding():
+    def wsgi(environ, start_response):
+        response = Response(WORKSHEET, mimetype='text/html')
+        response.set_etag('abc')
+        return response.make_conditional(environ)(environ, start_response)
+
+    client = Client(response_compression.CompressionMiddleware(wsgi))
+    response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['ETag'] == '"abc-gzip"'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert 'Accept-Ranges' not in response.headers
+    response = client.get('/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': '"abc-gzip"'})
+    assert response.status_code == 304 and response.headers['ETag'] == '"abc-gzip"'
+    # Identity keeps the application's ETag
+    response = client.get('/')
+    assert response.headers['ETag'] == '"abc"' and response.data == WORKSHEET.encode()
+
+
+def test_pages_are_compressed(database):
+    with app.test_client() as client:
+        identity = client.get('/login')
+        assert 'Content-Encoding' not in identity.headers
+        for encoding in precompressed.ENCODINGS:
+            response = client.get('/login', headers={'Accept-Encoding': encoding})
+            assert response.headers['Content-Encoding'] == encoding
+            assert 'Accept-Encoding' in response.headers['Vary']
+            assert len(response.data) < len(identity.data)
+            assert decode(response) == identity.data
+
+
+def test_immutable_uploads_are_compressed_once(classroom, login):
+    classroom(students=0, assignment=False)
+    with app.test_client() as client:
+        login(client, 'teacher')
+        client.post('/create_assignment', data={
+            'title': 'Long', 'description': 'Answer', 'is_active': 'on',
+            'html_file': (io.BytesIO(WORKSHEET.encode('utf-8')), 'long.html'),
+        }, content_type='multipart/form-data')
+        with app.app_context():
+            key = Assignment.query.one().html_filename
+        variants = cached_variants()
+
+        response = client.get(f'/uploads/{key}', headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert int(response.headers['Content-Length']) == len(response.data)
+        assert decode(response) == WORKSHEET.encode('utf-8')
+        added = sorted(set(cached_variants()) - set(variants))
+        assert len(added) == 1 and added[0].endswith('.gz')
+
+        # Served from the cache afterwards
+        path = os.path.join(variant_cache.directory, added[0][:2], added[0])
+        with open(path, 'wb') as f:
+            f.write(gzip.compress(b'from the cache'))
+        response = client.get(f'/uploads/{key}', headers={'Accept-Encoding': 'gzip'})
+        assert decode(response) == b'from the cache'
+
+        etag = response.headers['ETag']
+        assert etag.endswith('-gzip"')
+        response = client.get(f'/uploads/{key}', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        assert response.status_code == 304
+
+        # Ranges are of the uncompressed file
+        response = client.get(f'/uploads/{key}', headers={'Accept-Encoding': 'gzip', 'Range': 'bytes=0-5'})
+        assert response.status_code == 206 and 'Content-Encoding' not in response.headers
+        assert response.data == WORKSHEET.encode('utf-8')[:6]
+
+
+def test_images_and_small_bodies_pass_through():
+    def wsgi(environ, start_response):
+        body = b'\x89PNG\r\n\x1a\n' + b'\x00' * 4096 if environ['PATH_INFO'] == '/image' else b'{"ok": true}'
+        start_response('200 OK', [('Content-Type', 'image/png' if environ['PATH_INFO'] == '/image' else
+                                   'application/json'), ('Content-Length', str(len(body)))])
+        return [body]
+
+    client = Client(response_compression.CompressionMiddleware(wsgi))
+    response = client.get('/image', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers and 'Vary' not in response.headers
+    response = client.get('/small', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers and response.headers['Vary'] == 'Accept-Encoding'
+
@@ -0,0 +1,102 @@
+# Test the versioned schema migrations on a legacy SQLite database
+import os
+import tempfile
+
+from sqlalchemy import create_engine, inspect, text
+import migrations
+from app import app, db, init_database
+
+LEGACY_SCHEMA = [
+    'CREATE TABLE user (id INTEGER PRIMARY KEY, username VARCHAR(100) UNIQUE NOT NULL, '
+    'email VARCHAR(100) UNIQUE NOT NULL, password_hash VARCHAR(200) NOT NULL, '
+    'role VARCHAR(50) NOT NULL, created_at DATETIME)',
+    'CREATE TABLE assignment (id INTEGER PRIMARY KEY, title VARCHAR(200) NOT NULL, '
+    'description TEXT NOT NULL, created_at DATETIME, due_date DATETIME, is_active BOOLEAN)',
+    'CREATE TABLE submission (id INTEGER PRIMARY KEY, assignment_id INTEGER NOT NULL, '
+    'student_id INTEGER NOT NULL, content TEXT NOT NULL, submitted_at DATETIME, '
+    'grade FLOAT, feedback TEXT)',
+    'CREATE TABLE student_assignment (student_id INTEGER NOT NULL, assignment_id INTEGER NOT NULL, '
+    'assigned_at DATETIME, PRIMARY KEY (student_id, assignment_id))',
+]
+
+EXPECTED_INDEXES = {
+    'submission': {'ix_submission_assignment_student', 'ix_submission_student'},
+    'student_assignment': {'ix_student_assignment_student'},
+    'assignment': {'ix_assignment_active_creator'},
+}
+
+
+def index_names(engine, table):
+    return {ix['name'] for ix in inspect(engine).get_indexes(table)}
+
+
+def test_upgrade_legacy_database():
+    engine = create_engine('sqlite:///' + os.path.join(tempfile.mkdtemp(), 'legacy.db'))
+    with engine.begin() as conn:
+        for statement in LEGACY_SCHEMA:
+            conn.execute(text(statement))
+
+    assert migrations.get_schema_version(engine) is None
+    applied = migrations.upgrade(engine)
+    assert applied == [m.version for m in migrations.MIGRATIONS]
+    assert migrations.get_schema_version(engine) == migrations.latest_version()
+
+    columns = {c['name'] for c in inspect(engine).get_columns('submission')}
+    assert 'screenshot_filename' in columns
+    for table, expected in EXPECTED_INDEXES.items():
+        assert expected <= index_names(engine, table)
+
+    # Running again is a no-op
+    assert migrations.upgrade(engine) == []
+
+
+def test_fresh_database_is_stamped_and_indexed(database):
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+        with db.engine.begin() as conn:
+            conn.execute(text(f'DROP TABLE IF EXISTS {migrations.SCHEMA_VERSION_TABLE}'))
+
+        assert init_database()
+        assert migrations.get_schema_version(db.engine) == migrations.latest_version()
+        for table, expected in EXPECTED_INDEXES.items():
+            assert expected <= index_names(db.engine, table)
+
+        # A second boot goes through the fast path
+        assert init_database()
+
+
+def test_db_upgrade_command_applies_pending_migrations(database):
+    runner = app.test_cli_runner()
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+        with db.engine.begin() as conn:
+            conn.execute(text(f'DROP TABLE IF EXISTS {migrations.SCHEMA_VERSION_TABLE}'))
+
+    # An empty database is created and stamped
+    result = runner.invoke(args=['db-upgrade'])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert migrations.get_schema_version(db.engine) == migrations.latest_version()
+
+        # A database deployed before the page cache, with a purge left by the old purge worker
+        latest = migrations.latest_version()
+        with db.engine.begin() as conn:
+            conn.execute(text('DROP TABLE cache_version'))
+            conn.execute(text(f'DELETE FROM {migrations.SCHEMA_VERSION_TABLE} WHERE version >= 13'))
+            conn.execute(text("INSERT INTO purge_task (target_type, target_id, status, submissions_deleted, "
+                              "allocations_deleted, files_deleted) VALUES ('assignment', 1, 'running', 0, 0, 0)"))
+
+    result = runner.invoke(args=['db-upgrade'])
+    assert result.exit_code == 0, result.output
+    assert f'Applied migrations: {list(range(13, latest + 1))}' in result.output
+    with app.app_context():
+        assert migrations.get_schema_version(db.engine) == latest
+        assert 'cache_version' in inspect(db.engine).get_table_names()
+        with db.engine.connect() as conn:
+            assert conn.execute(text("SELECT kind, status FROM job")).fetchall() == [('purge', 'pending')]
+
+    result = runner.invoke(args=['db-upgrade'])
+    assert 'Applied migrations: none' in result.output
+
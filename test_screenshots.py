@@ -0,0 +1,227 @@
+# Test screenshot uploads, WebP re-encoding and lazily generated thumbnails
+import io
+import os
+
+import pytest
+from PIL import Image
+
+import screenshots
+import storage
+from app import app, Submission, run_pending_jobs
+
+WORKSHEET = '<html><body><input type="text" id="q1" name="q1"></body></html>'
+
+
+@pytest.fixture
+def assignment_id(classroom):
+    """A one-question worksheet allocated to student0 and student1"""
+    return classroom(students=2, html_content=WORKSHEET).assignment_id
+
+
+def image_bytes(size, fmt='PNG'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'blue').save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def submit(client, assignment_id, screenshot=None):
+    data = {'content': WORKSHEET}
+    if screenshot is not None:
+        data['screenshot'] = (io.BytesIO(screenshot), 'screenshot.png')
+    response = client.post(f'/submit_html_assignment/{assignment_id}', data=data,
+                           content_type='multipart/form-data')
+    assert response.status_code == 302
+
+
+def uploads():
+    """Names of the stored files, wherever they are sharded"""
+    return sorted(name for _, _, files in os.walk(app.config['UPLOAD_FOLDER']) for name in files)
+
+
+def stored_path(key):
+    return storage.LocalStorage(app.config['UPLOAD_FOLDER']).path(key)
+
+
+def test_screenshot_is_reencoded_to_bounded_webp(assignment_id, login):
+    with app.test_client() as client:
+        login(client, 'student0')
+        submit(client, assignment_id, image_bytes((4000, 1000)))
+
+    with app.app_context():
+        original = Submission.query.one().screenshot_filename
+        assert storage.is_content_key(original) and original.endswith('.png')
+        run_pending_jobs()
+        processed = Submission.query.one().screenshot_filename
+        assert storage.is_content_key(processed) and processed.endswith('.webp')
+        # The original is replaced, not kept next to the WebP
+        assert original not in uploads() and processed in uploads()
+        with Image.open(stored_path(processed)) as image:
+            assert image.format == 'WEBP'
+            assert image.size == (screenshots.MAX_DIMENSION, screenshots.MAX_DIMENSION // 4)
+
+
+def test_uploads_that_are_not_kept(assignment_id, login):
+    app.config['SCREENSHOT_MAX_BYTES'] = 1000
+    try:
+        with app.test_client() as client:
+            # Too large: the submission goes through without it
+            login(client, 'student0')
+            submit(client, assignment_id, image_bytes((10, 10)) + b'\x00' * 2000)
+            # Not an image at all
+            login(client, 'student1')
+            submit(client, assignment_id, b'<script>alert(1)</script>')
+    finally:
+        app.config['SCREENSHOT_MAX_BYTES'] = screenshots.MAX_UPLOAD_BYTES
+
+    with app.app_context():
+        assert Submission.query.count() == 2
+        assert {s.screenshot_filename for s in Submission.query} == {None}
+        # No half-written temporary files either
+        assert uploads() == []
+
+
+def test_undecodable_screenshot_is_dropped(assignment_id, login):
+    with app.test_client() as client:
+        login(client, 'student0')
+        # The right signature, but no image behind it
+        submit(client, assignment_id, b'\x89PNG\r\n\x1a\n' + b'\x00' * 64)
+
+    with app.app_context():
+        assert Submission.query.one().screenshot_filename is not None
+        run_pending_jobs()
+        assert Submission.query.one().screenshot_filename is None
+        assert not [name for name in uploads() if not name.endswith('.html')]
+
+
+def test_raw_upload_replaces_screenshot(assignment_id, login):
+    with app.test_client() as client:
+        login(client, 'student0')
+        submit(client, assignment_id, image_bytes((50, 50)))
+        with app.app_context():
+            submission_id = Submission.query.one().id
+            run_pending_jobs()
+            first = Submission.query.one().screenshot_filename
+
+        # A binary body without a Content-Length, as a server passes on a chunked upload
+        response = client.put(f'/submission/{submission_id}/screenshot',
+                              input_stream=io.BytesIO(image_bytes((60, 60), 'JPEG')),
+                              headers={'Content-Type': 'image/jpeg'},
+                              environ_overrides={'wsgi.input_terminated': True})
+        assert response.status_code == 201, response.get_data(as_text=True)
+        assert response.get_json()['screenshot'].endswith('.jpg')
+
+        app.config['SCREENSHOT_MAX_BYTES'] = 100
+        try:
+            # Refused from its Content-Length...
+            response = client.put(f'/submission/{submission_id}/screenshot', data=b'GIF89a' + b'\x00' * 200)
+            assert response.status_code == 413
+            # ...or once the streamed body passes the limit
+            response = client.put(f'/submission/{submission_id}/screenshot',
+                                  input_stream=io.BytesIO(b'GIF89a' + b'\x00' * 200),
+                                  environ_overrides={'wsgi.input_terminated': True})
+            assert response.status_code == 413
+        finally:
+            app.config['SCREENSHOT_MAX_BYTES'] = screenshots.MAX_UPLOAD_BYTES
+        response = client.put(f'/submission/{submission_id}/screenshot', data=b'plain text')
+        assert response.status_code == 415
+
+        login(client, 'student1')
+        response = client.put(f'/submission/{submission_id}/screenshot', data=image_bytes((10, 10)))
+        assert response.status_code == 403
+
+    with app.app_context():
+        # Deleted by a job once the replacement has committed
+        assert first in uploads()
+        run_pending_jobs()
+        assert first not in uploads()
+        current = Submission.query.one().screenshot_filename
+        assert current != first and current.endswith('.webp')
+        assert [name for name in uploads() if not name.endswith('.html')] == [current]
+
+
+def test_oversized_requests_are_refused_before_reading(assignment_id, login):
+    limit = app.config['MAX_CONTENT_LENGTH']
+    assert limit > app.config['SCREENSHOT_MAX_BYTES'] + app.config['MAX_FORM_MEMORY_SIZE']
+    app.config['MAX_CONTENT_LENGTH'] = 5000
+    try:
+        with app.test_client() as client:
+            login(client, 'student0')
+            response = client.post(f'/submit_html_assignment/{assignment_id}', data={
+                'content': WORKSHEET, 'screenshot': (io.BytesIO(image_bytes((10, 10)) + b'\x00' * 10000), 'big.png'),
+            }, content_type='multipart/form-data')
+            assert response.status_code == 302
+            assert response.headers['Location'].endswith(f'/view_assignment/{assignment_id}')
+            with client.session_transaction() as session:
+                assert 'too large' in session['_flashes'][-1][1]
+
+            submit(client, assignment_id)
+            with app.app_context():
+                submission_id = Submission.query.one().id
+            response = client.put(f'/submission/{submission_id}/screenshot', data=b'\x00' * 10000)
+            assert response.status_code == 413 and 'error' in response.get_json()
+    finally:
+        app.config['MAX_CONTENT_LENGTH'] = limit
+
+    with app.app_context():
+        assert Submission.query.one().screenshot_filename is None
+        assert not [name for name in uploads() if not name.endswith('.html')]
+
+
+def test_assignment_page_offers_screenshot_uploads(assignment_id, login):
+    with app.test_client() as client:
+        login(client, 'student0')
+        client.get('/student_dashboard')  # Shows the login flash
+        page = client.get(f'/view_assignment/{assignment_id}').get_data(as_text=True)
+        # Outside the hidden form, but submitted with it
+        assert 'form="submissionForm"' in page and 'name="screenshot"' in page
+
+        submit(client, assignment_id)
+        with app.app_context():
+            submission_id = Submission.query.one().id
+        client.get('/student_dashboard')
+        page = client.get(f'/view_assignment/{assignment_id}').get_data(as_text=True)
+        assert f'action="/submission/{submission_id}/screenshot"' in page
+        assert 'Attach a screenshot' in page
+
+        response = client.put(f'/submission/{submission_id}/screenshot', data=image_bytes((10, 10)))
+        assert response.status_code == 201
+        assert 'Replace your screenshot' in client.get(f'/view_assignment/{assignment_id}').get_data(as_text=True)
+
+        login(client, 'teacher')
+        client.post(f'/grade_submission/{submission_id}', data={'grade': '90', 'feedback': ''})
+        login(client, 'student0')
+        client.get('/student_dashboard')
+        assert 'screenshotUpload' not in client.get(f'/view_assignment/{assignment_id}').get_data(as_text=True)
+
+
+def test_thumbnails_are_made_on_first_request(assignment_id, login):
+    with app.test_client() as client:
+        login(client, 'student0')
+        submit(client, assignment_id, image_bytes((1600, 1200)))
+        with app.app_context():
+            run_pending_jobs()
+            submission_id, filename = Submission.query.with_entities(Submission.id, Submission.screenshot_filename).one()
+        assert os.listdir(app.config['THUMBNAIL_FOLDER']) == []
+
+        login(client, 'teacher')
+        page = client.get(f'/view_submissions/{assignment_id}').get_data(as_text=True)
+        url = f'/submission/{submission_id}/thumbnail/{filename}'
+        assert url in page
+
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.mimetype == 'image/webp'
+        assert 'private' in response.headers['Cache-Control']
+        thumbnail = Image.open(io.BytesIO(response.data))
+        assert thumbnail.width <= screenshots.THUMBNAIL_SIZE[0] and thumbnail.height <= screenshots.THUMBNAIL_SIZE[1]
+        assert len(response.data) < os.path.getsize(stored_path(filename))
+        assert os.listdir(app.config['THUMBNAIL_FOLDER']) == [screenshots.thumbnail_name(filename)]
+
+        # Only the submission's current screenshot has a thumbnail
+        assert client.get(f'/submission/{submission_id}/thumbnail/{"0" * 64}.png').status_code == 404
+        assert client.get(f'/submission/{submission_id + 1}/thumbnail/{filename}').status_code == 404
+
+        # Students only see their own
+        login(client, 'student1')
+        assert client.get(url).status_code == 403
+
@@ -0,0 +1,107 @@
+# Test SQLite WAL mode and the serialized writer under a burst of submissions
+import sqlite3
+import threading
+import time
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+import db_profile
+from app import app, db, Submission, db_writer
+
+DB_PATH = db_profile.sqlite_database_path(app.config['SQLALCHEMY_DATABASE_URI'])
+
+CLASS_SIZE = 40
+
+
+@pytest.fixture
+def assignment_id(classroom):
+    """An assignment allocated to CLASS_SIZE students"""
+    return classroom(students=CLASS_SIZE, title='Deadline', description='Due now').assignment_id
+
+
+def test_connections_use_wal_and_pragmas(database):
+    with app.app_context():
+        with db.engine.connect() as conn:
+            assert conn.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+            assert conn.execute(text('PRAGMA synchronous')).scalar() == 1  # NORMAL
+            assert conn.execute(text('PRAGMA busy_timeout')).scalar() == 5000
+    assert db_writer.enabled
+    assert db_writer.lock_path == DB_PATH + '.writelock'
+
+
+def test_simultaneous_submissions_all_succeed(assignment_id, login):
+    clients = []
+    for i in range(CLASS_SIZE):
+        client = app.test_client()
+        login(client, f'student{i}')
+        clients.append(client)
+
+    # An outside writer (another worker) holds the lock while the burst arrives
+    blocker = sqlite3.connect(DB_PATH, check_same_thread=False)
+    blocker.execute('BEGIN IMMEDIATE')
+    release = threading.Timer(0.5, blocker.commit)
+    release.start()
+
+    barrier = threading.Barrier(CLASS_SIZE)
+    statuses = [None] * CLASS_SIZE
+
+    def submit(i):
+        barrier.wait()
+        response = clients[i].post(f'/submit_html_assignment/{assignment_id}',
+                                   data={'content': f'<p>Answer from student {i}</p>'})
+        statuses[i] = (response.status_code, response.location)
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(CLASS_SIZE)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    release.join()
+    blocker.close()
+
+    assert all(status == (302, '/student_dashboard') for status in statuses), statuses
+    with app.app_context():
+        assert Submission.query.filter_by(assignment_id=assignment_id).count() == CLASS_SIZE
+
+
+def test_writer_retries_lock_errors():
+    writer = db_profile.SerializedWriter(backoff=0.001)
+    attempts = []
+
+    class Session:
+        commits = rollbacks = 0
+
+        def commit(self):
+            self.commits += 1
+
+        def rollback(self):
+            self.rollbacks += 1
+
+    def work():
+        attempts.append(time.perf_counter())
+        if len(attempts) < 3:
+            raise OperationalError('INSERT', {}, sqlite3.OperationalError('database is locked'))
+        return 'written'
+
+    session = Session()
+    assert writer.run(session, work) == 'written'
+    assert len(attempts) == 3
+    assert (session.commits, session.rollbacks) == (1, 2)
+
+    def broken():
+        raise OperationalError('INSERT', {}, sqlite3.OperationalError('no such table: submission'))
+
+    try:
+        writer.run(session, broken)
+        assert False, 'non-lock errors are not retried'
+    except OperationalError:
+        pass
+    assert session.rollbacks == 3
+
+
+def test_postgres_writes_are_not_serialized():
+    writer = db_profile.SerializedWriter.for_database('postgresql+psycopg2://u:p@host/db')
+    assert not writer.enabled
+    assert writer.lock_path is None
+
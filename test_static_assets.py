@@ -0,0 +1,84 @@
+# Test fingerprinted static assets and whitespace-trimmed pages
+import gzip
+import os
+import re
+import tempfile
+import time
+
+import assets
+from app import app, asset_fingerprints, variant_cache
+
+STATIC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+
+def test_pages_link_fingerprinted_assets(database):
+    with app.test_client() as client:
+        page = client.get('/login').get_data(as_text=True)
+    links = re.findall(r'(?:href|src)="(/assets/[^"]+)"', page)
+    assert sorted(links) == sorted([
+        f"/assets/css/base.{asset_fingerprints.fingerprint('css/base.css')}.css",
+        f"/assets/css/login.{asset_fingerprints.fingerprint('css/login.css')}.css",
+        f"/assets/js/base.{asset_fingerprints.fingerprint('js/base.js')}.js",
+        f"/assets/js/login.{asset_fingerprints.fingerprint('js/login.js')}.js",
+    ])
+    # Nothing is inlined any more, and template indentation is gone
+    assert '<style>' not in page and '<script>' not in page
+    assert not re.search(r'\n[ \t]+<', page)
+
+
+def test_assets_are_cached_for_a_year(database):
+    url = f"/assets/css/base.{asset_fingerprints.fingerprint('css/base.css')}.css"
+    with app.test_client() as client:
+        response = client.get(url)
+        assert response.status_code == 200 and response.mimetype == 'text/css'
+        assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+        with open(os.path.join(STATIC, 'css', 'base.css'), 'rb') as f:
+            assert response.data == f.read()
+        assert client.get(url, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+        # Compressed once, then kept with the worksheet variants
+        response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(response.data) == client.get(url).data
+        assert len(os.listdir(variant_cache.directory)) == 1
+
+        # A page rendered before an edit still gets the file, but must revalidate it
+        response = client.get('/assets/css/base.000000000000.css')
+        assert response.status_code == 200 and 'no-cache' in response.headers['Cache-Control']
+
+        assert client.get('/assets/css/base.css').status_code == 404
+        assert client.get('/assets/css/missing.000000000000.css').status_code == 404
+        assert client.get('/assets/../app.000000000000.py').status_code == 404
+
+
+def test_fingerprint_follows_edits():
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'site.css')
+    with open(path, 'w') as f:
+        f.write('body { color: black; }')
+    fingerprints = assets.Fingerprints(directory)
+    before = fingerprints.hashed_name('site.css')
+    assert fingerprints.resolve(before) == ('site.css', True)
+
+    with open(path, 'w') as f:
+        f.write('body { color: navy; }')
+    os.utime(path, ns=(time.time_ns(), time.time_ns() + 1_000_000_000))
+    after = fingerprints.hashed_name('site.css')
+    assert after != before and re.match(r'^site\.[0-9a-f]{12}\.css$', after)
+    assert fingerprints.resolve(before) == ('site.css', False)
+
+
+def test_static_files_have_no_template_syntax():
+    for directory, _, files in os.walk(STATIC):
+        for name in files:
+            with open(os.path.join(directory, name), encoding='utf-8') as f:
+                text = f.read()
+            assert '{{' not in text and '{%' not in text, name
+
+
+def test_minify_keeps_preformatted_text():
+    source = ('<div>\n    <p>One  two</p>\n    <pre>\n  kept\n</pre>\n'
+              '    <textarea>\n  also kept</textarea>\n    {{ _("a\n   b") }}\n</div>\n')
+    assert assets.minify_html(source) == ('<div>\n<p>One  two</p>\n<pre>\n  kept\n</pre>\n'
+                                          '<textarea>\n  also kept</textarea>\n{{ _("a\n   b") }}\n</div>\n')
+
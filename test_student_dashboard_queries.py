@@ -0,0 +1,80 @@
+# Test that the student dashboard loads in a fixed number of queries
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+from app import app, db, User, Assignment, Submission, get_student_dashboard_rows
+
+
+@pytest.fixture
+def student_with_assignments(classroom):
+    """Factory for a student with `count` assignments, some submitted; returns the student's id"""
+    def create(count):
+        teacher_id, _, (student_id,) = classroom(students=['student'], assignment=False)
+        with app.app_context():
+            student = db.session.get(User, student_id)
+            for i in range(count):
+                assignment = Assignment(
+                    title=f'Assignment {i}',
+                    description='x' * 500,
+                    created_by=teacher_id,
+                    due_date=datetime.utcnow() + timedelta(days=1 if i % 2 else -1),
+                    html_content='<html>' + 'y' * 1000 + '</html>'
+                )
+                db.session.add(assignment)
+                db.session.flush()
+                assignment.assigned_students.append(student)
+                if i % 3 == 0:
+                    db.session.add(Submission(assignment_id=assignment.id, student_id=student_id,
+                                              content='<html>answer</html>', grade=80.0 if i % 2 else None))
+            db.session.commit()
+        return student_id
+    return create
+
+
+def count_queries(func, *args):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        result = func(*args)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return result, statements
+
+
+def test_dashboard_query_count_is_constant(database, student_with_assignments):
+    for count in (5, 60):
+        database()
+        student_id = student_with_assignments(count)
+        with app.app_context():
+            rows, statements = count_queries(get_student_dashboard_rows, student_id)
+            assert len(rows) == count
+            assert len(statements) == 1, statements
+
+
+def test_dashboard_rows_are_compact_projection(student_with_assignments):
+    student_id = student_with_assignments(6)
+    with app.app_context():
+        rows = get_student_dashboard_rows(student_id)
+
+        submitted = [row for row in rows if row.submission_id]
+        assert len(submitted) == 2
+        assert all(row.due_state == 'submitted' for row in submitted)
+        assert {row.due_state for row in rows if not row.submission_id} == {'open', 'overdue'}
+        assert all(len(row.description) == 100 for row in rows)
+        assert not hasattr(rows[0], 'html_content')
+
+
+def test_student_dashboard_renders(student_with_assignments, login):
+    student_with_assignments(4)
+    with app.test_client() as client:
+        login(client, 'student')
+        response = client.get('/student_dashboard')
+        assert response.status_code == 200
+        assert b'Assignment 3' in response.data
+        assert b'Submitted' in response.data
+
@@ -0,0 +1,144 @@
+# Test the streamed, resumable ZIP download of an assignment's submissions
+import io
+import os
+import random
+import zipfile
+from datetime import datetime
+
+import pytest
+import zipstream
+from app import app, db, User, Assignment, Submission, archive_manifests, encode_submission_content
+
+WORKSHEET = '<html><body>' + ''.join(f'<p>Question {i}</p><input id="q{i}">\n' for i in range(200)) + '</body></html>'
+CLASS_SIZE = 120
+
+
+def test_zipstream_ranges():
+    datas = [os.urandom(random.randint(0, 50000)) for _ in range(10)]
+    entries = []
+    for i, data in enumerate(datas):
+        size, crc = zipstream.checksum([data])
+        entries.append(zipstream.Entry(f'dir/fïle{i}.bin', size, crc, datetime(2025, 3, 4, 5, 6, 7),
+                                       lambda data=data: (data[j:j + 4096] for j in range(0, len(data), 4096))))
+    whole = b''.join(zipstream.stream(entries))
+    assert len(whole) == zipstream.archive_size(entries)
+    with zipfile.ZipFile(io.BytesIO(whole)) as archive:
+        assert archive.testzip() is None
+        assert [archive.read(name) for name in archive.namelist()] == datas
+        assert archive.namelist()[1] == 'dir/fïle1.bin'
+    for _ in range(200):
+        start = random.randint(0, len(whole))
+        stop = random.randint(start, len(whole))
+        assert b''.join(zipstream.stream(entries, start, stop)) == whole[start:stop]
+
+
+@pytest.fixture
+def submitted_class(classroom):
+    """(assignment id, {submission id: document}) for CLASS_SIZE submissions, every tenth with a screenshot"""
+    teacher_id, assignment_id, student_ids = classroom(
+        students=[f'student {i}' for i in range(CLASS_SIZE)], allocate=False,
+        title='Quiz', description='', html_filename='q.html')
+    with app.app_context():
+        db.session.add(User(username='other', email='other@example.com', role='teacher',
+                            password_hash=db.session.get(User, teacher_id).password_hash))
+        assignment = db.session.get(Assignment, assignment_id)
+        assignment.set_html_content(WORKSHEET)
+        documents = {}
+        for i, student_id in enumerate(student_ids):
+            content = WORKSHEET.replace('<input id="q3">', f'<input id="q3" value="answer {i}">')
+            stored, base = encode_submission_content(content, assignment)
+            screenshot = None
+            if i % 10 == 0:
+                screenshot = f'screenshot_{assignment.id}_{student_id}_20250101.png'
+                with open(os.path.join(app.config['UPLOAD_FOLDER'], screenshot), 'wb') as f:
+                    f.write(b'\x89PNG' + bytes([i]) * 1000)
+            submission = Submission(assignment_id=assignment.id, student_id=student_id, stored_content=stored,
+                                    content_base_hash=base, screenshot_filename=screenshot,
+                                    submitted_at=datetime(2025, 5, 1, 12, 0))
+            db.session.add(submission)
+            db.session.flush()
+            documents[submission.id] = content
+        db.session.commit()
+        return assignment.id, documents
+
+
+def test_download_all_submissions(submitted_class, login):
+    assignment_id, documents = submitted_class
+    with app.test_client() as client:
+        login(client, 'teacher')
+        response = client.get(f'/assignment/{assignment_id}/submissions.zip')
+        assert response.status_code == 200 and response.is_streamed
+        assert response.headers['Accept-Ranges'] == 'bytes'
+        whole = response.data
+        assert int(response.headers['Content-Length']) == len(whole)
+        etag = response.headers['ETag']
+
+        with zipfile.ZipFile(io.BytesIO(whole)) as archive:
+            assert archive.testzip() is None
+            names = archive.namelist()
+            html = [n for n in names if n.endswith('.html')]
+            assert len(html) == CLASS_SIZE
+            for name in html:
+                submission_id = int(name[:-len('.html')].rsplit('_', 1)[1])
+                assert archive.read(name).decode('utf-8') == documents[submission_id]
+            assert len([n for n in names if n.startswith('screenshots/')]) == CLASS_SIZE // 10
+            assert html[0].startswith('student_0_')
+
+        # Resume from the middle, then an open-ended and a suffix range
+        middle = len(whole) // 2
+        response = client.get(f'/assignment/{assignment_id}/submissions.zip',
+                              headers={'Range': f'bytes={middle}-{middle + 9999}', 'If-Range': etag})
+        assert response.status_code == 206
+        assert response.headers['Content-Range'] == f'bytes {middle}-{middle + 9999}/{len(whole)}'
+        assert response.data == whole[middle:middle + 10000]
+        response = client.get(f'/assignment/{assignment_id}/submissions.zip', headers={'Range': f'bytes={middle}-'})
+        assert response.data == whole[middle:]
+        response = client.get(f'/assignment/{assignment_id}/submissions.zip', headers={'Range': 'bytes=-22'})
+        assert response.data == whole[-22:]
+
+        # A stale If-Range gets the whole archive; an impossible range is refused
+        response = client.get(f'/assignment/{assignment_id}/submissions.zip',
+                              headers={'Range': f'bytes={middle}-', 'If-Range': '"archive-old"'})
+        assert response.status_code == 200 and response.data == whole
+        response = client.get(f'/assignment/{assignment_id}/submissions.zip',
+                              headers={'Range': f'bytes={len(whole) + 10}-'})
+        assert response.status_code == 416
+
+    with app.test_client() as client:
+        login(client, 'other')
+        assert client.get(f'/assignment/{assignment_id}/submissions.zip').status_code == 302
+
+
+
+def test_deleted_students_are_left_out(submitted_class, login):
+    assignment_id, documents = submitted_class
+    with app.test_client() as client:
+        login(client, 'teacher')
+        etag = client.get(f'/assignment/{assignment_id}/submissions.zip').headers['ETag']
+        with app.app_context():
+            # Soft-deleted and waiting for the purge job
+            User.query.filter_by(username='student 0').one().deleted_at = datetime.utcnow()
+            db.session.commit()
+        response = client.get(f'/assignment/{assignment_id}/submissions.zip')
+        assert response.status_code == 200 and response.headers['ETag'] != etag
+        with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+            names = archive.namelist()
+    assert len([n for n in names if n.endswith('.html')]) == CLASS_SIZE - 1
+    assert not [n for n in names if 'student_0_' in n]
+
+
+def test_submission_purged_during_download_ends_the_stream(submitted_class, login):
+    assignment_id, documents = submitted_class
+    with app.test_client() as client:
+        login(client, 'teacher')
+        response = client.get(f'/assignment/{assignment_id}/submissions.zip', buffered=False)
+        etag = response.headers['ETag'].strip('"')
+        body = iter(response.response)
+        first = next(body)
+        with app.app_context():
+            Submission.query.filter_by(id=max(documents)).delete()
+            db.session.commit()
+        received = first + b''.join(body)
+        response.close()
+    assert len(received) < int(response.headers['Content-Length'])
+    assert archive_manifests.get(etag, lambda: None) is None
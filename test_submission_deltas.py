@@ -0,0 +1,128 @@
+# Test that submissions are stored as deltas against their worksheet and rebuilt exactly
+import io
+import os
+
+import pytest
+from PIL import Image
+from sqlalchemy.exc import OperationalError
+
+import app as app_module
+import migrations
+import template_delta
+from app import app, db, Assignment, Submission, template_cache, run_pending_jobs
+
+QUESTIONS = 40
+WORKSHEET = ('<!DOCTYPE html>\n<html lang="zh">\n<head>\n<meta charset="utf-8">\n<style>\n'
+             + 'body { font-family: sans-serif; }\n' * 200 + '</style>\n</head>\n<body>\n'
+             + ''.join(f'<div class="q">\n<p>第{i}題：閱讀下列短文並回答問題。{"這是一段很長的文章。" * 20}</p>\n'
+                       f'<input type="text" name="q{i}"><br>\n</div>\n' for i in range(QUESTIONS))
+             + '</body>\n</html>\n')
+
+
+def serialized_submission(answer):
+    # What XMLSerializer produces in the browser: XHTML void tags and value attributes
+    html = WORKSHEET.replace('<html lang="zh">', '<html xmlns="http://www.w3.org/1999/xhtml" lang="zh">')
+    html = html.replace('<meta charset="utf-8">', '<meta charset="utf-8" />').replace('<br>', '<br />')
+    for i in range(QUESTIONS):
+        html = html.replace(f'<input type="text" name="q{i}">', f'<input type="text" name="q{i}" value="{answer}{i}" />')
+    return html
+
+
+@pytest.fixture
+def worksheet(classroom, login):
+    """(assignment id, student id) of WORKSHEET uploaded by the teacher for student"""
+    _, _, (student_id,) = classroom(students=['student'], assignment=False)
+
+    with app.test_client() as client:
+        login(client, 'teacher')
+        client.post('/create_assignment', data={
+            'title': 'Reading', 'description': 'Read and answer', 'is_active': 'on',
+            'student_ids': [str(student_id)],
+            'html_file': (io.BytesIO(WORKSHEET.encode('utf-8')), 'reading.html'),
+        }, content_type='multipart/form-data')
+
+    with app.app_context():
+        return Assignment.query.one().id, student_id
+
+
+def test_delta_round_trip():
+    content = serialized_submission('答案')
+    delta = template_delta.encode(WORKSHEET, content)
+    assert delta is not None
+    assert template_delta.decode(WORKSHEET, delta) == content
+    assert len(delta) * 10 < len(content)
+    # Unrelated documents are kept in full
+    assert template_delta.encode(WORKSHEET, '<html><body>Something else</body></html>') is None
+
+
+def test_submit_stores_delta_and_views_rebuild_it(worksheet, login):
+    assignment_id, _ = worksheet
+    content = serialized_submission('A')
+
+    with app.test_client() as client:
+        login(client, 'student')
+        response = client.post(f'/submit_html_assignment/{assignment_id}', data={'content': content})
+        assert response.status_code == 302
+
+        with app.app_context():
+            submission = Submission.with_content().one()
+            assert submission.content_base_hash is not None
+            assert len(submission.stored_content) * 10 < len(content)
+            assert submission.content == content
+            submission_id = submission.id
+
+        response = client.get(f'/submission/{submission_id}/content')
+        assert response.get_data(as_text=True) == content
+
+    with app.test_client() as client:
+        login(client, 'teacher')
+        response = client.get(f'/view_submission_content/{submission_id}')
+        assert response.status_code == 200
+        assert 'value=&quot;A39&quot;' in response.get_data(as_text=True)
+
+
+def test_failed_encoding_is_reported_and_releases_the_screenshot(worksheet, login, monkeypatch):
+    assignment_id, _ = worksheet
+
+    def unavailable(content, assignment):
+        raise OperationalError('SELECT', {}, Exception('server closed the connection unexpectedly'))
+    monkeypatch.setattr(app_module, 'encode_submission_content', unavailable)
+
+    screenshot = io.BytesIO()
+    Image.new('RGB', (20, 20), 'red').save(screenshot, 'PNG')
+    with app.test_client() as client:
+        login(client, 'student')
+        response = client.post(f'/submit_html_assignment/{assignment_id}', data={
+            'content': serialized_submission('A'), 'screenshot': (io.BytesIO(screenshot.getvalue()), 'page.png'),
+        }, content_type='multipart/form-data')
+        assert response.status_code == 302
+        assert response.headers['Location'].endswith(f'/view_assignment/{assignment_id}')
+        with client.session_transaction() as session:
+            assert session['_flashes'][-1][1] == 'Failed to submit HTML assignment'
+
+    with app.app_context():
+        assert Submission.query.count() == 0
+        run_pending_jobs()
+    stored = [name for _, _, files in os.walk(app.config['UPLOAD_FOLDER']) for name in files]
+    assert stored and all(name.endswith('.html') for name in stored)
+
+
+def test_migration_converts_existing_rows(worksheet):
+    assignment_id, student_id = worksheet
+    content = serialized_submission('B')
+    with app.app_context():
+        # A row written before deltas existed
+        db.session.add(Submission(assignment_id=assignment_id, student_id=student_id, content=content))
+        db.session.commit()
+        assert Submission.with_content().one().content_base_hash is None
+
+        with db.engine.begin() as conn:
+            migrations.add_submission_deltas(conn)
+
+        db.session.expire_all()
+        template_cache._entries.clear()
+        submission = Submission.with_content().one()
+        assert submission.content_base_hash == Assignment.query.one().content_hash
+        assert len(submission.stored_content) * 10 < len(content)
+        assert submission.content == content
+
@@ -0,0 +1,66 @@
+# Test the on-demand submission preview endpoint used by view_submissions
+import gzip
+
+import pytest
+from app import app, db, Submission
+
+ANSWER = '<html><body><input value="42"> ' + 'answer text ' * 4000 + '</body></html>'
+
+
+@pytest.fixture
+def submission(classroom):
+    """(assignment id, submission id) of a long answer by student; other has the assignment too"""
+    _, assignment_id, (student_id, _) = classroom(students=['student', 'other'])
+    with app.app_context():
+        submission = Submission(assignment_id=assignment_id, student_id=student_id, content=ANSWER)
+        db.session.add(submission)
+        db.session.commit()
+        return assignment_id, submission.id
+
+
+def test_list_page_does_not_embed_content(submission, login):
+    assignment_id, submission_id = submission
+    with app.test_client() as client:
+        login(client, 'teacher')
+        response = client.get(f'/view_submissions/{assignment_id}')
+        assert response.status_code == 200
+        assert b'answer text' not in response.data
+        assert f'/submission/{submission_id}/content'.encode() in response.data
+        assert len(response.data) < len(ANSWER)
+
+
+def test_content_endpoint_supports_etag_and_gzip(submission, login):
+    _, submission_id = submission
+    with app.test_client() as client:
+        login(client, 'teacher')
+        url = f'/submission/{submission_id}/content'
+
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.get_data(as_text=True) == ANSWER
+        assert 'sandbox' in response.headers['Content-Security-Policy']
+        etag = response.headers['ETag']
+
+        response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(response.data).decode('utf-8') == ANSWER
+        assert len(response.data) < len(ANSWER) / 10
+
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+
+
+def test_content_endpoint_is_authorized(submission, login):
+    _, submission_id = submission
+    url = f'/submission/{submission_id}/content'
+
+    with app.test_client() as client:
+        assert client.get(url).status_code == 302
+        login(client, 'other')
+        assert client.get(url).status_code == 403
+
+    with app.test_client() as client:
+        login(client, 'student')
+        assert client.get(url).status_code == 200
+
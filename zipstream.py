@@ -0,0 +1,131 @@
+# ZIP archives generated on the fly, with byte ranges
+#
+# An archive is described by a manifest of Entry tuples (name, size, CRC-32,
+# modification time and a function returning the data). Entries are stored
+# uncompressed, so the size of every part of the archive, and therefore any byte
+# offset, is known from the manifest alone. stream() can then produce just the
+# bytes of a Range request, reading only the entries that overlap it, and the
+# output is identical on every worker. Zip64 records are added when the archive
+# outgrows the 4GB / 65535 entry limits of the classic format.
+import struct
+import zlib
+from collections import namedtuple
+
+CHUNK_SIZE = 64 * 1024
+
+# name: str; size and crc of the data; modified: datetime; read: callable -> iterable of bytes
+Entry = namedtuple('Entry', ['name', 'size', 'crc', 'modified', 'read'])
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+VERSION = 45  # 4.5: Zip64
+MADE_BY_UNIX = 3 << 8  # So the Unix file modes in the central directory are used
+UTF8_FLAG = 0x800
+
+
+def checksum(chunks):
+    """(size, crc) of data given as an iterable of bytes"""
+    size = crc = 0
+    for chunk in chunks:
+        size += len(chunk)
+        crc = zlib.crc32(chunk, crc)
+    return size, crc
+
+
+def file_chunks(path, chunk_size=CHUNK_SIZE):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _dos_time(modified):
+    year = min(max(modified.year, 1980), 2107)
+    return ((modified.hour << 11) | (modified.minute << 5) | (modified.second // 2),
+            ((year - 1980) << 9) | (modified.month << 5) | modified.day)
+
+
+def _local_header(entry, name):
+    time, date = _dos_time(entry.modified)
+    return struct.pack('<IHHHHHIIIHH', 0x04034B50, VERSION, UTF8_FLAG, 0, time, date,
+                       entry.crc, entry.size, entry.size, len(name), 0) + name
+
+
+def _central_header(entry, name, offset):
+    time, date = _dos_time(entry.modified)
+    extra = b''
+    if offset >= ZIP64_LIMIT:
+        extra = struct.pack('<HHQ', 0x0001, 8, offset)
+        offset = ZIP64_LIMIT
+    return struct.pack('<IHHHHHHIIIHHHHHII', 0x02014B50, MADE_BY_UNIX | VERSION, VERSION, UTF8_FLAG, 0, time, date,
+                       entry.crc, entry.size, entry.size, len(name), len(extra), 0, 0, 0, 0o100644 << 16,
+                       offset) + name + extra
+
+
+def _end_records(count, directory_offset, directory_size):
+    records = b''
+    zip64 = count >= ZIP64_COUNT_LIMIT or directory_offset >= ZIP64_LIMIT or directory_size >= ZIP64_LIMIT
+    if zip64:
+        end64_offset = directory_offset + directory_size
+        records += struct.pack('<IQHHIIQQQQ', 0x06064B50, 44, VERSION, VERSION, 0, 0,
+                               count, count, directory_size, directory_offset)
+        records += struct.pack('<IIQI', 0x07064B50, 0, end64_offset, 1)
+    return records + struct.pack('<IHHHHIIH', 0x06054B50, 0, 0,
+                                 min(count, ZIP64_COUNT_LIMIT), min(count, ZIP64_COUNT_LIMIT),
+                                 min(directory_size, ZIP64_LIMIT), min(directory_offset, ZIP64_LIMIT), 0)
+
+
+def _parts(entries):
+    """(length, bytes or Entry) for every part of the archive, in order"""
+    parts = []
+    offset = 0
+    directory = []
+    for entry in entries:
+        if entry.size >= ZIP64_LIMIT:
+            raise ValueError(f'{entry.name} is too large to store')
+        name = entry.name.encode('utf-8')
+        header = _local_header(entry, name)
+        parts.append((len(header), header))
+        parts.append((entry.size, entry))
+        directory.append(_central_header(entry, name, offset))
+        offset += len(header) + entry.size
+    directory = b''.join(directory)
+    parts.append((len(directory), directory))
+    end = _end_records(len(entries), offset, len(directory))
+    parts.append((len(end), end))
+    return parts
+
+
+def archive_size(entries):
+    return sum(length for length, _ in _parts(entries))
+
+
+def _entry_data(entry):
+    produced = 0
+    for chunk in entry.read():
+        produced += len(chunk)
+        yield chunk
+    if produced != entry.size:
+        raise ValueError(f'{entry.name} changed size while being archived')
+
+
+def stream(entries, start=0, stop=None):
+    """Bytes start..stop (exclusive) of the archive of `entries`, as chunks"""
+    position = 0
+    for length, part in _parts(entries):
+        if stop is not None and position >= stop:
+            return
+        end = position + length
+        if end <= start:
+            position = end
+            continue
+        chunks = [part] if isinstance(part, bytes) else _entry_data(part)
+        for chunk in chunks:
+            chunk_end = position + len(chunk)
+            if chunk_end > start:
+                yield chunk[max(start - position, 0):len(chunk) if stop is None else stop - position]
+            position = chunk_end
+            if stop is not None and position >= stop:
+                return